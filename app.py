@@ -1,13 +1,24 @@
 import os
+import hashlib
+import json
+import re
 import time
-from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, send_from_directory, g, jsonify
+import threading
+import unicodedata
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, send_from_directory, g, jsonify, has_app_context, has_request_context
+from jinja2 import nodes
+from jinja2.ext import Extension
 import sqlite3
 import random
+import secrets
+import string
 import uuid
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import date, datetime, timedelta
 from functools import wraps
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 # --- Login Helper: Map phone to email for Supabase Auth ---
 def map_identifier_to_email(identifier):
@@ -25,32 +36,23 @@ from urllib.parse import quote
 
 # --- Supabase Auth/Helper Functions ---
 import requests
+from supabase_client import get_supabase_client
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "documents")
+# Largest accepted request body; also the per-file cap for document uploads.
+MAX_UPLOAD_BYTES = max(1, int(os.getenv("DCONT_MAX_UPLOAD_MB", "16") or 16)) * 1024 * 1024
 
 def supabase_login(email: str, password: str):
-    url = f"{SUPABASE_URL}/auth/v1/token?grant_type=password"
-    headers = {"apikey": SUPABASE_ANON_KEY, "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json={"email": email, "password": password}, timeout=30)
-    return r
+    return get_supabase_client().login(email, password)
 
 def supabase_is_admin(user_id: str) -> bool:
-    url = f"{SUPABASE_URL}/rest/v1/profiles"
-    headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-    }
-    params = {"id": f"eq.{user_id}", "select": "is_admin"}
-    r = requests.get(url, headers=headers, params=params, timeout=30)
-    if not r.ok:
-        print("[ADMIN CHECK ERROR]", r.status_code, r.text)
-        return False
-    rows = r.json()
-    return bool(rows and rows[0].get("is_admin") is True)
+    return get_supabase_client().is_admin(user_id)
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-only-change-me")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 
 # --- /login route (Supabase Auth) ---
 "])
@@ -66,24 +68,10 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 def supabase_login(email: str, password: str):
-    url = f"{SUPABASE_URL}/auth/v1/token?grant_type=password"
-    headers = {"apikey": SUPABASE_ANON_KEY, "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json={"email": email, "password": password}, timeout=30)
-    return r
+    return get_supabase_client().login(email, password)
 
 def supabase_is_admin(user_id: str) -> bool:
-    url = f"{SUPABASE_URL}/rest/v1/profiles"
-    headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-    }
-    params = {"id": f"eq.{user_id}", "select": "is_admin"}
-    r = requests.get(url, headers=headers, params=params, timeout=30)
-    if not r.ok:
-        print("[ADMIN CHECK ERROR]", r.status_code, r.text)
-        return False
-    rows = r.json()
-    return bool(rows and rows[0].get("is_admin") is True)
+    return get_supabase_client().is_admin(user_id)
 
 # ...existing code...
 
@@ -95,11 +83,112 @@ def debug_session():
 
 # --- Document Upload Endpoint (Supabase Storage REST API) ---
 
-# --- Enhanced Upload: Store file in local DB for admin verification ---
+def _file_storage_size(file_storage):
+    """Size of an uploaded file without reading it; None if the stream can't seek."""
+    stream = file_storage.stream
+    try:
+        pos = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell() - pos
+        stream.seek(pos)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return size
+
+
+def _spool_upload(file_storage, dest_path: str):
+    """Copy an upload to disk in chunks; returns (sha256 hex digest, size).
+
+    Raises ValueError (and removes the partial file) past MAX_UPLOAD_BYTES.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"file too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+    return digest.hexdigest(), size
+
+
+def _remove_spool_file(spool_name: str) -> None:
+    try:
+        os.remove(os.path.join(UPLOAD_SPOOL_FOLDER, os.path.basename(spool_name or '')))
+    except OSError:
+        pass
+
+
+def _queue_document_upload(*, user_id: str, doc_type: str, file_storage):
+    """Spool the file, record its user_documents row and queue the Storage upload.
+
+    Returns (result, status); on success result is {"file_path", "row"} with the
+    inserted row(s) as PostgREST returned them. The `document_upload` job moves the
+    spooled file to Storage.
+    """
+    size = _file_storage_size(file_storage)
+    if size is not None and size > MAX_UPLOAD_BYTES:
+        return {"error": f"file too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"}, 413
+    filename = secure_filename(file_storage.filename)
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
+    unique = f"{uuid.uuid4().hex}.{ext}"
+    file_path = f"{user_id}/{int(datetime.utcnow().timestamp())}-{unique}"
+    content_type = file_storage.mimetype or "application/octet-stream"
+
+    os.makedirs(UPLOAD_SPOOL_FOLDER, exist_ok=True)
+    spool_name = unique
+    spool_path = os.path.join(UPLOAD_SPOOL_FOLDER, spool_name)
+    try:
+        sha256, size = _spool_upload(file_storage, spool_path)
+    except ValueError as e:
+        return {"error": str(e)}, 413
+
+    # The job is queued in this transaction and only committed once the row exists,
+    # so a failed insert leaves neither a job nor a stray spool file behind.
+    conn = get_db()
+    job_id = enqueue_job(conn, 'document_upload', {
+        "user_id": str(user_id),
+        "file_path": file_path,
+        "content_type": content_type,
+        "spool_name": spool_name,
+        "sha256": sha256,
+    }, idempotency_key=f"document_upload:{file_path}")
+    db_resp = get_supabase_client().insert("user_documents", {
+        "user_id": str(user_id),
+        "doc_type": doc_type,
+        "file_path": file_path,
+        "file_name": filename,
+        "content_type": content_type,
+        "status": "pending",
+        "created_at": datetime.utcnow().isoformat(),
+    })
+    print("[DB INSERT] Status:", db_resp.status_code)
+    if not db_resp.ok:
+        conn.rollback()
+        conn.close()
+        _remove_spool_file(spool_name)
+        print("[DB INSERT] Error:", db_resp.text)
+        return {"error": "db insert failed", "details": db_resp.text}, 500
+    conn.commit()
+    conn.close()
+    print(f"[UPLOAD] Queued job {job_id}: {SUPABASE_BUCKET}/{file_path} ({size} bytes, sha256 {sha256})")
+    return {"file_path": file_path, "row": db_resp.json()}, 200
+
 @app.route("/api/upload-document", methods=["POST"])
 def upload_document():
     print("[UPLOAD ENDPOINT CALLED]")
-    """Upload document to Supabase Storage and record metadata in user_documents table."""
+    """Record a user_documents row and queue the file for Supabase Storage (see `document_upload` job)."""
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         return jsonify({"error": "Supabase not configured"}), 500
     user_id = session.get("user_id")
@@ -112,53 +201,10 @@ def upload_document():
         return jsonify({"error": "user_id missing"}), 400
     if not f:
         return jsonify({"error": "file missing"}), 400
-    filename = secure_filename(f.filename)
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
-    unique = f"{uuid.uuid4()}.{ext}"
-    file_path = f"{user_id}/{int(datetime.utcnow().timestamp())}-{unique}"
-    file_bytes = f.read()
-    content_type = f.mimetype or "application/octet-stream"
-
-    # 1) Upload to Supabase Storage via REST
-    storage_url = f"{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{file_path}"
-    storage_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": content_type,
-        "x-upsert": "true",
-    }
-    storage_resp = requests.put(storage_url, headers=storage_headers, data=file_bytes)
-    print(f"[Supabase Storage] Upload URL: {storage_url}")
-    print(f"[STORAGE] Status: {storage_resp.status_code}")
-    print(f"[STORAGE] Body: {storage_resp.text}")
-    if not storage_resp.ok:
-        return jsonify({"error": "storage upload failed", "details": storage_resp.text}), 500
-    # Do NOT generate public_url if bucket is private. Only store file_path in DB.
-
-    # 2) Insert DB record via PostgREST (Supabase user_documents table)
-    db_url = f"{SUPABASE_URL}/rest/v1/user_documents"
-    db_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=representation"
-    }
-    db_payload = {
-        "user_id": str(user_id),
-        "doc_type": doc_type,
-        "file_path": file_path,
-        "file_name": filename,
-        "content_type": content_type,
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    db_resp = requests.post(db_url, headers=db_headers, json=db_payload)
-    print("[DB INSERT] Status:", db_resp.status_code)
-    print("[DB INSERT] Body:", db_resp.text)
-    if not db_resp.ok:
-        return jsonify({"error": db_resp.text}), 500
-
-    data = db_resp.json()
+    result, status = _queue_document_upload(user_id=user_id, doc_type=doc_type, file_storage=f)
+    if status != 200:
+        return jsonify(result), status
+    data = result["row"]
     doc = data[0] if isinstance(data, list) and data else data
     return jsonify({"ok": True, "document": doc}), 200
 
@@ -220,11 +266,20 @@ pass  # No longer needed; user management is now handled by Supabase Auth
 # Render's filesystem is ephemeral unless you attach a persistent disk.
 # You can override these paths via env vars to point at a persistent mount.
 DATABASE = os.environ.get('DCONT_DATABASE_PATH', os.path.join(BASE_DIR, 'users.db'))
+# If using a mounted disk path like /var/data/users.db on Render,
+# ensure the directory exists (once per process, not per connection).
+try:
+    if os.path.dirname(DATABASE):
+        os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
+except OSError:
+    pass
 # Store uploads outside /static by default so sensitive documents aren't publicly accessible.
 # Override with DCONT_UPLOAD_FOLDER if you want a mounted disk path (recommended in production).
 UPLOAD_FOLDER = os.environ.get('DCONT_UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Document uploads wait here until the document_upload job has pushed them to Storage.
+UPLOAD_SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, 'pending')
 
 # Demo admin identity (change these for your deployment)
 ADMIN_USERNAME = os.environ.get('DCONT_ADMIN_USERNAME', 'cyanmerc')
@@ -238,6 +293,18 @@ APP_FEE_CREDIT_EXPIRY_DAYS = 183  # ~6 months
 APP_FEE_CREDIT_MAX_APPLY_PER_MONTH = 30
 
 
+_APP_FEE_FOR_MONTH_SQL = 'SELECT gross_amount, credit_applied, net_amount FROM app_fee_payments WHERE username=? AND month=?'
+_APP_FEE_MONTH_TOTAL_SQL = 'SELECT COALESCE(SUM(COALESCE(net_amount,0)),0) FROM app_fee_payments WHERE month=?'
+_REFERRAL_CREDIT_AVAILABLE_SQL = """
+    SELECT COALESCE(SUM(COALESCE(credit_amount,0)),0)
+    FROM referrals
+    WHERE referrer_username=?
+      AND UPPER(COALESCE(status,''))='CREDITED'
+      AND COALESCE(credit_used,0)=0
+      AND COALESCE(credit_expires_at,'') > ?
+"""
+
+
 def _current_month_key() -> str:
     # YYYY-MM
     return date.today().strftime('%Y-%m')
@@ -260,17 +327,7 @@ def _available_app_fee_credit(conn: sqlite3.Connection, username: str) -> int:
     now = datetime.now().isoformat(timespec='seconds')
     c = conn.cursor()
     try:
-        c.execute(
-            """
-            SELECT COALESCE(SUM(COALESCE(credit_amount,0)),0)
-            FROM referrals
-            WHERE referrer_username=?
-              AND UPPER(COALESCE(status,''))='CREDITED'
-              AND COALESCE(credit_used,0)=0
-              AND COALESCE(credit_expires_at,'') > ?
-            """,
-            (uname, now),
-        )
+        c.execute(_REFERRAL_CREDIT_AVAILABLE_SQL, (uname, now))
         return int((c.fetchone() or [0])[0] or 0)
     except sqlite3.OperationalError:
         return 0
@@ -375,6 +432,7 @@ def _ensure_app_fee_current_month(conn: sqlite3.Connection, username: str) -> No
             c.execute("UPDATE users SET app_fee_paid=0 WHERE username=?", (uname,))
         except sqlite3.OperationalError:
             return
+        _forget_current_user()
 
 
 def _verify_app_fee_payment(conn: sqlite3.Connection, username: str) -> tuple[int, int, int, str]:
@@ -411,7 +469,7 @@ def _verify_app_fee_payment(conn: sqlite3.Connection, username: str) -> tuple[in
     # If already verified for this month, don't consume credits again.
     try:
         c.execute(
-            "SELECT gross_amount, credit_applied, net_amount FROM app_fee_payments WHERE username=? AND month=?",
+            _APP_FEE_FOR_MONTH_SQL,
             (uname, month_key),
         )
         existing = c.fetchone()
@@ -566,13 +624,18 @@ def _delete_user_and_related(conn: sqlite3.Connection, username: str) -> tuple[b
 
     # Clean references in groups (best-effort)
     try:
-        c.execute(
-            """
-            DELETE FROM group_members WHERE username=?;
-            DELETE FROM user_documents WHERE user_id=?;
-            """,
-            (uname, uname),
-        )
+        c.execute("SELECT DISTINCT group_id FROM group_members WHERE username=? AND status='joined'", (uname,))
+        joined_group_ids = [r[0] for r in c.fetchall()]
+        c.execute("DELETE FROM group_members WHERE username=?", (uname,))
+        _sync_group_joined_count(conn, joined_group_ids)
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute("DELETE FROM user_documents WHERE user_id=?", (uname,))
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute("SELECT COALESCE(mobile,'') FROM users WHERE username=?", (uname,))
         mrow = c.fetchone()
         mobile_val = (mrow[0] if mrow else '') or ''
         try:
@@ -587,6 +650,11 @@ def _delete_user_and_related(conn: sqlite3.Connection, username: str) -> tuple[b
     except sqlite3.OperationalError:
         pass
 
+    try:
+        c.execute("DELETE FROM trust_aggregates WHERE username=?", (uname,))
+    except sqlite3.OperationalError:
+        pass
+
     # Finally delete the user row
     try:
         c.execute("DELETE FROM users WHERE username=?", (uname,))
@@ -595,13 +663,11 @@ def _delete_user_and_related(conn: sqlite3.Connection, username: str) -> tuple[b
     except sqlite3.OperationalError:
         return (False, 'Unable to delete user right now.')
 
-    # Delete uploads (ignore errors)
-    for fn in files_to_delete:
+    # Delete uploads once the caller commits (ignore errors)
+    if files_to_delete:
         try:
-            path = os.path.join(app.config.get('UPLOAD_FOLDER') or UPLOAD_FOLDER, fn)
-            if os.path.isfile(path):
-                os.remove(path)
-        except OSError:
+            enqueue_job(conn, 'delete_upload_files', {'filenames': files_to_delete})
+        except sqlite3.OperationalError:
             pass
 
     return (True, 'User deleted.')
@@ -621,16 +687,17 @@ def _make_referral_code_from_user_id(user_id: int) -> str:
     return f"DC{uid:06d}"
 
 
+_HAS_JOINED_ANY_GROUP_SQL = "SELECT 1 FROM group_members WHERE username=? AND status='joined' LIMIT 1"
+_REFERRAL_BY_NEW_USER_SQL = "SELECT id, COALESCE(status,'') FROM referrals WHERE new_username=?"
+
+
 def _user_has_joined_any_group(conn: sqlite3.Connection, username: str) -> bool:
     uname = (username or '').strip()
     if not uname:
         return False
     c = conn.cursor()
     try:
-        c.execute(
-            "SELECT 1 FROM group_members WHERE username=? AND status='joined' LIMIT 1",
-            (uname,),
-        )
+        c.execute(_HAS_JOINED_ANY_GROUP_SQL, (uname,))
         return c.fetchone() is not None
     except sqlite3.OperationalError:
         return False
@@ -642,10 +709,7 @@ def _maybe_mark_referral_eligible(conn: sqlite3.Connection, new_username: str) -
         return
     c = conn.cursor()
     try:
-        c.execute(
-            "SELECT id, COALESCE(status,'') FROM referrals WHERE new_username=?",
-            (uname,),
-        )
+        c.execute(_REFERRAL_BY_NEW_USER_SQL, (uname,))
         row = c.fetchone()
     except sqlite3.OperationalError:
         row = None
@@ -700,15 +764,11 @@ def _get_user_language(username: str) -> str:
     username = (username or '').strip()
     if not username:
         return 'en'
-    conn = get_db()
-    c = conn.cursor()
     try:
-        c.execute('SELECT COALESCE(language,\'\') FROM users WHERE username=?', (username,))
-        row = c.fetchone()
+        user = get_user_row(username)
     except sqlite3.OperationalError:
-        row = None
-    conn.close()
-    return _normalize_lang(row[0] if row else '')
+        user = None
+    return _normalize_lang((user or {}).get('language') or '')
 
 
 @app.before_request
@@ -1117,22 +1177,75 @@ TRANSLATIONS = {
 }
 
 
-def t(key: str, **kwargs) -> str:
-    lang = _normalize_lang(getattr(g, 'lang', None) or session.get('lang') or 'en')
-    base = TRANSLATIONS.get('en', {})
-    table = TRANSLATIONS.get(lang, {})
-    text = table.get(key) or base.get(key) or key
-    try:
-        return text.format(**kwargs)
-    except Exception:
+# TRANSLATIONS is compiled once at import: each language becomes one flat dict with the
+# English fallbacks merged in, and strings without placeholders are pre-rendered, so a
+# lookup is a single dict access. Only strings with {fields} are formatted per call.
+def _compile_translations(translations: dict) -> tuple[dict, dict, dict]:
+    """Return (catalogs, format_fields, missing) keyed by language."""
+    formatter = string.Formatter()
+    base = translations.get('en', {})
+    catalogs, format_fields, missing = {}, {}, {}
+    for lang in SUPPORTED_LANGS:
+        table = translations.get(lang, {})
+        merged = {**base, **{k: v for k, v in table.items() if v}}
+        catalog, fields = {}, {}
+        for key, text in merged.items():
+            try:
+                names = {name for _, name, _, _ in formatter.parse(text) if name is not None}
+                if names:
+                    fields[key] = frozenset(names)
+                else:
+                    text = text.format()  # unescape {{ }}
+            except (ValueError, IndexError, KeyError):
+                pass  # malformed braces: shown as written, as before
+            catalog[key] = text
+        catalogs[lang] = catalog
+        format_fields[lang] = fields
+        missing[lang] = sorted(k for k in base if not table.get(k)) if lang != 'en' else []
+    return catalogs, format_fields, missing
+
+
+TRANSLATION_CATALOGS, _TRANSLATION_FIELDS, TRANSLATION_MISSING = _compile_translations(TRANSLATIONS)
+for _lang, _keys in TRANSLATION_MISSING.items():
+    if _keys:
+        app.logger.warning('Translations: %d key(s) fall back to English for %s', len(_keys), _lang)
+
+
+def get_translator(lang: str):
+    """t(key, **kwargs) bound to one language's compiled catalog."""
+    lang = _normalize_lang(lang)
+    catalog = TRANSLATION_CATALOGS[lang]
+    fields = _TRANSLATION_FIELDS[lang]
+
+    def translate(key: str, **kwargs) -> str:
+        text = catalog.get(key, key)
+        if key in fields:
+            try:
+                return text.format(**kwargs)
+            except (KeyError, IndexError, ValueError, AttributeError):
+                return text
         return text
 
+    return translate
+
+
+_TRANSLATORS = {lang: get_translator(lang) for lang in SUPPORTED_LANGS}
+
+
+def _request_lang() -> str:
+    return _normalize_lang(getattr(g, 'lang', None) or session.get('lang') or 'en')
+
+
+def t(key: str, **kwargs) -> str:
+    return _TRANSLATORS[_request_lang()](key, **kwargs)
+
 
 @app.context_processor
 def _inject_i18n():
+    lang = _request_lang()
     return {
-        't': t,
-        'current_lang': _normalize_lang(getattr(g, 'lang', None) or session.get('lang') or 'en'),
+        't': _TRANSLATORS[lang],
+        'current_lang': lang,
         'supported_langs': SUPPORTED_LANGS,
     }
 
@@ -1193,55 +1306,82 @@ ADVANCED_HANDOFF_KEYWORDS = [
     "complaint",
 ]
 
+ADVANCED_HANDOFF_KEYWORDS_HI = [
+    "dhokha",
+    "shikayat",
+    "paise wapas",
+    "galat person",
+    "otp nahi aa",
+    "number badal",
+    "धोखा",
+    "धोखाधड़ी",
+    "पुलिस",
+    "शिकायत",
+    "रिफंड",
+    "पैसे वापस",
+    "गलत व्यक्ति",
+    "ओटीपी नहीं",
+    "नंबर बदल",
+]
+
 
 FAQ_INTENTS = [
     {
         'key': 'what_is',
         'triggers': ["what is d-cont", "what is d cont", "about", "what is this", "d-cont"],
+        'triggers_hi': ["d-cont kya hai", "d cont kya hai", "ye kya hai", "डी-कॉन्ट क्या है", "यह क्या है"],
         'answer': "D-CONT is a non-custodial savings/group contribution helper. It helps groups coordinate contributions, but payments happen directly between members via UPI.",
     },
     {
         'key': 'non_custodial',
         'triggers': ["hold my money", "custodial", "does d-cont hold", "does d cont hold"],
+        'triggers_hi': ["paisa rakhta", "paise rakhta", "पैसा रखता", "पैसे रखता"],
         'answer': "No. D-CONT never holds money. You pay directly to the selected member via UPI.",
     },
     {
         'key': 'how_groups_work',
         'triggers': ["how do groups work", "group work", "rosca", "how it works"],
+        'triggers_hi': ["kaise kaam karta", "group kaise chalta", "कैसे काम करता", "ग्रुप कैसे चलता"],
         'answer': "You join a group with a fixed monthly amount. Each cycle, members contribute and one member receives, based on the group’s rules. D-CONT only helps track and coordinate—payments are member-to-member.",
     },
     {
         'key': 'join_group',
         'triggers': ["join group", "how do i join", "join"],
+        'triggers_hi': ["join kaise", "group me kaise jud", "ग्रुप में कैसे जुड़", "ग्रुप जॉइन", "जुड़ना"],
         'answer': "To join: open Home → choose ₹500 or ₹1000 → preview a group → add your UPI ID (required) → request to join. Your request will show as pending until approved.",
         'link': '/home',
     },
     {
         'key': 'pay_when_who',
         'triggers': ["when do i pay", "who do i pay", "pay to whom", "payment"],
+        'triggers_hi': ["kab pay", "kisko pay", "kisko paise", "कब भुगतान", "किसको भुगतान", "किसको पैसे"],
         'answer': "On the due date, the group shares the receiver details (name + UPI). You pay directly to that member using UPI. D-CONT does not take payments.",
     },
     {
         'key': 'receiver_selected',
         'triggers': ["receiver selected", "who gets", "how is the receiver", "selection"],
+        'triggers_hi': ["kisko milega", "receiver kaise", "किसको मिलेगा", "रिसीवर कैसे"],
         'answer': "Receiver selection depends on your group’s rules. If you’re unsure for your group, message support on WhatsApp and include the group name/amount.",
         'handoff': True,
     },
     {
         'key': 'missed_payment',
         'triggers': ["doesnt pay", "doesnt pay", "missed payment", "not paid"],
+        'triggers_hi': ["pay nahi kiya", "paise nahi diye", "भुगतान नहीं किया", "पैसे नहीं दिए"],
         'answer': "If someone misses a payment, avoid arguments in the group chat. For help handling missed contributions safely, contact support on WhatsApp.",
         'handoff': True,
     },
     {
         'key': 'paid_pending',
         'triggers': ["paid but", "shows pending", "paid pending", "pending"],
+        'triggers_hi': ["pay kar diya", "abhi bhi pending", "भुगतान कर दिया", "पेंडिंग"],
         'answer': "If you paid but it still shows pending: double-check you paid the correct receiver UPI and keep your UTR/reference ready. If it still doesn’t resolve, contact support on WhatsApp.",
         'handoff': True,
     },
     {
         'key': 'update_upi',
         'triggers': ["update upi", "change upi", "upi update", "upi id"],
+        'triggers_hi': ["upi badal", "upi change karna", "यूपीआई बदल", "यूपीआई आईडी"],
         'answer': "You can update your UPI ID from the Add UPI screen.",
         'link': '/add-upi',
     },
@@ -1259,6 +1399,7 @@ FAQ_INTENTS = [
             "transaction history",
             "open transaction history",
         ],
+        'triggers_hi': ["utr kaise", "proof kaise", "यूटीआर", "रसीद", "प्रूफ", "स्क्रीनशॉट"],
         'answer': (
             "To upload UTR/Proof: go to Payments tab → Transaction Records → Open Transaction History. "
             "Fill the form (Group optional, Amount, Paid Date, UTR/Transaction ID) and attach your proof file (optional), then tap Submit Record. "
@@ -1269,17 +1410,20 @@ FAQ_INTENTS = [
     {
         'key': 'leave_group',
         'triggers': ["leave group", "exit group", "remove me"],
+        'triggers_hi': ["group chhod", "group se nikal", "ग्रुप छोड़", "ग्रुप से निकल"],
         'answer': "Leaving a group may affect the cycle and other members. Please contact support on WhatsApp and we’ll guide you.",
         'handoff': True,
     },
     {
         'key': 'safety',
         'triggers': ["safety", "avoid scams", "tips", "safe"],
+        'triggers_hi': ["dhokhe se bach", "surakshit", "सुरक्षा", "सुरक्षित", "धोखे से बच"],
         'answer': "Safety tips: never share OTP/UPI PIN, verify receiver UPI ID before paying, and keep your UTR/reference. If anything feels suspicious, contact support on WhatsApp.",
     },
     {
         'key': 'contact',
         'triggers': ["contact", "support", "help", "talk to support", "whatsapp"],
+        'triggers_hi': ["madad", "baat karni", "मदद", "सहायता", "सपोर्ट", "बात करनी"],
         'answer': "This looks like something our team should handle. Tap below to chat on WhatsApp.",
         'handoff': True,
     },
@@ -1299,6 +1443,7 @@ FAQ_INTENTS = [
             "how to get d-cont app",
             "how to get d cont app",
         ],
+        'triggers_hi': ["app kaise download", "app install kaise", "ऐप डाउनलोड", "ऐप इंस्टॉल"],
         'answer': (
             "You can use D-CONT like an app without Play Store: "
             "Android (Chrome): open https://d-cont-web.onrender.com → tap ⋮ → Add to Home screen → Add (or tap ‘Install app’ if shown). "
@@ -1308,6 +1453,94 @@ FAQ_INTENTS = [
 ]
 
 
+# --- Support bot intent matching ---
+# Every trigger (English and Hindi) and handoff keyword is compiled once into a single
+# regex shaped like a trie of the phrases, so classifying a message is one scan whose
+# cost depends on the message, not on how many FAQs there are. Matching is by substring
+# after _normalize_bot_text(), as before; the intent with the longest matched trigger
+# wins, ties going to the earlier FAQ entry.
+def _normalize_bot_text(text: str) -> str:
+    text = unicodedata.normalize('NFC', text or '').lower()
+    text = text.replace('’', '').replace("'", '')
+    return ' '.join(text.split())
+
+
+def _phrase_trie(phrases) -> dict:
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[''] = phrase
+    return trie
+
+
+def _trie_pattern(node: dict) -> str:
+    """Regex for a trie node; greedy, so the longest phrase at a position wins."""
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        return f'(?:{body})?'
+    return body
+
+
+def build_intent_matcher(intents: list, handoff_keywords: list):
+    """Compile intents into classify(message) -> (intent or None, needs_handoff)."""
+    phrase_intents = {}
+    for idx, intent in enumerate(intents):
+        for trig in [*intent.get('triggers', []), *intent.get('triggers_hi', [])]:
+            phrase = _normalize_bot_text(trig)
+            if phrase:
+                phrase_intents.setdefault(phrase, set()).add(idx)
+    handoff_phrases = {p for p in map(_normalize_bot_text, handoff_keywords) if p}
+    trie = _phrase_trie(set(phrase_intents) | handoff_phrases)
+
+    # The scan reports only the longest phrase starting at each position, so fold every
+    # phrase contained in it into its entry: {intent index: longest trigger}, handoff.
+    hits = {}
+    for phrase in set(phrase_intents) | handoff_phrases:
+        best = {}
+        handoff = False
+        for start in range(len(phrase)):
+            node = trie
+            for ch in phrase[start:]:
+                node = node.get(ch)
+                if node is None:
+                    break
+                inner = node.get('')
+                if inner:
+                    for idx in phrase_intents.get(inner, ()):
+                        best[idx] = max(best.get(idx, 0), len(inner))
+                    handoff = handoff or inner in handoff_phrases
+        hits[phrase] = (tuple(best.items()), handoff)
+
+    scanner = re.compile(f'(?=({_trie_pattern(trie)}))') if trie else None
+
+    def classify(message: str):
+        text = _normalize_bot_text(message)
+        if not text or scanner is None:
+            return None, False
+        best = {}
+        handoff = False
+        for m in scanner.finditer(text):
+            phrase_best, phrase_handoff = hits[m.group(1)]
+            for idx, length in phrase_best:
+                if length > best.get(idx, 0):
+                    best[idx] = length
+            handoff = handoff or phrase_handoff
+        if not best:
+            return None, handoff
+        intent = intents[min(best, key=lambda idx: (-best[idx], idx))]
+        return intent, handoff or bool(intent.get('handoff'))
+
+    return classify
+
+
+classify_message = build_intent_matcher(FAQ_INTENTS, ADVANCED_HANDOFF_KEYWORDS + ADVANCED_HANDOFF_KEYWORDS_HI)
+
+
 def build_whatsapp_link(prefill_text: str) -> str:
     return f"https://wa.me/{WHATSAPP_SUPPORT_NUMBER}?text={quote(prefill_text)}"
 
@@ -1423,6 +1656,14 @@ def _parse_iso_date(value: str):
         return None
 
 
+def _trust_event_date(value):
+    """A trust event date: only a valid zero-padded YYYY-MM-DD, the same rule as _TRUST_COUNTS_SQL."""
+    v = (value or '').strip()
+    if not re.fullmatch(r'[0-9]{4}-[0-9]{2}-[0-9]{2}', v):
+        return None
+    return _parse_iso_date(v)
+
+
 def _today_iso() -> str:
     return date.today().isoformat()
 
@@ -1436,6 +1677,86 @@ def _get_trust_grace_days() -> int:
     return max(0, min(14, g))
 
 
+TRUST_COUNTER_FIELDS = (
+    'on_time',
+    'late',
+    'missed',
+    'rejected',
+    'completed_groups',
+    'deposit_verified',
+    'default_after_payout',
+)
+
+
+def _trust_event_counts(event_type: str, due_date, verified_at, grace_days: int) -> dict:
+    """Counter increments contributed by a single trust event."""
+    event_type = (event_type or '').strip().lower()
+    counts = dict.fromkeys(TRUST_COUNTER_FIELDS, 0)
+    if event_type == 'contribution_verified':
+        due = _trust_event_date(due_date)
+        verified = _trust_event_date(verified_at)
+        if due and verified:
+            if verified <= due:
+                counts['on_time'] += 1
+            else:
+                # After due date is late; after grace is missed too.
+                counts['late'] += 1
+                if (verified - due).days > grace_days:
+                    counts['missed'] += 1
+        else:
+            # If dates are missing, treat as late (minimal positive, avoids abuse)
+            counts['late'] += 1
+    elif event_type == 'contribution_rejected':
+        counts['rejected'] += 1
+    elif event_type == 'payment_missed':
+        counts['missed'] += 1
+    elif event_type == 'default_after_payout':
+        counts['default_after_payout'] += 1
+    elif event_type == 'deposit_verified':
+        counts['deposit_verified'] += 1
+    elif event_type == 'group_completed':
+        counts['completed_groups'] += 1
+    return counts
+
+
+def _trust_score_from_counts(counts: dict) -> int:
+    score = 50
+    score += 3 * int(counts.get('on_time') or 0)
+    score += 1 * int(counts.get('late') or 0)
+    score += 5 * int(counts.get('completed_groups') or 0)
+    score += 2 * int(counts.get('deposit_verified') or 0)
+    score -= 8 * int(counts.get('missed') or 0)
+    score -= 15 * int(counts.get('default_after_payout') or 0)
+    score -= 3 * int(counts.get('rejected') or 0)
+    return max(0, min(100, int(score)))
+
+
+def _trust_breakdown(counts: dict, grace_days: int) -> dict:
+    return {
+        'on_time_verified': int(counts.get('on_time') or 0),
+        'late_verified': int(counts.get('late') or 0),
+        'missed': int(counts.get('missed') or 0),
+        'rejected': int(counts.get('rejected') or 0),
+        'completed_groups': int(counts.get('completed_groups') or 0),
+        'deposit_verified': int(counts.get('deposit_verified') or 0),
+        'default_after_payout': int(counts.get('default_after_payout') or 0),
+        'grace_days': grace_days,
+    }
+
+
+def _trust_event_row_to_dict(row) -> dict:
+    event_id, event_type, group_id, due_date, verified_at, created_at, note = row
+    return {
+        'id': int(event_id),
+        'type': (event_type or '').strip().lower(),
+        'group_id': group_id,
+        'due_date': (due_date or ''),
+        'verified_at': (verified_at or ''),
+        'created_at': (created_at or ''),
+        'note': (note or ''),
+    }
+
+
 def calculate_trust_from_history(username: str) -> dict:
     """History-based (Option A) Trust Score.
 
@@ -1446,6 +1767,9 @@ def calculate_trust_from_history(username: str) -> dict:
     - default_after_payout
     - deposit_verified
     - group_completed
+
+    This walks the full event history; page loads should use get_trust_details(),
+    which reads the per-user trust_aggregates row instead.
     """
     username = (username or '').strip()
     if not username:
@@ -1470,100 +1794,218 @@ def calculate_trust_from_history(username: str) -> dict:
         rows = []
     conn.close()
 
-    on_time = 0
-    late = 0
-    missed = 0
-    rejected = 0
-    completed_groups = 0
-    deposit_verified = 0
-    default_after_payout = 0
-
+    counts = dict.fromkeys(TRUST_COUNTER_FIELDS, 0)
     events = []
-
-        print("[LOGIN] form:", dict(request.form))
-        print("[LOGIN] identifier:", repr(identifier), "is_digit:", identifier.isdigit())
-        print("[LOGIN] mpin_len:", len(mpin))
     for r in rows:
-        event_id, event_type, group_id, due_date, verified_at, created_at, note = r
-        event_type = (event_type or '').strip().lower()
-        due = _parse_iso_date(due_date)
-        verified = _parse_iso_date(verified_at)
-
-        if event_type == 'contribution_verified':
-            if due and verified:
-                if verified <= due:
-                    on_time += 1
-                else:
-                    # After due date is late; after grace is missed too.
-                    late += 1
-                    if (verified - due).days > grace_days:
-                        missed += 1
-            else:
+        for key, inc in _trust_event_counts(r[1], r[3], r[4], grace_days).items():
+            counts[key] += inc
+        events.append(_trust_event_row_to_dict(r))
 
-            print("[LOGIN] user found:", bool(user))
-            if user:
-                print("[LOGIN] user keys:", list(user.keys()))
-                print("[LOGIN] has mpin_hash:", bool(user.get("mpin_hash")))
-                # If dates are missing, treat as late (minimal positive, avoids abuse)
-                late += 1
-        elif event_type == 'contribution_rejected':
-            rejected += 1
-        elif event_type == 'payment_missed':
-            missed += 1
-        elif event_type == 'default_after_payout':
-            default_after_payout += 1
-        elif event_type == 'deposit_verified':
-            deposit_verified += 1
-        elif event_type == 'group_completed':
-            completed_groups += 1
+    return {
+        'score': _trust_score_from_counts(counts),
+        'breakdown': _trust_breakdown(counts, grace_days),
+        'events': events,
+    }
 
-        events.append(
-            {
-                'id': int(event_id),
-                'type': event_type,
-                'group_id': group_id,
-                'due_date': (due_date or ''),
-                'verified_at': (verified_at or ''),
-                'created_at': (created_at or ''),
-                'note': (note or ''),
-            }
+
+# Same classification as _trust_event_counts(), expressed as one grouped query so
+# aggregates can be rebuilt without pulling event rows into Python. Dates must be
+# real zero-padded YYYY-MM-DD dates (as _trust_event_date checks); anything else
+# counts as missing.
+_TRUST_COUNTS_SQL = """
+    SELECT username,
+           SUM(CASE WHEN et='contribution_verified' AND dd IS NOT NULL AND vd IS NOT NULL AND vd <= dd THEN 1 ELSE 0 END),
+           SUM(CASE WHEN et='contribution_verified' AND NOT (dd IS NOT NULL AND vd IS NOT NULL AND vd <= dd) THEN 1 ELSE 0 END),
+           SUM(CASE
+                   WHEN et='payment_missed' THEN 1
+                   WHEN et='contribution_verified' AND dd IS NOT NULL AND vd IS NOT NULL
+                        AND julianday(vd) - julianday(dd) > ? THEN 1
+                   ELSE 0
+               END),
+           SUM(CASE WHEN et='contribution_rejected' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN et='group_completed' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN et='deposit_verified' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN et='default_after_payout' THEN 1 ELSE 0 END),
+           MAX(id)
+    FROM (
+        SELECT id, username,
+               LOWER(TRIM(COALESCE(event_type,''))) AS et,
+               CASE WHEN date(julianday(TRIM(due_date)))=TRIM(due_date) THEN TRIM(due_date) END AS dd,
+               CASE WHEN date(julianday(TRIM(verified_at)))=TRIM(verified_at) THEN TRIM(verified_at) END AS vd
+        FROM trust_events
+        {where}
+    )
+    GROUP BY username
+"""
+
+
+def rebuild_trust_aggregates(conn: sqlite3.Connection, usernames=None, grace_days: int | None = None) -> dict:
+    """Recompute trust_aggregates (and users.trust_score) from trust_events.
+
+    With usernames=None every user is rebuilt. Counters come from one grouped
+    query; only aggregate rows and scores that actually changed are written.
+    Returns {username: score} for the rebuilt users. The caller commits.
+    """
+    if grace_days is None:
+        grace_days = _get_trust_grace_days()
+    c = conn.cursor()
+    cols = ', '.join(TRUST_COUNTER_FIELDS)
+    if usernames is None:
+        where, params = '', ()
+        c.execute('SELECT username, COALESCE(trust_score,50) FROM users')
+    else:
+        targets = sorted({(u or '').strip() for u in usernames if (u or '').strip()})
+        if not targets:
+            return {}
+        where, params = f"WHERE username IN ({','.join('?' for _ in targets)})", tuple(targets)
+        c.execute(f'SELECT username, COALESCE(trust_score,50) FROM users {where}', params)
+    current_scores = {r[0]: int(r[1]) for r in c.fetchall() if r[0]}
+
+    c.execute(f'SELECT username, {cols}, grace_days, last_event_id FROM trust_aggregates {where}', params)
+    current_aggs = {r[0]: tuple(r[1:]) for r in c.fetchall()}
+
+    c.execute(_TRUST_COUNTS_SQL.format(where=where), (grace_days, *params))
+    by_user = {}
+    for row in c.fetchall():
+        by_user[row[0]] = (dict(zip(TRUST_COUNTER_FIELDS, (int(v or 0) for v in row[1:8]))), row[8])
+    for username in (current_scores if usernames is None else targets):
+        by_user.setdefault(username, (dict.fromkeys(TRUST_COUNTER_FIELDS, 0), None))
+
+    now = datetime.now().isoformat(timespec='seconds')
+    agg_rows = []
+    score_rows = []
+    scores = {}
+    for username, (counts, last_event_id) in by_user.items():
+        score = _trust_score_from_counts(counts)
+        scores[username] = score
+        agg = (*(counts[k] for k in TRUST_COUNTER_FIELDS), grace_days, last_event_id)
+        if current_aggs.get(username) != agg:
+            agg_rows.append((username, *agg, now))
+        if username in current_scores and current_scores[username] != score:
+            score_rows.append((score, username))
+
+    if agg_rows:
+        c.executemany(
+            f"""
+            INSERT INTO trust_aggregates (username, {cols}, grace_days, last_event_id, updated_at)
+            VALUES ({','.join('?' for _ in range(len(TRUST_COUNTER_FIELDS) + 4))})
+            ON CONFLICT(username) DO UPDATE SET
+                {', '.join(f'{k}=excluded.{k}' for k in TRUST_COUNTER_FIELDS)},
+                grace_days=excluded.grace_days,
+                last_event_id=excluded.last_event_id,
+                updated_at=excluded.updated_at
+            """,
+            agg_rows,
         )
+    if score_rows:
+        c.executemany('UPDATE users SET trust_score=? WHERE username=?', score_rows)
+    return scores
 
-    score = 50
-    score += 3 * on_time
-    score += 1 * late
-    score += 5 * completed_groups
-    score += 2 * deposit_verified
-    score -= 8 * missed
-    score -= 15 * default_after_payout
-    score -= 3 * rejected
-    score = max(0, min(100, int(score)))
-
-    breakdown = {
-        'on_time_verified': on_time,
-        'late_verified': late,
-        'missed': missed,
-        'rejected': rejected,
-        'completed_groups': completed_groups,
-        'deposit_verified': deposit_verified,
-        'default_after_payout': default_after_payout,
-        'grace_days': grace_days,
+
+_TRUST_AGGREGATE_SQL = f'SELECT {", ".join(TRUST_COUNTER_FIELDS)}, grace_days FROM trust_aggregates WHERE username=?'
+
+
+def _read_trust_aggregate(c, username: str, grace_days: int):
+    """Counters for one user, or None if missing/stale (rebuild needed)."""
+    try:
+        c.execute(_TRUST_AGGREGATE_SQL, (username,))
+        row = c.fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if not row or row[-1] is None or int(row[-1]) != grace_days:
+        # Rows computed under a different grace period classify late payments differently.
+        return None
+    return dict(zip(TRUST_COUNTER_FIELDS, (int(v or 0) for v in row[:-1])))
+
+
+def record_trust_event(conn: sqlite3.Connection, username: str, event_id: int, event_type: str, due_date=None, verified_at=None) -> int:
+    """Fold a freshly inserted trust event into the user's aggregate row.
+
+    Call right after the INSERT INTO trust_events, on the same connection.
+    Returns the new score; the caller commits.
+    """
+    username = (username or '').strip()
+    grace_days = _get_trust_grace_days()
+    c = conn.cursor()
+    counts = _read_trust_aggregate(c, username, grace_days)
+    if counts is None:
+        # No row yet (or stale grace period): a full rebuild already includes this event.
+        return rebuild_trust_aggregates(conn, [username], grace_days=grace_days).get(username, 50)
+
+    deltas = _trust_event_counts(event_type, due_date, verified_at, grace_days)
+    for key, inc in deltas.items():
+        counts[key] += inc
+    score = _trust_score_from_counts(counts)
+    c.execute(
+        f"""
+        UPDATE trust_aggregates
+        SET {', '.join(f'{k}={k}+?' for k in TRUST_COUNTER_FIELDS)},
+            last_event_id=MAX(COALESCE(last_event_id,0), ?),
+            updated_at=?
+        WHERE username=?
+        """,
+        (
+            *(deltas[k] for k in TRUST_COUNTER_FIELDS),
+            int(event_id or 0),
+            datetime.now().isoformat(timespec='seconds'),
+            username,
+        ),
+    )
+    c.execute('UPDATE users SET trust_score=? WHERE username=?', (score, username))
+    return score
+
+
+_RECENT_TRUST_EVENTS_SQL = """
+    SELECT id, event_type, group_id, due_date, verified_at, created_at, note
+    FROM trust_events
+    WHERE username=?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+
+def get_trust_details(username: str, events_limit: int = 25) -> dict:
+    """Trust score + breakdown from trust_aggregates, plus the most recent events."""
+    username = (username or '').strip()
+    if not username:
+        return {'score': 50, 'breakdown': {}, 'events': []}
+
+    grace_days = _get_trust_grace_days()
+    conn = get_db()
+    c = conn.cursor()
+    counts = _read_trust_aggregate(c, username, grace_days)
+    if counts is None:
+        try:
+            rebuild_trust_aggregates(conn, [username], grace_days=grace_days)
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+        counts = _read_trust_aggregate(c, username, grace_days) or dict.fromkeys(TRUST_COUNTER_FIELDS, 0)
+
+    try:
+        c.execute(_RECENT_TRUST_EVENTS_SQL, (username, int(events_limit)))
+        events = [_trust_event_row_to_dict(r) for r in c.fetchall()]
+    except sqlite3.OperationalError:
+        events = []
+    conn.close()
+
+    return {
+        'score': _trust_score_from_counts(counts),
+        'breakdown': _trust_breakdown(counts, grace_days),
+        'events': events,
     }
-    return {'score': score, 'breakdown': breakdown, 'events': events}
 
 
 def recalculate_and_store_trust(username: str) -> dict:
-    result = calculate_trust_from_history(username)
-    score = int(result.get('score', 50))
+    """Rebuild one user's aggregate from full history and persist the score."""
     try:
         conn = get_db()
-        c = conn.cursor()
-        c.execute('UPDATE users SET trust_score=? WHERE username=?', (score, username))
+        rebuild_trust_aggregates(conn, [username])
         conn.commit()
         conn.close()
     except sqlite3.OperationalError:
         pass
-    return result
+    return get_trust_details(username)
 
 
 def _early_payout_deposit_amount(monthly_amount: int, trust_score: int) -> int:
@@ -1680,20 +2122,6 @@ def inject_support_links():
     }
 
 
-def message_needs_handoff(message: str) -> bool:
-    msg = (message or "").lower()
-    return any(k in msg for k in ADVANCED_HANDOFF_KEYWORDS)
-
-
-def match_intent(message: str):
-    msg = (message or "").strip().lower()
-    if not msg:
-        return None
-    for intent in FAQ_INTENTS:
-        for trig in intent.get('triggers', []):
-            if trig in msg:
-                return intent
-    return None
 
 USER_COLUMNS = {
     "username": "TEXT",
@@ -1796,29 +2224,32 @@ def _webauthn_expected_rp_id() -> str:
     return ''
 
 
+_CUSTOMER_BY_MOBILE_SQL = (
+    "SELECT username, role, is_active, mobile, mpin_hash, COALESCE(webauthn_credential_id,''), "
+    "COALESCE(webauthn_public_key,''), COALESCE(webauthn_sign_count,0) FROM users WHERE mobile_normalized=?"
+)
+_UNLINKED_CUSTOMERS_SQL = (
+    "SELECT username, role, is_active, mobile, mpin_hash, COALESCE(webauthn_credential_id,''), "
+    "COALESCE(webauthn_public_key,''), COALESCE(webauthn_sign_count,0) FROM users "
+    "WHERE mobile_normalized IS NULL AND COALESCE(mobile,'') != ''"
+)
+
+
 def _lookup_customer_candidates_by_mobile(conn: sqlite3.Connection, mobile_identifier: str):
-    identifier = (mobile_identifier or '').strip()
-    if not identifier:
+    identifier_digits = _normalize_mobile_digits(mobile_identifier)
+    if not identifier_digits:
         return []
     c = conn.cursor()
-    candidate_rows = []
     try:
-        for mobile_value in _mobile_candidates(identifier):
-            c.execute(
-                'SELECT username, role, is_active, mobile, mpin_hash, COALESCE(webauthn_credential_id,\'\'), COALESCE(webauthn_public_key,\'\'), COALESCE(webauthn_sign_count,0) FROM users WHERE mobile=?',
-                (mobile_value,),
-            )
-            candidate_rows.extend(c.fetchall() or [])
-
-        identifier_digits = _normalize_mobile_digits(identifier)
-        if identifier_digits:
-            c.execute(
-                'SELECT username, role, is_active, mobile, mpin_hash, COALESCE(webauthn_credential_id,\'\'), COALESCE(webauthn_public_key,\'\'), COALESCE(webauthn_sign_count,0) FROM users'
-            )
-            for cand in c.fetchall() or []:
-                cand_mobile = cand[3] if len(cand) > 3 else ''
-                if _normalize_mobile_digits(cand_mobile) == identifier_digits:
-                    candidate_rows.append(cand)
+        # mobile_normalized is set by the app's write paths and uniquely indexed.
+        c.execute(_CUSTOMER_BY_MOBILE_SQL, (identifier_digits,))
+        candidate_rows = c.fetchall() or []
+        if not candidate_rows:
+            # Rows written outside the app stay unlinked until `flask mobiles-relink`.
+            c.execute(_UNLINKED_CUSTOMERS_SQL)
+            candidate_rows = [
+                row for row in c.fetchall() if _normalize_mobile_digits(row[3]) == identifier_digits
+            ]
     except sqlite3.OperationalError:
         candidate_rows = []
 
@@ -1837,18 +2268,13 @@ def _lookup_customer_candidates_by_mobile(conn: sqlite3.Connection, mobile_ident
 def is_user_active(username: str) -> bool:
     if not username:
         return False
-    conn = get_db()
-    c = conn.cursor()
     try:
-        c.execute('SELECT is_active FROM users WHERE username=?', (username,))
-        row = c.fetchone()
+        user = get_user_row(username)
     except sqlite3.OperationalError:
-        conn.close()
         return True
-    conn.close()
-    if not row:
+    if not user:
         return False
-    return int(row[0] if row[0] is not None else 1) == 1
+    return int(user.get('is_active', 1)) == 1
 
 
 def enforce_active_session():
@@ -1890,11 +2316,37 @@ def admin_required(fn):
 
 
 def get_user_row(username):
-    conn, c = get_db()
-    c.execute(
-        'SELECT username, full_name, mobile, language, city_state, email, role, upi_id, onboarding_completed, app_fee_paid, app_fee_paid_month, first_app_fee_verified, trust_score, join_blocked, is_active FROM users WHERE username=?',
-        (username,),
-    )
+    """User columns as a dict (None if missing).
+
+    The logged-in user's row is loaded once per request and kept on flask.g, so the
+    context processor, session checks and views share a single query.
+    """
+    if has_request_context() and username and username == session.get('username'):
+        cached = g.get('_current_user')
+        if cached is None or cached[0] != username:
+            cached = (username, _load_user_row(username))
+            g._current_user = cached
+        return dict(cached[1]) if cached[1] is not None else None
+    return _load_user_row(username)
+
+
+def _forget_current_user() -> None:
+    """Drop the per-request user row after writing to it."""
+    if has_app_context():
+        g.pop('_current_user', None)
+
+
+_USER_ROW_SQL = (
+    'SELECT username, full_name, mobile, language, city_state, email, role, upi_id, onboarding_completed, '
+    'app_fee_paid, app_fee_paid_month, first_app_fee_verified, trust_score, join_blocked, is_active '
+    'FROM users WHERE username=?'
+)
+
+
+def _load_user_row(username):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(_USER_ROW_SQL, (username,))
     row = c.fetchone()
     conn.close()
     if not row:
@@ -1943,6 +2395,25 @@ def _save_proof_upload(file_storage, username: str) -> str:
     return out_name
 
 
+_USER_TRANSACTIONS_SQL = """
+    SELECT t.id,
+           COALESCE(t.group_id,0),
+           COALESCE(g.name,''),
+           COALESCE(t.amount,0),
+           COALESCE(t.paid_at,''),
+           COALESCE(t.utr,''),
+           COALESCE(t.note,''),
+           COALESCE(t.proof_file,''),
+           COALESCE(t.status,'pending'),
+           COALESCE(t.created_at,'')
+    FROM transactions t
+    LEFT JOIN groups g ON g.id = t.group_id
+    WHERE t.username=?
+    ORDER BY COALESCE(t.paid_at,'' ) DESC, t.id DESC
+    LIMIT ?
+"""
+
+
 def _fetch_user_transactions(conn: sqlite3.Connection, username: str, limit: int = 200):
     uname = (username or '').strip()
     if not uname:
@@ -1955,26 +2426,7 @@ def _fetch_user_transactions(conn: sqlite3.Connection, username: str, limit: int
 
     c = conn.cursor()
     try:
-        c.execute(
-            """
-            SELECT t.id,
-                   COALESCE(t.group_id,0),
-                   COALESCE(g.name,''),
-                   COALESCE(t.amount,0),
-                   COALESCE(t.paid_at,''),
-                   COALESCE(t.utr,''),
-                   COALESCE(t.note,''),
-                   COALESCE(t.proof_file,''),
-                   COALESCE(t.status,'pending'),
-                   COALESCE(t.created_at,'')
-            FROM transactions t
-            LEFT JOIN groups g ON g.id = t.group_id
-            WHERE t.username=?
-            ORDER BY COALESCE(t.paid_at,'' ) DESC, t.id DESC
-            LIMIT ?
-            """,
-            (uname, lim),
-        )
+        c.execute(_USER_TRANSACTIONS_SQL, (uname, lim))
         rows = c.fetchall() or []
     except sqlite3.OperationalError:
         return []
@@ -2033,6 +2485,78 @@ def require_customer(fn):
     return wrapper
 
 
+# --- Conditional GET ---
+# Read-mostly customer pages send a weak ETag and answer a matching If-None-Match with
+# 304 before the view runs any of its queries. The tag covers the data versions the
+# page reads (see data_version(); 'user' is the signed-in user's own rows, 'referred'
+# the users they referred) plus everything else that shapes the HTML: user, role,
+# language, pay badge, settings, asset version and the current hour (for dates and
+# credit expiry).
+PAGE_CACHE_CONTROL = 'private, no-cache'
+
+
+_REFERRED_USERS_VERSION_SQL = """
+    SELECT COALESCE(SUM(v.version), 0)
+    FROM referrals r
+    JOIN data_versions v ON v.scope = 'user:' || r.new_username
+    WHERE r.referrer_username=?
+"""
+
+
+def _referred_users_version(username: str) -> int:
+    # Versions only grow, so the sum moves whenever any of them does; adding or removing
+    # a referral bumps the referrer's own version instead.
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute(_REFERRED_USERS_VERSION_SQL, (username,))
+        total = int((c.fetchone() or [0])[0] or 0)
+    except sqlite3.OperationalError:
+        total = 0
+    conn.close()
+    return total
+
+
+def page_etag(scopes, username: str) -> str:
+    tables = [f'user:{username}' if scope == 'user' else scope for scope in scopes if scope != 'referred']
+    parts = [
+        username,
+        session.get('role') or '',
+        _request_lang(),
+        session.get('nav_pay_badge') or '',
+        settings_version(),
+        ASSET_VERSION,
+        datetime.now().strftime('%Y-%m-%dT%H'),
+        data_version(*tables),
+        str(_referred_users_version(username)) if 'referred' in scopes else '',
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def conditional_page(*scopes: str):
+    """Tag GET responses with page_etag(scopes); 304 when the client's copy is current."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # A pending flash is shown once, so that render must never be revalidated.
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return fn(*args, **kwargs)
+            etag = page_etag(scopes, session.get('username') or '')
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def _json_error_response(message: str, status_code: int):
     try:
         return jsonify({'error': message}), status_code
@@ -2083,6 +2607,16 @@ def _handle_404(err):
     return err
 
 
+@app.errorhandler(413)
+def _handle_413(err):
+    # Raised before the body is read when it exceeds MAX_CONTENT_LENGTH.
+    limit_mb = MAX_UPLOAD_BYTES // (1024 * 1024)
+    if _request_wants_json() or (request.path or '').startswith('/api/'):
+        return _json_error_response(f'File too large (max {limit_mb} MB).', 413)
+    flash(f'File too large. Please upload a file under {limit_mb} MB.')
+    return redirect(request.referrer or url_for('home'))
+
+
 @app.errorhandler(500)
 def _handle_500(err):
     if _request_wants_json():
@@ -2090,10 +2624,13 @@ def _handle_500(err):
     return err
 
 
+_MEMBERSHIP_SQL = 'SELECT id, status FROM group_members WHERE group_id=? AND username=?'
+
+
 def join_group_with_status(group_id, username, status="joined"):
     conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT id, status FROM group_members WHERE group_id=? AND username=?', (group_id, username))
+    c.execute(_MEMBERSHIP_SQL, (group_id, username))
     existing = c.fetchone()
     if existing:
         conn.close()
@@ -2101,21 +2638,47 @@ def join_group_with_status(group_id, username, status="joined"):
 
     c.execute('INSERT INTO group_members (group_id, username, status) VALUES (?, ?, ?)', (group_id, username, status))
 
-    # If this join completes the group, auto-activate it and schedule the first due date.
+    # If this join completes the group, the group_cycle job activates it and schedules
+    # the first due date.
     if (status or '').strip().lower() == 'joined':
-        _maybe_activate_group(conn, group_id)
+        _sync_group_joined_count(conn, [group_id])
+        _queue_group_activation(conn)
 
     conn.commit()
     conn.close()
     return status
 
 
+_SYNC_JOINED_COUNT_SQL = """
+    UPDATE groups
+    SET joined_count=(
+        SELECT COUNT(1) FROM group_members gm WHERE gm.group_id=groups.id AND gm.status='joined'
+    )
+    WHERE id IN ({ids})
+"""
+
+
+def _sync_group_joined_count(conn: sqlite3.Connection, group_ids) -> None:
+    """Recount joined members into groups.joined_count for the given groups.
+
+    Call on the connection that changed group_members, before it commits, so the
+    counter moves in the same transaction as the membership.
+    """
+    ids = sorted({int(gid) for gid in (group_ids or []) if gid})
+    if not ids:
+        return
+    c = conn.cursor()
+    c.execute(_SYNC_JOINED_COUNT_SQL.format(ids=','.join('?' for _ in ids)), ids)
+
+
 DEFAULT_PAY_CUTOFF_TIME = '15:00'  # 3 PM
 
 
 def _maybe_activate_group(conn, group_id) -> bool:
     """Auto-activate the group once it reaches max members.
 
+    Used by the activate_full_groups migration; live activation is run_group_cycle().
+
     Rule:
     - When max_members (default 10) have status='joined', group becomes active.
     - First payment due date is exactly 30 days after the join that completes the group.
@@ -2206,37 +2769,6 @@ def _maybe_activate_group(conn, group_id) -> bool:
     return True
 
 
-def _mobile_candidates(raw: str):
-    raw = (raw or '').strip()
-    candidates = []
-    if raw:
-        candidates.append(raw)
-
-    digits = re.sub(r'\D+', '', raw)
-    if digits:
-        candidates.append(digits)
-
-        if digits.startswith('91') and len(digits) == 12:
-            candidates.append(digits[2:])
-            candidates.append('+91' + digits[2:])
-
-        if digits.startswith('0') and len(digits) == 11:
-            candidates.append(digits[1:])
-
-        if len(digits) == 10:
-            candidates.append('91' + digits)
-            candidates.append('+91' + digits)
-
-    # Deduplicate, preserve order
-    deduped = []
-    seen = set()
-    for value in candidates:
-        if value and value not in seen:
-            seen.add(value)
-            deduped.append(value)
-    return deduped
-
-
 def _normalize_mobile_digits(raw: str) -> str:
     raw = (raw or '').strip()
     digits = re.sub(r'\D+', '', raw)
@@ -2252,6 +2784,27 @@ def _normalize_mobile_digits(raw: str) -> str:
     return digits
 
 
+def _normalize_mobile_or_null(raw):
+    """users.mobile_normalized for a stored mobile: the Python rule, '' -> NULL."""
+    if raw is None:
+        return None
+    return _normalize_mobile_digits(str(raw)) or None
+
+
+def _set_user_mobile_normalized(c, user_id: int) -> None:
+    """Recompute one user's mobile_normalized; call after writing users.mobile."""
+    if 'mobile_normalized' not in _table_columns(c, 'users'):
+        return  # Before migration 9, which backfills every row.
+    c.execute('SELECT mobile FROM users WHERE id=?', (user_id,))
+    row = c.fetchone()
+    key = _normalize_mobile_or_null(row[0]) if row else None
+    try:
+        c.execute('UPDATE users SET mobile_normalized=? WHERE id=?', (key, user_id))
+    except sqlite3.IntegrityError:
+        # The number is already linked to another account; leave this one unlinked.
+        c.execute('UPDATE users SET mobile_normalized=NULL WHERE id=?', (user_id,))
+
+
 def _password_matches(stored_pw: str, provided_pw: str) -> bool:
     stored_pw = stored_pw or ''
     provided_pw = provided_pw or ''
@@ -2269,6 +2822,72 @@ def _password_matches(stored_pw: str, provided_pw: str) -> bool:
 AUTH_RATE_LIMIT_WINDOW_SECONDS = 15 * 60
 AUTH_RATE_LIMIT_MAX_PASSWORD = 10
 AUTH_RATE_LIMIT_MAX_MPIN = 8
+# 'sqlite' (the default) shares failed-attempt windows between workers and restarts
+# through auth_attempts. 'memory' keeps them per process, so with N workers an attacker
+# gets N times the attempts; only use it for single-process development.
+AUTH_RATE_LIMIT_BACKEND = (os.environ.get('DCONT_AUTH_RATE_LIMIT_BACKEND') or 'sqlite').strip().lower()
+AUTH_RATE_LIMIT_MAX_KEYS = max(100, int(os.environ.get('DCONT_AUTH_RATE_LIMIT_MAX_KEYS', '10000') or 10000))
+AUTH_ATTEMPTS_RETENTION_DAYS = 7
+AUTH_ATTEMPTS_PRUNE_INTERVAL_SECONDS = 60 * 60
+_AUTH_FAILURES_BY_IP_SQL = 'SELECT COUNT(1) FROM auth_attempts WHERE method=? AND success=0 AND ip=? AND created_at>=?'
+_AUTH_FAILURES_BY_IDENTIFIER_SQL = (
+    'SELECT COUNT(1) FROM auth_attempts WHERE method=? AND success=0 AND identifier=? AND created_at>=?'
+)
+_AUTH_PRUNE_SQL = 'DELETE FROM auth_attempts WHERE created_at < ?'
+
+
+class _SlidingWindowCounter:
+    """Per-key timestamps of recent events, bounded in keys (LRU) and per key."""
+
+    def __init__(self, window_seconds: float, max_keys: int, max_per_key: int):
+        self.window_seconds = float(window_seconds)
+        self.max_keys = int(max_keys)
+        self.max_per_key = int(max_per_key)
+        self._hits: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _trim(self, key, now: float):
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        cutoff = now - self.window_seconds
+        while hits and hits[0] < cutoff:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def count(self, key, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hits = self._trim(key, now)
+            return len(hits) if hits else 0
+
+    def add(self, key, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hits = self._trim(key, now)
+            if hits is None:
+                # Only the newest max_per_key hits matter for a threshold check.
+                hits = self._hits[key] = deque(maxlen=self.max_per_key)
+            hits.append(now)
+            self._hits.move_to_end(key)
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hits.clear()
+
+
+_auth_failures = _SlidingWindowCounter(
+    AUTH_RATE_LIMIT_WINDOW_SECONDS,
+    AUTH_RATE_LIMIT_MAX_KEYS,
+    max(AUTH_RATE_LIMIT_MAX_PASSWORD, AUTH_RATE_LIMIT_MAX_MPIN),
+)
+_auth_prune_state = {'last': 0.0}
+_auth_prune_lock = threading.Lock()
 
 
 def _client_ip() -> str:
@@ -2300,9 +2919,13 @@ def _auth_is_rate_limited(method: str, identifier: str, ip: str) -> bool:
     if not method or (not ident and not ip):
         return False
 
-    cutoff = (datetime.now() - timedelta(seconds=AUTH_RATE_LIMIT_WINDOW_SECONDS)).isoformat(timespec='seconds')
     max_attempts = AUTH_RATE_LIMIT_MAX_MPIN if method == 'mpin' else AUTH_RATE_LIMIT_MAX_PASSWORD
+    if AUTH_RATE_LIMIT_BACKEND == 'memory':
+        ip_count = _auth_failures.count((method, 'ip', ip)) if ip else 0
+        ident_count = _auth_failures.count((method, 'id', ident)) if ident else 0
+        return max(ip_count, ident_count) >= max_attempts
 
+    cutoff = (datetime.now() - timedelta(seconds=AUTH_RATE_LIMIT_WINDOW_SECONDS)).isoformat(timespec='seconds')
     conn = get_db()
     c = conn.cursor()
     try:
@@ -2310,18 +2933,12 @@ def _auth_is_rate_limited(method: str, identifier: str, ip: str) -> bool:
         ident_count = 0
 
         if ip:
-            c.execute(
-                "SELECT COUNT(1) FROM auth_attempts WHERE method=? AND success=0 AND ip=? AND created_at>=?",
-                (method, ip, cutoff),
-            )
+            c.execute(_AUTH_FAILURES_BY_IP_SQL, (method, ip, cutoff))
             row = c.fetchone()
             ip_count = int(row[0] or 0) if row else 0
 
         if ident:
-            c.execute(
-                "SELECT COUNT(1) FROM auth_attempts WHERE method=? AND success=0 AND identifier=? AND created_at>=?",
-                (method, ident, cutoff),
-            )
+            c.execute(_AUTH_FAILURES_BY_IDENTIFIER_SQL, (method, ident, cutoff))
             row = c.fetchone()
             ident_count = int(row[0] or 0) if row else 0
 
@@ -2339,8 +2956,16 @@ def _auth_record_attempt(method: str, identifier: str, ip: str, success: bool) -
 
     ident = _auth_normalize_identifier(method, identifier)
     ip = (ip or '').strip()
-    now = datetime.now().isoformat(timespec='seconds')
+    if AUTH_RATE_LIMIT_BACKEND == 'memory':
+        # Only failures count towards the limit.
+        if not success:
+            if ip:
+                _auth_failures.add((method, 'ip', ip))
+            if ident:
+                _auth_failures.add((method, 'id', ident))
+        return
 
+    now = datetime.now().isoformat(timespec='seconds')
     conn = get_db()
     c = conn.cursor()
     try:
@@ -2348,13 +2973,32 @@ def _auth_record_attempt(method: str, identifier: str, ip: str, success: bool) -
             "INSERT INTO auth_attempts (method, identifier, ip, success, created_at) VALUES (?,?,?,?,?)",
             (method, ident, ip, 1 if success else 0, now),
         )
-
-        cleanup_cutoff = (datetime.now() - timedelta(days=7)).isoformat(timespec='seconds')
-        c.execute("DELETE FROM auth_attempts WHERE created_at < ?", (cleanup_cutoff,))
         conn.commit()
     except sqlite3.OperationalError:
         pass
     conn.close()
+    _auth_prune_attempts()
+
+
+def _auth_prune_attempts(force: bool = False) -> int:
+    """Drop old auth_attempts rows, at most once per prune interval per worker."""
+    now = time.monotonic()
+    with _auth_prune_lock:
+        if not force and now - _auth_prune_state['last'] < AUTH_ATTEMPTS_PRUNE_INTERVAL_SECONDS:
+            return 0
+        _auth_prune_state['last'] = now
+
+    cutoff = (datetime.now() - timedelta(days=AUTH_ATTEMPTS_RETENTION_DAYS)).isoformat(timespec='seconds')
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute(_AUTH_PRUNE_SQL, (cutoff,))
+        deleted = c.rowcount
+        conn.commit()
+    except sqlite3.OperationalError:
+        deleted = 0
+    conn.close()
+    return deleted
 
 
 def _repair_blank_username(conn, username: str, mobile: str) -> str:
@@ -2398,7 +3042,8 @@ def _dedupe_user_rows(rows):
 @app.route('/chat', methods=['GET', 'POST'])
 @require_customer
 def chat():
-    history = session.get('bot_history') or []
+    store = server_session()
+    history = store.get('bot_history') or []
     if not isinstance(history, list):
         history = []
 
@@ -2411,8 +3056,7 @@ def chat():
         if message:
             history.append({'from': 'user', 'text': message})
 
-            intent = match_intent(message)
-            needs_handoff = message_needs_handoff(message)
+            intent, needs_handoff = classify_message(message)
             bot_text = None
 
             if intent:
@@ -2427,8 +3071,6 @@ def chat():
                         intent_link_label = 'Open Transaction History'
                     else:
                         intent_link_label = 'Open'
-                if intent.get('handoff'):
-                    needs_handoff = True
             else:
                 # If we can't confidently answer, direct the customer to WhatsApp support.
                 needs_handoff = True
@@ -2441,15 +3083,14 @@ def chat():
                 uname = (session.get('username') or '').strip()
                 prefill = f"Hi D-CONT Support, I need help. User: {uname}. Message: {message}"
                 whatsapp_url = build_whatsapp_link(prefill)
-                session['whatsapp_handoff_url'] = whatsapp_url
-                session['whatsapp_handoff_message'] = message
+                store['whatsapp_handoff_url'] = whatsapp_url
+                store['whatsapp_handoff_message'] = message
 
             if bot_text:
                 history.append({'from': 'bot', 'text': bot_text})
 
-            # Keep cookie-sized session data small
             history = history[-30:]
-            session['bot_history'] = history
+            store['bot_history'] = history
 
     return render_template(
         'chat.html',
@@ -2465,16 +3106,17 @@ def chat():
 @app.route('/support/whatsapp', methods=['GET'])
 @require_customer
 def support_whatsapp_handoff():
-    url = (session.get('whatsapp_handoff_url') or '').strip()
-    message = (session.get('whatsapp_handoff_message') or '').strip()
+    store = server_session()
+    url = (store.get('whatsapp_handoff_url') or '').strip()
+    message = (store.get('whatsapp_handoff_message') or '').strip()
 
     if not url:
         return redirect(url_for('chat'))
 
     # Basic allowlist: only redirect to WhatsApp domains
     if not (url.startswith('https://wa.me/') or url.startswith('https://api.whatsapp.com/') or url.startswith('https://web.whatsapp.com/')):
-        session.pop('whatsapp_handoff_url', None)
-        session.pop('whatsapp_handoff_message', None)
+        store.pop('whatsapp_handoff_url', None)
+        store.pop('whatsapp_handoff_message', None)
         return redirect(url_for('chat'))
 
     username = session.get('username')
@@ -2492,13 +3134,14 @@ def support_whatsapp_handoff():
         pass
     conn.close()
 
-    session.pop('whatsapp_handoff_url', None)
-    session.pop('whatsapp_handoff_message', None)
+    store.pop('whatsapp_handoff_url', None)
+    store.pop('whatsapp_handoff_message', None)
     return redirect(url)
 
 
 @app.route('/rewards', methods=['GET'])
 @require_customer
+@conditional_page('user', 'referred')
 def rewards():
     username = session['username']
     conn = get_db()
@@ -2607,6 +3250,18 @@ def rewards():
 
 
 
+_USER_EARLY_PAYOUTS_SQL = """
+    SELECT r.id, r.group_id, COALESCE(g.name,''), COALESCE(r.monthly_amount,0),
+           COALESCE(r.deposit_amount,0), COALESCE(r.status,''), COALESCE(r.deposit_status,''),
+           COALESCE(r.utr,''), COALESCE(r.reason,''), COALESCE(r.created_at,'')
+    FROM early_payout_requests r
+    LEFT JOIN groups g ON g.id = r.group_id
+    WHERE r.username=?
+    ORDER BY r.id DESC
+    LIMIT 10
+"""
+
+
 def _fetch_user_early_payout_requests(username: str):
     username = (username or '').strip()
     if not username:
@@ -2614,19 +3269,7 @@ def _fetch_user_early_payout_requests(username: str):
     try:
         conn = get_db()
         c = conn.cursor()
-        c.execute(
-            """
-            SELECT r.id, r.group_id, COALESCE(g.name,''), COALESCE(r.monthly_amount,0),
-                   COALESCE(r.deposit_amount,0), COALESCE(r.status,''), COALESCE(r.deposit_status,''),
-                   COALESCE(r.utr,''), COALESCE(r.reason,''), COALESCE(r.created_at,'')
-            FROM early_payout_requests r
-            LEFT JOIN groups g ON g.id = r.group_id
-            WHERE r.username=?
-            ORDER BY r.id DESC
-            LIMIT 10
-            """,
-            (username,),
-        )
+        c.execute(_USER_EARLY_PAYOUTS_SQL, (username,))
         rows = c.fetchall()
         conn.close()
     except sqlite3.OperationalError:
@@ -2754,55 +3397,10 @@ def api_upload_document():
     if not f or not f.filename:
         return jsonify({"error": "file missing"}), 400
 
-    filename = secure_filename(f.filename)
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
-    unique = f"{uuid.uuid4().hex}.{ext}"
-    file_path = f"{user_id}/{int(datetime.utcnow().timestamp())}-{unique}"
-
-    file_bytes = f.read()
-    content_type = f.mimetype or "application/octet-stream"
-
-    # 1) Upload to Supabase Storage (PUT)
-    storage_url = f"{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{file_path}"
-    storage_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": content_type,
-        "x-upsert": "true",
-    }
-
-    storage_resp = requests.put(storage_url, headers=storage_headers, data=file_bytes)
-    print("[STORAGE] URL:", storage_url)
-    print("[STORAGE] Status:", storage_resp.status_code)
-    if not storage_resp.ok:
-        print("[STORAGE] Error:", storage_resp.text)
-        return jsonify({"error": "storage upload failed", "details": storage_resp.text}), 500
-
-    # 2) Insert row into user_documents via PostgREST
-    db_url = f"{SUPABASE_URL}/rest/v1/user_documents"
-    db_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=representation",
-    }
-    db_payload = {
-        "user_id": str(user_id),
-        "doc_type": doc_type,
-        "file_path": file_path,
-        "file_name": filename,
-        "content_type": content_type,
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat(),
-    }
-
-    db_resp = requests.post(db_url, headers=db_headers, json=db_payload)
-    print("[DB INSERT] Status:", db_resp.status_code)
-    if not db_resp.ok:
-        print("[DB INSERT] Error:", db_resp.text)
-        return jsonify({"error": "db insert failed", "details": db_resp.text}), 500
-
-    return jsonify({"ok": True, "file_path": file_path, "row": db_resp.json()}), 200
+    result, status = _queue_document_upload(user_id=str(user_id), doc_type=doc_type, file_storage=f)
+    if status != 200:
+        return jsonify(result), status
+    return jsonify({"ok": True, **result}), 200
     app_fee_paid_month = ''
     trust_score = 50
     referral_code = ''
@@ -2844,6 +3442,7 @@ def api_upload_document():
         )
         gender = gender_in
         occupation = occupation_in
+        _forget_current_user()
 
         # Optional: handle document uploads
         doc_fields = [
@@ -3049,6 +3648,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-only-change-me")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 
 # --- /login route (Supabase Auth) ---
 @app.route("/login", methods=["GET", "POST"])
@@ -3076,20 +3676,10 @@ if missing:
     raise RuntimeError(f"Missing env vars: {', '.join(missing)}")
 
 def supabase_login(email: str, password: str):
-    url = f"{SUPABASE_URL}/auth/v1/token?grant_type=password"
-    headers = {"apikey": SUPABASE_ANON_KEY, "Content-Type": "application/json"}
-    return requests.post(url, headers=headers, json={"email": email, "password": password}, timeout=30)
+    return get_supabase_client().login(email, password)
 
 def supabase_is_admin(user_id: str) -> bool:
-    url = f"{SUPABASE_URL}/rest/v1/profiles"
-    headers = {"apikey": SUPABASE_SERVICE_ROLE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"}
-    params = {"id": f"eq.{user_id}", "select": "is_admin"}
-    r = requests.get(url, headers=headers, params=params, timeout=30)
-    if not r.ok:
-        print("[ADMIN CHECK ERROR]", r.status_code, r.text)
-        return False
-    rows = r.json()
-    return bool(rows and rows[0].get("is_admin") is True)
+    return get_supabase_client().is_admin(user_id)
 
 
 
@@ -3400,30 +3990,37 @@ def webauthn_auth_verify():
     return jsonify({'ok': True})
 
 
+_GROUP_MEMBERS_WITH_TRUST_SQL = """
+    SELECT u.username, COALESCE(u.full_name,''), COALESCE(u.trust_score,50)
+    FROM group_members gm
+    JOIN users u ON u.username = gm.username
+    WHERE gm.group_id=? AND gm.status='joined'
+    ORDER BY u.id ASC
+"""
+
+
 def _fetch_group_members_with_trust(group_id: int):
     conn = get_db()
     c = conn.cursor()
     try:
-        c.execute(
-            """
-            SELECT u.username, COALESCE(u.full_name,''), COALESCE(u.trust_score,50)
-            FROM group_members gm
-            JOIN users u ON u.username = gm.username
-            WHERE gm.group_id=? AND gm.status='joined'
-            ORDER BY u.id ASC
-            """,
-            (group_id,),
-        )
+        c.execute(_GROUP_MEMBERS_WITH_TRUST_SQL, (group_id,))
         rows = c.fetchall()
     except sqlite3.OperationalError:
         rows = []
+
+    # Keep scores fresh: one grouped recount for the whole group, writes only what changed.
+    scores = {}
+    if rows:
+        try:
+            scores = rebuild_trust_aggregates(conn, [r[0] for r in rows])
+            conn.commit()
+        except sqlite3.OperationalError:
+            scores = {}
     conn.close()
 
     members = []
     for username, full_name, trust_score in rows:
-        # Keep scores fresh (group sizes are small)
-        details = recalculate_and_store_trust(username)
-        score = int(details.get('score', trust_score if trust_score is not None else 50))
+        score = int(scores.get(username, trust_score if trust_score is not None else 50))
         members.append({'username': username, 'full_name': full_name or '', 'trust_score': score})
     return members
 
@@ -3486,61 +4083,208 @@ def profile_doc(doc_type: str):
     return jsonify(payload), status
 # Helper for document upload (Supabase)
 def api_upload_document_internal(*, user_id: str, doc_type: str, file):
-    filename = secure_filename(file.filename)
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
-    unique = f"{uuid.uuid4().hex}.{ext}"
-    file_path = f"{user_id}/{int(datetime.utcnow().timestamp())}-{unique}"
+    result, status = _queue_document_upload(user_id=user_id, doc_type=doc_type, file_storage=file)
+    if status != 200:
+        return jsonify(result), status
+    return jsonify({"ok": True, "file_path": result["file_path"]}), 200
+
+# --- SQLite connection layer ---
+# One connection per request (bound to flask.g), drawn from a small per-worker pool.
+# Pragmas are applied once when a pooled connection is opened, not on every checkout.
+DB_POOL_SIZE = max(0, int(os.environ.get('DCONT_DB_POOL_SIZE', '4') or 4))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DCONT_DB_BUSY_TIMEOUT_MS', '5000') or 5000)
+DB_PRAGMAS = {
+    'journal_mode': os.environ.get('DCONT_DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('DCONT_DB_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': os.environ.get('DCONT_DB_CACHE_SIZE', '-16000'),  # negative = KiB (~16 MB)
+    'mmap_size': os.environ.get('DCONT_DB_MMAP_SIZE', str(64 * 1024 * 1024)),
+    'foreign_keys': os.environ.get('DCONT_DB_FOREIGN_KEYS', 'OFF'),
+}
 
-    file_bytes = file.read()
-    content_type = file.mimetype or "application/octet-stream"
+_db_pool: list[sqlite3.Connection] = []
+_db_pool_lock = threading.Lock()
 
-    # 1) Upload to Supabase Storage (PUT)
-    storage_url = f"{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{file_path}"
-    storage_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": content_type,
-        "x-upsert": "true",
-    }
-    storage_resp = requests.put(storage_url, headers=storage_headers, data=file_bytes)
-    print("[STORAGE] Status:", storage_resp.status_code, storage_resp.text[:200])
-    if not storage_resp.ok:
-        return jsonify({"error": "storage upload failed", "details": storage_resp.text}), 500
-
-    # 2) Insert metadata
-    db_url = f"{SUPABASE_URL}/rest/v1/user_documents"
-    db_headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=representation",
-    }
-    db_payload = {
-        "user_id": user_id,
-        "doc_type": doc_type,
-        "file_path": file_path,
-        "file_name": filename,
-        "content_type": content_type,
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    db_resp = requests.post(db_url, headers=db_headers, json=db_payload)
-    print("[DB INSERT] Status:", db_resp.status_code, db_resp.text[:200])
-    if not db_resp.ok:
-        return jsonify({"error": "db insert failed", "details": db_resp.text}), 500
 
-    return jsonify({"ok": True, "file_path": file_path}), 200
+def _open_db_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+    c = conn.cursor()
+    c.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+    for name, value in DB_PRAGMAS.items():
+        value = (str(value) if value is not None else '').strip()
+        if not value:
+            continue
+        try:
+            c.execute(f"PRAGMA {name}={value}")
+        except sqlite3.DatabaseError:
+            # e.g. WAL is unavailable on some network filesystems; keep the default.
+            pass
+    c.close()
+    return conn
 
-def get_db():
-    # If using a mounted disk path like /var/data/users.db on Render,
-    # ensure the directory exists.
+
+def _db_pool_acquire() -> sqlite3.Connection:
+    with _db_pool_lock:
+        if _db_pool:
+            return _db_pool.pop()
+    return _open_db_connection()
+
+
+def _db_pool_release(conn: sqlite3.Connection, *, healthy: bool = True) -> None:
+    if conn is None:
+        return
+    if healthy:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            healthy = False
+    if healthy:
+        with _db_pool_lock:
+            if len(_db_pool) < DB_POOL_SIZE:
+                _db_pool.append(conn)
+                return
     try:
-        db_dir = os.path.dirname(DATABASE)
-        if db_dir:
-            os.makedirs(db_dir, exist_ok=True)
-    except OSError:
+        conn.close()
+    except sqlite3.Error:
         pass
 
+
+class _RequestConnection:
+    """Request-scoped handle around a pooled sqlite3 connection.
+
+    Helpers keep the usual get_db() ... conn.close() shape; close() is a no-op here
+    and the connection is committed and returned to the pool in teardown_appcontext.
+    """
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def close(self) -> None:
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def get_db():
+    """Return the current request's connection (or a standalone one outside an app context)."""
+    if not has_app_context():
+        # Import-time/CLI callers own the connection and close it themselves.
+        return _open_db_connection()
+    handle = g.get('_db_conn')
+    if handle is None:
+        handle = _RequestConnection(_db_pool_acquire())
+        g._db_conn = handle
+    return handle
+
+
+@app.teardown_appcontext
+def _teardown_db(exc):
+    handle = g.pop('_db_conn', None)
+    if handle is None:
+        return
+    conn = handle._conn
+    healthy = True
+    try:
+        if exc is None:
+            conn.commit()
+        else:
+            conn.rollback()
+    except sqlite3.Error:
+        healthy = False
+    _db_pool_release(conn, healthy=healthy)
+
+
+# --- Schema migrations ---
+# Each step runs exactly once per database and is recorded in `schema_version`.
+# Append new steps to SCHEMA_MIGRATIONS; never renumber or edit a step that has shipped.
+# Steps stay idempotent (IF NOT EXISTS / column checks) so legacy databases that
+# predate `schema_version` can replay them safely.
+
+
+def _table_columns(c, table: str) -> set[str]:
+    c.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in c.fetchall()}  # row[1] = column name
+
+
+def _migration_base_schema(conn) -> None:
+    c = conn.cursor()
+
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            password TEXT,
+            mobile TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            description TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS group_members (
+            id INTEGER PRIMARY KEY,
+            group_id INTEGER,
+            username TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY,
+            referrer_username TEXT,
+            new_username TEXT,
+            status TEXT,
+            created_at TEXT,
+            eligible_at TEXT,
+            paid_at TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS trust_events (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            event_type TEXT,
+            group_id INTEGER,
+            due_date TEXT,
+            verified_at TEXT,
+            created_at TEXT,
+            note TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS early_payout_requests (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            group_id INTEGER,
+            monthly_amount INTEGER,
+            trust_score INTEGER,
+            deposit_amount INTEGER,
+            status TEXT,
+            deposit_status TEXT,
+            utr TEXT,
+            reason TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT,
+            doc_type TEXT,
+            file_path TEXT,
+            file_url TEXT,
+            status TEXT,
+            created_at TEXT
+        )'''
+    )
+
     # App-fee payments ledger (for monthly fee + credits applied)
     c.execute(
         '''CREATE TABLE IF NOT EXISTS app_fee_payments (
@@ -3601,9 +4345,14 @@ def get_db():
     except sqlite3.OperationalError:
         pass
 
+    # Settings table for owner controls
+    c.execute('''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+
     # Ensure referrals table has credit columns (auto-migration)
-    c.execute("PRAGMA table_info(referrals)")
-    existing_referral_cols = {row[1] for row in c.fetchall()}
+    existing_referral_cols = _table_columns(c, 'referrals')
     if "credited_at" not in existing_referral_cols:
         c.execute("ALTER TABLE referrals ADD COLUMN credited_at TEXT")
     if "credit_expires_at" not in existing_referral_cols:
@@ -3618,8 +4367,7 @@ def get_db():
         c.execute("ALTER TABLE referrals ADD COLUMN credit_used_month TEXT")
 
     # Ensure groups table has monthly_amount column (auto-migration)
-    c.execute("PRAGMA table_info(groups)")
-    existing_group_cols = {row[1] for row in c.fetchall()}
+    existing_group_cols = _table_columns(c, 'groups')
     if "monthly_amount" not in existing_group_cols:
         c.execute("ALTER TABLE groups ADD COLUMN monthly_amount INTEGER")
 
@@ -3660,25 +4408,42 @@ def get_db():
         c.execute("ALTER TABLE groups ADD COLUMN start_date TEXT")
 
     # Ensure users table has required columns (auto-migration)
-    c.execute("PRAGMA table_info(users)")
-    existing_cols = {row[1] for row in c.fetchall()}  # row[1] = column name
+    existing_cols = _table_columns(c, 'users')
     for col_name, col_type in USER_COLUMNS.items():
         if col_name not in existing_cols:
             c.execute(f"ALTER TABLE users ADD COLUMN {col_name} {col_type}")
 
-    # Settings table for owner controls
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )''')
-
     # Ensure group_members has status column (auto-migration)
-    c.execute("PRAGMA table_info(group_members)")
-    existing_member_cols = {row[1] for row in c.fetchall()}
-    if "status" not in existing_member_cols:
+    if "status" not in _table_columns(c, 'group_members'):
         c.execute("ALTER TABLE group_members ADD COLUMN status TEXT")
 
-    # Backfill onboarding + membership status
+    # Ensure username/mobile uniqueness (best-effort; may fail if duplicates already exist)
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_mobile ON users(mobile)")
+    except sqlite3.OperationalError:
+        pass
+
+    # Referral indexes
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_new_username ON referrals(new_username)")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_username)")
+    except sqlite3.OperationalError:
+        pass
+
+
+def _migration_backfill_defaults(conn) -> None:
+    c = conn.cursor()
     # The 4-tab UI doesn't require onboarding; default existing users to completed.
     c.execute("UPDATE users SET onboarding_completed=1 WHERE onboarding_completed IS NULL")
     c.execute("UPDATE users SET app_fee_paid=0 WHERE app_fee_paid IS NULL")
@@ -3699,36 +4464,10 @@ def get_db():
     except sqlite3.OperationalError:
         pass
 
-    # Best-effort: if a group is already full but has no activation schedule yet, start it now.
-    try:
-        c.execute(
-            """
-            SELECT g.id, COALESCE(g.max_members,10)
-            FROM groups g
-            WHERE COALESCE(NULLIF(g.activated_at,''),'')='' OR COALESCE(NULLIF(g.next_due_date,''),'')=''
-            """
-        )
-        candidates = c.fetchall()
-        for gid, max_members in candidates:
-            try:
-                max_m = int(max_members or 10)
-            except (TypeError, ValueError):
-                max_m = 10
-            max_m = max(1, max_m)
-            c.execute(
-                "SELECT COUNT(1) FROM group_members WHERE group_id=? AND status='joined'",
-                (gid,),
-            )
-            joined_count = int((c.fetchone() or [0])[0] or 0)
-            if joined_count >= max_m:
-                _maybe_activate_group(conn, gid)
-    except sqlite3.OperationalError:
-        pass
-
-    # Backfill roles for existing users
-    c.execute("UPDATE users SET role='customer' WHERE role IS NULL OR role='' ")
-
-    # If a user already has app_fee_paid=1 in the legacy schema, treat it as first verified.
+    # Backfill roles for existing users
+    c.execute("UPDATE users SET role='customer' WHERE role IS NULL OR role='' ")
+
+    # If a user already has app_fee_paid=1 in the legacy schema, treat it as first verified.
     try:
         c.execute("UPDATE users SET first_app_fee_verified=1 WHERE COALESCE(first_app_fee_verified,0)=0 AND COALESCE(app_fee_paid,0)=1")
     except sqlite3.OperationalError:
@@ -3744,7 +4483,31 @@ def get_db():
     except sqlite3.OperationalError:
         pass
 
+
+def _migration_activate_full_groups(conn) -> None:
+    # Best-effort: if a group is already full but has no activation schedule yet, start it now.
+    c = conn.cursor()
+    try:
+        c.execute(
+            """
+            SELECT g.id
+            FROM groups g
+            WHERE (COALESCE(NULLIF(g.activated_at,''),'')='' OR COALESCE(NULLIF(g.next_due_date,''),'')='')
+              AND (
+                SELECT COUNT(1) FROM group_members gm
+                WHERE gm.group_id = g.id AND gm.status='joined'
+              ) >= MAX(1, COALESCE(g.max_members,10))
+            """
+        )
+        for (gid,) in c.fetchall():
+            _maybe_activate_group(conn, gid)
+    except sqlite3.OperationalError:
+        pass
+
+
+def _migration_referrals_paid_to_credited(conn) -> None:
     # Migrate any old 'PAID' referral rows to 'CREDITED' credits (non-withdrawable)
+    c = conn.cursor()
     try:
         c.execute(
             "SELECT id, COALESCE(paid_at,''), COALESCE(eligible_at,''), COALESCE(created_at,'') FROM referrals WHERE UPPER(COALESCE(status,''))='PAID'"
@@ -3775,42 +4538,25 @@ def get_db():
     except sqlite3.OperationalError:
         pass
 
-    # Ensure username/mobile uniqueness (best-effort; may fail if duplicates already exist)
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_mobile ON users(mobile)")
-    except sqlite3.OperationalError:
-        pass
-
-    # Referral indexes
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_new_username ON referrals(new_username)")
-    except sqlite3.OperationalError:
-        pass
-    try:
-        c.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_username)")
-    except sqlite3.OperationalError:
-        pass
 
+def _migration_backfill_referral_codes(conn) -> None:
     # Backfill referral codes for existing customer users (best-effort)
+    c = conn.cursor()
     try:
-        c.execute("SELECT id, username, COALESCE(NULLIF(role,''),'customer') as role, COALESCE(referral_code,'') FROM users")
+        c.execute(
+            """
+            SELECT id, username
+            FROM users
+            WHERE COALESCE(NULLIF(role,''),'customer') != 'admin'
+              AND TRIM(COALESCE(referral_code,'')) = ''
+              AND COALESCE(username,'') != ''
+            """
+        )
         rows = c.fetchall() or []
-        for uid, uname, role, rcode in rows:
+        for uid, uname in rows:
             uname = (uname or '').strip()
             if not uname:
                 continue
-            if (role or '').strip().lower() == 'admin':
-                continue
-            if _normalize_referral_code(rcode):
-                continue
 
             candidate = _make_referral_code_from_user_id(uid)
             suffix = 0
@@ -3833,7 +4579,10 @@ def get_db():
     except sqlite3.OperationalError:
         pass
 
+
+def _ensure_admin_user(conn) -> None:
     # Ensure a demo admin exists (username/password)
+    c = conn.cursor()
     try:
         admin_password_hash = generate_password_hash(ADMIN_PASSWORD)
 
@@ -3845,6 +4594,7 @@ def get_db():
                 'UPDATE users SET role=\'admin\', is_active=1, password=?, mobile=COALESCE(NULLIF(mobile, \'\'), ?) WHERE username=?',
                 (admin_password_hash, ADMIN_MOBILE, ADMIN_USERNAME),
             )
+            _set_user_mobile_normalized(c, row[0])
         else:
             # Fallback: if a user exists with the admin mobile, upgrade it and set username (best-effort)
             c.execute('SELECT id, username FROM users WHERE mobile=?', (ADMIN_MOBILE,))
@@ -3865,12 +4615,15 @@ def get_db():
                     'INSERT INTO users (username, password, mobile, full_name, language, city_state, email, role, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
                     (ADMIN_USERNAME, admin_password_hash, ADMIN_MOBILE, 'Owner', 'English', '', '', 'admin', 1),
                 )
-    except sqlite3.OperationalError:
+                _set_user_mobile_normalized(c, c.lastrowid)
+    except (sqlite3.OperationalError, sqlite3.IntegrityError):
         pass
 
+
+def _migration_seed_groups(conn) -> None:
     # Seed / update default groups
+    c = conn.cursor()
     c.execute('SELECT COUNT(1) FROM groups')
-   
     group_count = (c.fetchone() or [0])[0]
     if group_count == 0:
         c.execute(
@@ -3895,30 +4648,1412 @@ def get_db():
         c.execute('UPDATE groups SET name=?, monthly_amount=? WHERE id=1 AND (monthly_amount IS NULL OR monthly_amount=0)', ("Pilot Group 2026", 500))
         c.execute('UPDATE groups SET name=?, monthly_amount=? WHERE id=2 AND (monthly_amount IS NULL OR monthly_amount=0)', ("Pilot Group 2 2026", 1000))
 
+
+def _migration_trust_aggregates(conn) -> None:
+    # Per-user trust counters, kept current by record_trust_event().
+    c = conn.cursor()
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS trust_aggregates (
+            username TEXT PRIMARY KEY,
+            on_time INTEGER NOT NULL DEFAULT 0,
+            late INTEGER NOT NULL DEFAULT 0,
+            missed INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            completed_groups INTEGER NOT NULL DEFAULT 0,
+            deposit_verified INTEGER NOT NULL DEFAULT 0,
+            default_after_payout INTEGER NOT NULL DEFAULT 0,
+            grace_days INTEGER,
+            last_event_id INTEGER,
+            updated_at TEXT
+        )'''
+    )
+    rebuild_trust_aggregates(conn)
+
+
+def _migration_users_mobile_normalized(conn) -> None:
+    # Indexed login lookup by mobile, whatever format it was stored in.
+    c = conn.cursor()
+    if 'mobile_normalized' not in _table_columns(c, 'users'):
+        c.execute('ALTER TABLE users ADD COLUMN mobile_normalized TEXT')
+    relink_users_mobile_normalized(conn)
+    _create_declared_indexes(conn, ('idx_users_mobile_normalized',))
+
+
+def relink_users_mobile_normalized(conn: sqlite3.Connection) -> int:
+    """Recompute users.mobile_normalized for every row; returns how many changed.
+
+    The app sets the key itself when it writes a mobile; this picks up rows written by
+    anything else (the sqlite3 shell, import scripts, restores). A number stored on
+    several rows stays linked to the oldest one only.
+    """
+    c = conn.cursor()
+    c.execute('SELECT id, mobile, mobile_normalized FROM users ORDER BY id')
+    linked = set()
+    changed = {}
+    duplicates = 0
+    for user_id, mobile, current in c.fetchall():
+        key = _normalize_mobile_or_null(mobile)
+        if key is not None and key in linked:
+            key = None
+            duplicates += 1
+        elif key is not None:
+            linked.add(key)
+        if key != current:
+            changed[user_id] = key
+    if duplicates:
+        app.logger.warning('mobile_normalized: %s duplicate mobile(s) left unlinked', duplicates)
+
+    # Clear first so a key moving between rows never trips the unique index.
+    c.executemany('UPDATE users SET mobile_normalized=NULL WHERE id=?', [(uid,) for uid in changed])
+    c.executemany(
+        'UPDATE users SET mobile_normalized=? WHERE id=?',
+        [(key, uid) for uid, key in changed.items() if key is not None],
+    )
+    return len(changed)
+
+
+def _migration_auth_attempts_indexes(conn) -> None:
+    # Cover the rate limiter's failed-attempt window counts and the periodic prune.
+    c = conn.cursor()
+    c.execute(
+        'CREATE INDEX IF NOT EXISTS idx_auth_attempts_method_ip_created '
+        'ON auth_attempts(method, ip, created_at) WHERE success=0'
+    )
+    c.execute(
+        'CREATE INDEX IF NOT EXISTS idx_auth_attempts_method_identifier_created '
+        'ON auth_attempts(method, identifier, created_at) WHERE success=0'
+    )
+    c.execute('CREATE INDEX IF NOT EXISTS idx_auth_attempts_created ON auth_attempts(created_at)')
+
+
+def _migration_groups_joined_count(conn) -> None:
+    # Denormalized member counter so group listings skip the group_members join.
+    c = conn.cursor()
+    if 'joined_count' not in _table_columns(c, 'groups'):
+        c.execute('ALTER TABLE groups ADD COLUMN joined_count INTEGER NOT NULL DEFAULT 0')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_group_members_group_status ON group_members(group_id, status)')
+    reconcile_group_joined_counts(conn)
+
+
+def reconcile_group_joined_counts(conn: sqlite3.Connection) -> int:
+    """Recount groups.joined_count for every group; returns how many were off."""
+    c = conn.cursor()
+    c.execute(
+        """
+        UPDATE groups
+        SET joined_count=(
+            SELECT COUNT(1) FROM group_members gm WHERE gm.group_id=groups.id AND gm.status='joined'
+        )
+        WHERE COALESCE(joined_count,-1) <> (
+            SELECT COUNT(1) FROM group_members gm WHERE gm.group_id=groups.id AND gm.status='joined'
+        )
+        """
+    )
+    return c.rowcount
+
+
+# Owner risk buckets. Each one has a partial index over exactly these terms, so queries
+# must spell them the same way (SQLite matches partial-index WHERE clauses textually).
+CUSTOMER_ONLY_SQL = "COALESCE(NULLIF(role,''),'customer') != 'admin'"
+RISK_BUCKETS = {
+    'blocked': 'COALESCE(is_active,1)=0',
+    'frozen': 'COALESCE(join_blocked,0)=1',
+    'low_trust': 'COALESCE(trust_score,50) < 40',
+}
+
+# Every index the hot queries rely on. `flask check-query-plans` verifies they exist
+# and that HOT_QUERIES still use them; new entries need a migration step that creates
+# them by name (_create_declared_indexes(conn, names)).
+SCHEMA_INDEXES = {
+    'idx_users_username': 'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)',
+    'idx_users_mobile_normalized': (
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_mobile_normalized ON users(mobile_normalized) '
+        'WHERE mobile_normalized IS NOT NULL'
+    ),
+    'idx_users_referral_code': 'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)',
+    'idx_group_members_group_status': 'CREATE INDEX IF NOT EXISTS idx_group_members_group_status ON group_members(group_id, status)',
+    'idx_group_members_username_status': 'CREATE INDEX IF NOT EXISTS idx_group_members_username_status ON group_members(username, status)',
+    'idx_trust_events_username_id': 'CREATE INDEX IF NOT EXISTS idx_trust_events_username_id ON trust_events(username, id)',
+    'idx_trust_events_group': 'CREATE INDEX IF NOT EXISTS idx_trust_events_group ON trust_events(group_id)',
+    'idx_referrals_new_username': 'CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_new_username ON referrals(new_username)',
+    'idx_referrals_referrer': 'CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_username)',
+    'idx_app_fee_payments_month': 'CREATE INDEX IF NOT EXISTS idx_app_fee_payments_month ON app_fee_payments(month, id)',
+    'idx_early_payout_requests_username_id': (
+        'CREATE INDEX IF NOT EXISTS idx_early_payout_requests_username_id ON early_payout_requests(username, id)'
+    ),
+    'idx_early_payout_requests_group': 'CREATE INDEX IF NOT EXISTS idx_early_payout_requests_group ON early_payout_requests(group_id)',
+    'idx_transactions_user_created': 'CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions(username, created_at)',
+    'idx_auth_attempts_method_ip_created': (
+        'CREATE INDEX IF NOT EXISTS idx_auth_attempts_method_ip_created '
+        'ON auth_attempts(method, ip, created_at) WHERE success=0'
+    ),
+    'idx_auth_attempts_method_identifier_created': (
+        'CREATE INDEX IF NOT EXISTS idx_auth_attempts_method_identifier_created '
+        'ON auth_attempts(method, identifier, created_at) WHERE success=0'
+    ),
+    'idx_auth_attempts_created': 'CREATE INDEX IF NOT EXISTS idx_auth_attempts_created ON auth_attempts(created_at)',
+    'idx_due_schedule_due_date': 'CREATE INDEX IF NOT EXISTS idx_due_schedule_due_date ON due_schedule(due_date, group_id)',
+    'idx_session_store_expires_at': 'CREATE INDEX IF NOT EXISTS idx_session_store_expires_at ON session_store(expires_at)',
+    'idx_jobs_status_run_after': 'CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after, id)',
+    'idx_jobs_idempotency_key': (
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency_key ON jobs(idempotency_key) '
+        "WHERE idempotency_key IS NOT NULL AND status='queued'"
+    ),
+    **{
+        f'idx_users_risk_{bucket}': (
+            f'CREATE INDEX IF NOT EXISTS idx_users_risk_{bucket} ON users(id) '
+            f'WHERE {CUSTOMER_ONLY_SQL} AND {condition}'
+        )
+        for bucket, condition in RISK_BUCKETS.items()
+    },
+}
+
+
+def _create_declared_indexes(conn, names=None) -> None:
+    """Create the SCHEMA_INDEXES entries in `names` (default: all of them)."""
+    c = conn.cursor()
+    for name in SCHEMA_INDEXES if names is None else names:
+        try:
+            c.execute(SCHEMA_INDEXES[name])
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            if 'no such table' in str(e):
+                # The migration that adds the table calls this again.
+                continue
+            # Unique indexes fail on legacy duplicates; check-query-plans reports them.
+            app.logger.warning('Could not create index %s', name)
+
+
+def _migration_declared_indexes(conn) -> None:
+    _create_declared_indexes(conn)
+
+
+def _migration_risk_bucket_indexes(conn) -> None:
+    _create_declared_indexes(conn, ('idx_users_risk_blocked', 'idx_users_risk_frozen', 'idx_users_risk_low_trust'))
+
+
+def _migration_group_cycle(conn) -> None:
+    # Bookkeeping for run_group_cycle(): the cycle just closed and whether it was checked.
+    c = conn.cursor()
+    cols = _table_columns(c, 'groups')
+    if 'previous_due_date' not in cols:
+        c.execute('ALTER TABLE groups ADD COLUMN previous_due_date TEXT')
+    if 'missed_checked_at' not in cols:
+        c.execute('ALTER TABLE groups ADD COLUMN missed_checked_at TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trust_events_group ON trust_events(group_id)')
+
+
+# due_schedule holds one row per group with a due date, so "what is due on day X" is a
+# single index probe; views add their own conditions (payments_tab: the group is full).
+# Triggers on groups keep it current; refresh_due_schedule() rebuilds it wholesale.
+_DUE_SCHEDULE_DATED_SQL = "TRIM(COALESCE(g.next_due_date,'')) GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+
+
+def _due_schedule_select_sql(where: str) -> str:
+    return f"""
+        SELECT g.id,
+               TRIM(g.next_due_date),
+               NULLIF(TRIM(COALESCE(g.payout_receiver_username,'')),''),
+               COALESCE(NULLIF(TRIM(COALESCE(g.payout_receiver_name,'')),''), NULLIF(TRIM(COALESCE(g.receiver_name,'')),''), 'Receiver'),
+               COALESCE(NULLIF(TRIM(COALESCE(g.payout_receiver_upi,'')),''), TRIM(COALESCE(g.receiver_upi,''))),
+               COALESCE(NULLIF(TRIM(COALESCE(g.pay_cutoff_time,'')),''), '{DEFAULT_PAY_CUTOFF_TIME}')
+        FROM groups g
+        WHERE {where}
+          AND {_DUE_SCHEDULE_DATED_SQL}
+    """
+
+
+_DUE_SCHEDULE_INSERT = (
+    'INSERT OR REPLACE INTO due_schedule (group_id, due_date, receiver_username, receiver_name, receiver_upi, pay_cutoff_time) '
+)
+
+
+def refresh_due_schedule(conn) -> int:
+    """Rebuild due_schedule from groups; returns the number of scheduled groups."""
+    c = conn.cursor()
+    c.execute('DELETE FROM due_schedule')
+    c.execute(_DUE_SCHEDULE_INSERT + _due_schedule_select_sql('1=1'))
+    return c.rowcount
+
+
+def _migration_due_schedule(conn) -> None:
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS due_schedule (
+            group_id INTEGER PRIMARY KEY,
+            due_date TEXT NOT NULL,
+            receiver_username TEXT,
+            receiver_name TEXT,
+            receiver_upi TEXT,
+            pay_cutoff_time TEXT
+        )
+        """
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS trg_groups_due_schedule_insert
+        AFTER INSERT ON groups
+        BEGIN
+            {_DUE_SCHEDULE_INSERT}{_due_schedule_select_sql('g.id=NEW.id')};
+        END"""
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS trg_groups_due_schedule_update
+        AFTER UPDATE ON groups
+        BEGIN
+            DELETE FROM due_schedule WHERE group_id=OLD.id;
+            {_DUE_SCHEDULE_INSERT}{_due_schedule_select_sql('g.id=NEW.id')};
+        END"""
+    )
+    c.execute(
+        """CREATE TRIGGER IF NOT EXISTS trg_groups_due_schedule_delete
+        AFTER DELETE ON groups
+        BEGIN
+            DELETE FROM due_schedule WHERE group_id=OLD.id;
+        END"""
+    )
+    _create_declared_indexes(conn, ('idx_due_schedule_due_date',))
+    refresh_due_schedule(conn)
+
+
+# users_fts mirrors the searchable user columns (rowid = users.id) for the owner search.
+# It stores its own copy rather than using external content, so the triggers can always
+# delete-then-insert by rowid.
+USERS_FTS_COLUMNS = ('username', 'full_name', 'mobile_normalized', 'email', 'referral_code')
+
+
+def refresh_users_fts(conn) -> int:
+    """Rebuild users_fts from users; returns the number of rows indexed."""
+    c = conn.cursor()
+    cols = ', '.join(USERS_FTS_COLUMNS)
+    c.execute('DELETE FROM users_fts')
+    c.execute(f'INSERT INTO users_fts (rowid, {cols}) SELECT id, {cols} FROM users')
+    return c.rowcount
+
+
+def _migration_users_fts(conn) -> None:
+    c = conn.cursor()
+    cols = ', '.join(USERS_FTS_COLUMNS)
+    new_values = ', '.join(f'NEW.{col}' for col in USERS_FTS_COLUMNS)
+    try:
+        c.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                {cols},
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+            """
+        )
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: the owner search falls back to LIKE.
+        app.logger.warning('users_fts not created: %s', e)
+        return
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert
+        AFTER INSERT ON users
+        BEGIN
+            DELETE FROM users_fts WHERE rowid=NEW.id;
+            INSERT INTO users_fts (rowid, {cols}) VALUES (NEW.id, {new_values});
+        END"""
+    )
+    c.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+        AFTER UPDATE OF id, {cols} ON users
+        BEGIN
+            DELETE FROM users_fts WHERE rowid=OLD.id;
+            INSERT INTO users_fts (rowid, {cols}) VALUES (NEW.id, {new_values});
+        END"""
+    )
+    c.execute(
+        """CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_fts WHERE rowid=OLD.id;
+        END"""
+    )
+    refresh_users_fts(conn)
+
+
+# data_versions holds one counter per tracked table, bumped by triggers on every write,
+# so "has anything in these tables changed?" is a lookup in a tiny table.
+DATA_VERSION_TABLES = ('users', 'groups', 'group_members', 'transactions', 'referrals', 'trust_events', 'due_schedule')
+# 'user_directory' only moves when the user columns other people's pages show change, so
+# fragments listing members (Owner -> Groups) aren't re-rendered by trust recomputes,
+# sign-count updates and the like, which bump the plain 'users' counter.
+USER_DIRECTORY_COLUMNS = ('username', 'full_name', 'upi_id')
+
+
+def _migration_data_versions(conn) -> None:
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table in DATA_VERSION_TABLES:
+        c.execute('INSERT OR IGNORE INTO data_versions (scope, version) VALUES (?, 0)', (table,))
+        for event in ('insert', 'update', 'delete'):
+            c.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_data_version_{event}
+                AFTER {event.upper()} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version=version+1 WHERE scope='{table}';
+                END"""
+            )
+    c.execute("INSERT OR IGNORE INTO data_versions (scope, version) VALUES ('user_directory', 0)")
+    for event, when in (('insert', 'INSERT'), ('update', f"UPDATE OF {', '.join(USER_DIRECTORY_COLUMNS)}"), ('delete', 'DELETE')):
+        c.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS trg_users_directory_version_{event}
+            AFTER {when} ON users
+            BEGIN
+                UPDATE data_versions SET version=version+1 WHERE scope='user_directory';
+            END"""
+        )
+
+
+# Per-user scopes ('user:<username>') in data_versions, bumped whenever a row belonging
+# to that user changes. Customer page ETags (conditional_page) are built from them.
+USER_DATA_VERSION_COLUMNS = {
+    'users': ('username',),
+    'group_members': ('username',),
+    'transactions': ('username',),
+    'trust_events': ('username',),
+    'app_fee_payments': ('username',),
+    'referrals': ('referrer_username', 'new_username'),
+}
+
+
+def _migration_user_data_versions(conn) -> None:
+    c = conn.cursor()
+    for table, columns in USER_DATA_VERSION_COLUMNS.items():
+        for event, refs in (('insert', ('NEW',)), ('update', ('OLD', 'NEW')), ('delete', ('OLD',))):
+            bumps = '\n'.join(
+                f"INSERT INTO data_versions (scope, version) VALUES ('user:' || COALESCE({ref}.{column}, ''), 1) "
+                "ON CONFLICT(scope) DO UPDATE SET version=version+1;"
+                for column in columns
+                for ref in refs
+            )
+            c.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_user_version_{event}
+                AFTER {event.upper()} ON {table}
+                BEGIN
+                    {bumps}
+                END"""
+            )
+
+
+def _migration_session_store(conn) -> None:
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_store (
+            sid TEXT PRIMARY KEY,
+            username TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            expires_at TEXT NOT NULL
+        )
+        """
+    )
+    _create_declared_indexes(conn, ('idx_session_store_expires_at',))
+
+
+def _migration_jobs(conn) -> None:
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            idempotency_key TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 6,
+            run_after TEXT NOT NULL,
+            locked_at TEXT,
+            last_error TEXT,
+            created_at TEXT,
+            finished_at TEXT
+        )
+        """
+    )
+    _create_declared_indexes(conn, ('idx_jobs_status_run_after', 'idx_jobs_idempotency_key'))
+
+
+SCHEMA_MIGRATIONS = [
+    (1, 'base_schema', _migration_base_schema),
+    (2, 'backfill_defaults', _migration_backfill_defaults),
+    (3, 'activate_full_groups', _migration_activate_full_groups),
+    (4, 'referrals_paid_to_credited', _migration_referrals_paid_to_credited),
+    (5, 'backfill_referral_codes', _migration_backfill_referral_codes),
+    (6, 'ensure_admin_user', _ensure_admin_user),
+    (7, 'seed_groups', _migration_seed_groups),
+    (8, 'trust_aggregates', _migration_trust_aggregates),
+    (9, 'users_mobile_normalized', _migration_users_mobile_normalized),
+    (10, 'auth_attempts_indexes', _migration_auth_attempts_indexes),
+    (11, 'groups_joined_count', _migration_groups_joined_count),
+    (12, 'declared_indexes', _migration_declared_indexes),
+    (13, 'jobs', _migration_jobs),
+    (14, 'group_cycle', _migration_group_cycle),
+    (15, 'due_schedule', _migration_due_schedule),
+    (16, 'risk_bucket_indexes', _migration_risk_bucket_indexes),
+    (17, 'users_fts', _migration_users_fts),
+    (18, 'session_store', _migration_session_store),
+    (19, 'data_versions', _migration_data_versions),
+    (20, 'user_data_versions', _migration_user_data_versions),
+]
+SCHEMA_HEAD = SCHEMA_MIGRATIONS[-1][0]
+
+
+def _schema_version(conn) -> int:
+    c = conn.cursor()
+    try:
+        c.execute('SELECT COALESCE(MAX(version),0) FROM schema_version')
+        return int((c.fetchone() or [0])[0] or 0)
+    except sqlite3.OperationalError:
+        return 0
+
+
+def run_migrations(conn) -> list[int]:
+    """Apply pending migrations in order; returns the versions applied.
+
+    Each step runs in its own BEGIN IMMEDIATE transaction, so concurrent workers
+    booting against the same file serialize and the loser sees the step as done.
+    """
+    c = conn.cursor()
+    if conn.in_transaction:
+        conn.commit()
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )'''
+    )
     conn.commit()
+
+    applied = []
+    for version, name, step in SCHEMA_MIGRATIONS:
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            if _schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            c.execute(
+                'INSERT INTO schema_version (version, name, applied_at) VALUES (?,?,?)',
+                (version, name, datetime.now().isoformat(timespec='seconds')),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def init_db() -> list[int]:
+    """Bring the schema to SCHEMA_HEAD. At head this is a single SELECT."""
+    conn = get_db()
+    try:
+        if _schema_version(conn) >= SCHEMA_HEAD:
+            return []
+        return run_migrations(conn)
+    finally:
+        conn.close()
+
+
+@app.cli.command('db-migrate')
+def db_migrate_command():
+    """Apply pending schema migrations."""
+    applied = init_db()
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)} (head={SCHEMA_HEAD})")
+    else:
+        print(f"Already at head (version {SCHEMA_HEAD}).")
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """Show the current schema version."""
+    conn = get_db()
+    current = _schema_version(conn)
     conn.close()
+    print(f"Schema version: {current} (head={SCHEMA_HEAD})")
 
 
-def get_setting(key: str, default: str = "") -> str:
+@app.cli.command('ensure-admin')
+def ensure_admin_command():
+    """Re-sync the owner account from DCONT_ADMIN_* env vars."""
     conn = get_db()
+    _ensure_admin_user(conn)
+    conn.commit()
+    conn.close()
+    print(f"Admin user '{ADMIN_USERNAME}' is up to date.")
+
+
+@app.cli.command('trust-rebuild')
+def trust_rebuild_command():
+    """Recompute trust_aggregates and users.trust_score from trust_events.
+
+    Run after changing the trust_grace_days setting. Until then, stale rows are
+    rebuilt lazily, one user at a time, as they are read.
+    """
+    conn = get_db()
+    scores = rebuild_trust_aggregates(conn)
+    conn.commit()
+    conn.close()
+    print(f"Rebuilt trust aggregates for {len(scores)} user(s) (grace_days={_get_trust_grace_days()}).")
+
+
+@app.cli.command('search-rebuild')
+def search_rebuild_command():
+    """Rebuild the users_fts search index from users."""
+    conn = get_db()
+    try:
+        count = refresh_users_fts(conn)
+    except sqlite3.OperationalError as e:
+        conn.close()
+        raise SystemExit(f"users_fts unavailable: {e}")
+    conn.commit()
+    conn.close()
+    print(f"Indexed {count} user(s) for search.")
+
+
+@app.cli.command('groups-reconcile')
+def groups_reconcile_command():
+    """Recount groups.joined_count from group_members."""
+    conn = get_db()
+    fixed = reconcile_group_joined_counts(conn)
+    conn.commit()
+    conn.close()
+    print(f"Reconciled joined_count: {fixed} group(s) corrected.")
+
+
+@app.cli.command('mobiles-relink')
+def mobiles_relink_command():
+    """Recompute users.mobile_normalized, e.g. after importing users outside the app."""
+    conn = get_db()
+    changed = relink_users_mobile_normalized(conn)
+    conn.commit()
+    conn.close()
+    print(f"Relinked mobile_normalized: {changed} user(s) updated.")
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query no longer uses an index."""
+    conn = get_db()
+    problems = check_query_plans(conn)
+    conn.close()
+    if problems:
+        for p in problems:
+            print(f"FAIL {p}")
+        raise SystemExit(1)
+    print(f"OK: {len(HOT_QUERIES)} queries, {len(SCHEMA_INDEXES)} indexes.")
+
+
+@app.cli.command('i18n-check')
+def i18n_check_command():
+    """List translation keys that fall back to English."""
+    for lang, keys in TRANSLATION_MISSING.items():
+        for key in keys:
+            print(f"{lang}: missing {key}")
+    total = sum(len(keys) for keys in TRANSLATION_MISSING.values())
+    print(f"{len(TRANSLATION_CATALOGS['en'])} key(s); {total} missing translation(s).")
+    if total:
+        raise SystemExit(1)
+
+
+@app.cli.command('chat-bench')
+def chat_bench_command():
+    """Time the support-bot matcher against the old per-trigger loop as the FAQ grows."""
+    rng = random.Random(0)
+
+    def _word():
+        return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 8)))
+
+    handoff_keywords = ADVANCED_HANDOFF_KEYWORDS + ADVANCED_HANDOFF_KEYWORDS_HI
+    messages = [*BOT_QUICK_REPLIES, 'मेरा यूपीआई बदलना है', 'I paid wrong person, need refund', 'hello, any news today?']
+    rounds = 50
+    print(f"{'triggers':>9} {'build ms':>9} {'matcher us/msg':>15} {'loop us/msg':>12}")
+    for extra in (0, 100, 1000, 10000):
+        # Filler intents go first so the loop has to walk past them, as it would for a
+        # real FAQ that grew.
+        filler = [{'key': f'bench_{i}', 'triggers': [f'{_word()} {_word()}'], 'answer': ''} for i in range(extra)]
+        intents = filler + FAQ_INTENTS
+        started = time.perf_counter()
+        classify = build_intent_matcher(intents, handoff_keywords)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        def _loop(message):
+            msg = (message or '').strip().lower()
+            handoff = any(k in msg for k in handoff_keywords)
+            for intent in intents:
+                for trig in [*intent.get('triggers', []), *intent.get('triggers_hi', [])]:
+                    if trig in msg:
+                        return intent, handoff
+            return None, handoff
+
+        timings = []
+        for fn in (classify, _loop):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                for message in messages:
+                    fn(message)
+            timings.append((time.perf_counter() - started) * 1e6 / (rounds * len(messages)))
+        n_triggers = sum(len(i.get('triggers', [])) + len(i.get('triggers_hi', [])) for i in intents)
+        print(f"{n_triggers:>9} {build_ms:>9.1f} {timings[0]:>15.1f} {timings[1]:>12.1f}")
+
+
+# --- Background jobs ---
+# Side effects that don't need to finish before the response (Storage uploads, trust
+# rebuilds, referral eligibility, file cleanup) are written to the `jobs` table in the
+# caller's transaction and drained by a worker: a daemon thread in each web process
+# (DCONT_JOBS_IN_PROCESS, on by default) and/or `flask --app app jobs-worker` running
+# against the same disk.
+# Claims take a BEGIN IMMEDIATE lock, so any number of drainers can share the table.
+# Delivery is at-least-once: handlers must be safe to run again after a crash.
+JOBS_IN_PROCESS = (os.environ.get('DCONT_JOBS_IN_PROCESS', '1') or '').strip().lower() not in {'0', 'false', 'no'}
+JOBS_POLL_SECONDS = max(0.1, float(os.environ.get('DCONT_JOBS_POLL_SECONDS', '2') or 2))
+JOBS_MAX_ATTEMPTS = max(1, int(os.environ.get('DCONT_JOBS_MAX_ATTEMPTS', '6') or 6))
+JOBS_BACKOFF_SECONDS = 10  # doubled per attempt, capped at JOBS_BACKOFF_MAX_SECONDS
+JOBS_BACKOFF_MAX_SECONDS = 15 * 60
+JOBS_LOCK_TIMEOUT_SECONDS = 10 * 60  # a 'running' job older than this is assumed orphaned
+UPLOAD_SPOOL_PURGE_SECONDS = 60 * 60
+UPLOAD_SPOOL_MAX_AGE_SECONDS = 24 * 60 * 60  # well past the last retry of a document_upload job
+
+JOB_HANDLERS = {}
+JOB_FAILURE_HANDLERS = {}  # kind -> fn(conn, payload), called once a job is marked 'failed'
+PERIODIC_JOBS = {}  # kind -> interval seconds; re-queued after each run
+_jobs_wakeup = threading.Event()
+_jobs_worker_thread = None
+_jobs_worker_lock = threading.Lock()
+
+
+def job_handler(kind: str, *, on_failure=None):
+    """Register fn(conn, payload) as the handler for jobs of this kind.
+
+    on_failure(conn, payload) runs once the job has used up its attempts.
+    """
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        if on_failure is not None:
+            JOB_FAILURE_HANDLERS[kind] = on_failure
+        return fn
+    return decorator
+
+
+def _jobs_timestamp(offset_seconds: float = 0) -> str:
+    return (datetime.now() + timedelta(seconds=offset_seconds)).isoformat(timespec='seconds')
+
+
+def enqueue_job(conn, kind: str, payload: dict, *, idempotency_key: str = None, delay_seconds: float = 0):
+    """Queue a job on `conn`; it becomes visible when the caller commits.
+
+    While a job with the same idempotency_key is still queued, enqueueing again is a
+    no-op and returns that job's id.
+    """
     c = conn.cursor()
+    c.execute(
+        """
+        INSERT OR IGNORE INTO jobs (kind, payload, idempotency_key, status, attempts, max_attempts, run_after, created_at)
+        VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)
+        """,
+        (kind, json.dumps(payload or {}), idempotency_key, JOBS_MAX_ATTEMPTS,
+         _jobs_timestamp(delay_seconds), _jobs_timestamp()),
+    )
+    if c.rowcount:
+        job_id = c.lastrowid
+    else:
+        c.execute("SELECT id FROM jobs WHERE idempotency_key=? AND status='queued'", (idempotency_key,))
+        row = c.fetchone()
+        job_id = row[0] if row else None
+    _jobs_wakeup.set()
+    return job_id
+
+
+def _requeue_job(c, job_id: int, run_after: str, error: str) -> None:
+    c.execute(
+        "UPDATE OR IGNORE jobs SET status='queued', locked_at=NULL, run_after=?, last_error=? WHERE id=?",
+        (run_after, error, job_id),
+    )
+    if not c.rowcount:
+        # A newer copy with the same idempotency key is already queued; it does the work.
+        c.execute(
+            "UPDATE jobs SET status='done', locked_at=NULL, finished_at=?, last_error=? WHERE id=?",
+            (_jobs_timestamp(), 'superseded by a queued duplicate', job_id),
+        )
+
+
+def _schedule_next_run(conn, kind: str, delay_seconds: float) -> None:
+    enqueue_job(conn, kind, {'periodic': True}, idempotency_key=f'periodic:{kind}', delay_seconds=delay_seconds)
+
+
+def _seed_periodic_jobs(conn) -> None:
+    for kind in PERIODIC_JOBS:
+        _schedule_next_run(conn, kind, 0)
+    conn.commit()
+
+
+_CLAIM_JOB_SQL = """
+    SELECT id, kind, payload, attempts, max_attempts
+    FROM jobs
+    WHERE status='queued' AND run_after <= ?
+    ORDER BY run_after, id
+    LIMIT 1
+"""
+
+
+def _claim_job(conn):
+    """Lock the next due job; returns (id, kind, payload, attempts, max_attempts) or None."""
+    c = conn.cursor()
+    if conn.in_transaction:
+        conn.commit()
+    c.execute('BEGIN IMMEDIATE')
     try:
-        c.execute('SELECT value FROM settings WHERE key=?', (key,))
+        c.execute(
+            "SELECT id FROM jobs WHERE status='running' AND locked_at < ?",
+            (_jobs_timestamp(-JOBS_LOCK_TIMEOUT_SECONDS),),
+        )
+        for (stale_id,) in c.fetchall():
+            _requeue_job(c, stale_id, _jobs_timestamp(), 'worker lost while running')
+        c.execute(_CLAIM_JOB_SQL, (_jobs_timestamp(),))
         row = c.fetchone()
+        if row:
+            c.execute(
+                "UPDATE jobs SET status='running', locked_at=?, attempts=attempts+1 WHERE id=?",
+                (_jobs_timestamp(), row[0]),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not row:
+        return None
+    return (row[0], row[1], row[2], int(row[3] or 0) + 1, int(row[4] or JOBS_MAX_ATTEMPTS))
+
+
+def _run_job(conn, job) -> bool:
+    job_id, kind, raw_payload, attempts, max_attempts = job
+    c = conn.cursor()
+    try:
+        payload = json.loads(raw_payload or '{}')
+    except ValueError:
+        payload = None
+    periodic = isinstance(payload, dict) and bool(payload.get('periodic')) and kind in PERIODIC_JOBS
+    try:
+        handler = JOB_HANDLERS.get(kind)
+        if handler is None:
+            raise LookupError(f'no handler for job kind {kind!r}')
+        if not isinstance(payload, dict):
+            raise ValueError('job payload is not a JSON object')
+        handler(conn, payload)
+        # Local writes made by the handler commit together with the 'done' mark.
+        c.execute(
+            "UPDATE jobs SET status='done', locked_at=NULL, finished_at=?, last_error=NULL WHERE id=?",
+            (_jobs_timestamp(), job_id),
+        )
+        if periodic:
+            _schedule_next_run(conn, kind, PERIODIC_JOBS[kind])
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        error = f'{type(e).__name__}: {e}'[:500]
+        if attempts >= max_attempts:
+            c.execute(
+                "UPDATE jobs SET status='failed', locked_at=NULL, finished_at=?, last_error=? WHERE id=?",
+                (_jobs_timestamp(), error, job_id),
+            )
+            app.logger.error('Job %s (%s) failed after %s attempts: %s', job_id, kind, attempts, error)
+            on_failure = JOB_FAILURE_HANDLERS.get(kind)
+            if on_failure is not None and isinstance(payload, dict):
+                try:
+                    on_failure(conn, payload)
+                except Exception:
+                    app.logger.exception('Job %s (%s) failure cleanup failed', job_id, kind)
+            if periodic:
+                _schedule_next_run(conn, kind, PERIODIC_JOBS[kind])
+        else:
+            delay = min(JOBS_BACKOFF_MAX_SECONDS, JOBS_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+            _requeue_job(c, job_id, _jobs_timestamp(delay * random.uniform(0.5, 1.0)), error)
+            app.logger.warning('Job %s (%s) attempt %s failed, retrying: %s', job_id, kind, attempts, error)
+        conn.commit()
+        return False
+
+
+def run_pending_jobs(conn, limit: int = None) -> int:
+    """Drain due jobs (at most `limit`); returns how many were attempted."""
+    done = 0
+    while limit is None or done < limit:
+        job = _claim_job(conn)
+        if job is None:
+            break
+        # A fresh app context per job: helpers that call get_db() get their own
+        # connection, committed and returned to the pool when the job ends.
+        with app.app_context():
+            _run_job(conn, job)
+        done += 1
+    return done
+
+
+def _jobs_worker_loop(stop_event: threading.Event) -> None:
+    conn = _open_db_connection()
+    try:
+        try:
+            _seed_periodic_jobs(conn)
+        except sqlite3.Error:
+            conn.rollback()
+            app.logger.exception('Could not schedule periodic jobs')
+        while not stop_event.is_set():
+            _jobs_wakeup.clear()
+            try:
+                worked = run_pending_jobs(conn)
+            except sqlite3.Error:
+                app.logger.exception('Job worker pass failed')
+                worked = 0
+            if not worked:
+                _jobs_wakeup.wait(JOBS_POLL_SECONDS)
+    finally:
+        conn.close()
+
+
+@app.before_request
+def _ensure_jobs_worker():
+    # Started lazily so CLI imports and pre-fork imports don't spawn a thread.
+    global _jobs_worker_thread
+    if not JOBS_IN_PROCESS or (_jobs_worker_thread is not None and _jobs_worker_thread.is_alive()):
+        return
+    with _jobs_worker_lock:
+        if _jobs_worker_thread is None or not _jobs_worker_thread.is_alive():
+            _jobs_worker_thread = threading.Thread(
+                target=_jobs_worker_loop, args=(threading.Event(),), name='jobs-worker', daemon=True
+            )
+            _jobs_worker_thread.start()
+
+
+@job_handler('referral_eligibility')
+def _job_referral_eligibility(conn, payload: dict) -> None:
+    _maybe_mark_referral_eligible(conn, payload.get('username') or '')
+
+
+@job_handler('trust_rebuild')
+def _job_trust_rebuild(conn, payload: dict) -> None:
+    usernames = [u for u in (payload.get('usernames') or []) if u]
+    if usernames:
+        rebuild_trust_aggregates(conn, usernames)
+
+
+@job_handler('delete_upload_files')
+def _job_delete_upload_files(conn, payload: dict) -> None:
+    folder = app.config.get('UPLOAD_FOLDER') or UPLOAD_FOLDER
+    for fn in payload.get('filenames') or []:
+        path = os.path.join(folder, os.path.basename(fn or ''))
+        if fn and os.path.isfile(path):
+            os.remove(path)
+
+
+def _document_upload_failed(conn, payload: dict) -> None:
+    # The file never reached Storage: drop the spooled copy and flag the row so the
+    # customer sees the upload failed instead of a document that can't be opened.
+    _remove_spool_file(payload.get('spool_name'))
+    resp = get_supabase_client().update(
+        'user_documents', {'file_path': f"eq.{payload['file_path']}"}, {'status': 'upload_failed'}
+    )
+    if not resp.ok:
+        raise RuntimeError(f'user_documents update failed ({resp.status_code}): {resp.text[:200]}')
+
+
+@job_handler('document_upload', on_failure=_document_upload_failed)
+def _job_document_upload(conn, payload: dict) -> None:
+    # Storage PUTs upsert, so a retry after a partial failure just overwrites the object.
+    # The user_documents row was written by the request (_queue_document_upload).
+    spool_path = os.path.join(UPLOAD_SPOOL_FOLDER, os.path.basename(payload['spool_name']))
+    supabase = get_supabase_client()
+    with open(spool_path, 'rb') as fh:
+        storage_resp, sha256, size = supabase.upload_stream(
+            SUPABASE_BUCKET, payload['file_path'], fh, payload['content_type'], size=os.path.getsize(spool_path)
+        )
+    if not storage_resp.ok:
+        raise RuntimeError(f'storage upload failed ({storage_resp.status_code}): {storage_resp.text[:200]}')
+    if payload.get('sha256') and sha256 != payload['sha256']:
+        raise RuntimeError('spooled file changed since upload (sha256 mismatch)')
+    print(f"[Supabase Storage] Stored {SUPABASE_BUCKET}/{payload['file_path']} ({size} bytes, sha256 {sha256})")
+    _remove_spool_file(payload['spool_name'])
+
+
+@job_handler('upload_spool_purge')
+def _job_upload_spool_purge(conn, payload: dict) -> None:
+    """Delete spooled uploads that no queued or running job will pick up."""
+    if not os.path.isdir(UPLOAD_SPOOL_FOLDER):
+        return
+    c = conn.cursor()
+    c.execute("SELECT payload FROM jobs WHERE kind='document_upload' AND status IN ('queued', 'running')")
+    wanted = set()
+    for (raw,) in c.fetchall():
+        try:
+            wanted.add(os.path.basename(json.loads(raw or '{}').get('spool_name') or ''))
+        except (ValueError, AttributeError):
+            continue
+    # The age floor covers files whose request hasn't committed its job yet.
+    cutoff = time.time() - UPLOAD_SPOOL_MAX_AGE_SECONDS
+    removed = 0
+    for entry in os.scandir(UPLOAD_SPOOL_FOLDER):
+        if entry.is_file() and entry.name not in wanted and entry.stat().st_mtime < cutoff:
+            _remove_spool_file(entry.name)
+            removed += 1
+    if removed:
+        app.logger.info('Removed %s orphaned spooled upload(s)', removed)
+
+
+PERIODIC_JOBS['upload_spool_purge'] = UPLOAD_SPOOL_PURGE_SECONDS
+
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Drain the jobs table until interrupted."""
+    print(f"Job worker started (poll every {JOBS_POLL_SECONDS}s).")
+    try:
+        _jobs_worker_loop(threading.Event())
+    except KeyboardInterrupt:
+        pass
+
+
+@app.cli.command('jobs-status')
+def jobs_status_command():
+    """Show job counts by status and the most recent failures."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('SELECT status, COUNT(1) FROM jobs GROUP BY status ORDER BY status')
+    counts = c.fetchall()
+    c.execute("SELECT id, kind, attempts, COALESCE(last_error,'') FROM jobs WHERE status='failed' ORDER BY id DESC LIMIT 10")
+    failures = c.fetchall()
+    conn.close()
+    print(', '.join(f'{status}: {n}' for status, n in counts) or 'No jobs.')
+    for job_id, kind, attempts, error in failures:
+        print(f"FAILED #{job_id} {kind} after {attempts} attempt(s): {error}")
+
+
+# --- Group cycle scheduler ---
+# One set-based pass over all groups: activate the ones that filled up, roll due dates
+# whose cycle has passed, and turn cycles with no recorded contribution into
+# payment_missed trust events once the grace period is over. Runs periodically as a
+# `group_cycle` job, right after a join that may complete a group, and from
+# `flask --app app group-cycle`. Every step is idempotent.
+GROUP_CYCLE_DAYS = 30
+GROUP_CYCLE_INTERVAL_SECONDS = max(0, int(os.environ.get('DCONT_GROUP_CYCLE_INTERVAL_SECONDS', '3600') or 3600))
+
+_ISO_DATE_GLOB = "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+
+
+def run_group_cycle(conn, today: date = None) -> dict:
+    """Advance every group to `today` (default: now). The caller commits."""
+    today = today or date.today()
+    today_iso = today.isoformat()
+    grace_days = _get_trust_grace_days()
+    c = conn.cursor()
+
+    # 1) Activate full groups (first due date one cycle out).
+    c.execute(
+        """
+        UPDATE groups
+        SET status=CASE WHEN LOWER(TRIM(COALESCE(status,''))) IN ('','formation','active') THEN 'active' ELSE status END,
+            activated_at=COALESCE(NULLIF(activated_at,''), ?),
+            next_due_date=COALESCE(NULLIF(next_due_date,''), ?),
+            pay_cutoff_time=COALESCE(NULLIF(pay_cutoff_time,''), ?),
+            payout_receiver_username=NULL,
+            payout_receiver_name=NULL,
+            payout_receiver_upi=NULL,
+            receiver_selected_at=NULL
+        WHERE COALESCE(is_paused,0)=0
+          AND LOWER(TRIM(COALESCE(status,''))) <> 'completed'
+          AND (COALESCE(activated_at,'')='' OR COALESCE(next_due_date,'')='')
+          AND COALESCE(joined_count,0) >= MAX(1, COALESCE(max_members,10))
+        """,
+        (today_iso, (today + timedelta(days=GROUP_CYCLE_DAYS)).isoformat(), DEFAULT_PAY_CUTOFF_TIME),
+    )
+    activated = c.rowcount
+
+    # 2) Roll passed due dates to the first cycle date on/after today; the new cycle
+    #    starts without a receiver.
+    c.execute(
+        f"""
+        UPDATE groups
+        SET previous_due_date=next_due_date,
+            missed_checked_at=NULL,
+            next_due_date=date(
+                next_due_date,
+                '+' || ({GROUP_CYCLE_DAYS} * ((CAST(julianday(?) - julianday(next_due_date) AS INTEGER) + {GROUP_CYCLE_DAYS - 1}) / {GROUP_CYCLE_DAYS})) || ' days'
+            ),
+            payout_receiver_username=NULL,
+            payout_receiver_name=NULL,
+            payout_receiver_upi=NULL,
+            receiver_selected_at=NULL
+        WHERE LOWER(TRIM(COALESCE(status,'')))='active'
+          AND COALESCE(is_paused,0)=0
+          AND TRIM(COALESCE(next_due_date,'')) GLOB {_ISO_DATE_GLOB}
+          AND next_due_date < ?
+        """,
+        (today_iso, today_iso),
+    )
+    rolled = c.rowcount
+
+    # 3) Missed contributions for the previous cycle, once its grace period is over.
+    #    Only cycles where the owner recorded at least one verified contribution count;
+    #    groups whose payments aren't tracked in the app are left alone.
+    c.execute('SELECT COALESCE(MAX(id),0) FROM trust_events')
+    last_event_id = int((c.fetchone() or [0])[0] or 0)
+    due_groups_sql = f"""
+        SELECT g.id, g.previous_due_date
+        FROM groups g
+        WHERE g.missed_checked_at IS NULL
+          AND TRIM(COALESCE(g.previous_due_date,'')) GLOB {_ISO_DATE_GLOB}
+          AND julianday(?) - julianday(g.previous_due_date) > ?
+    """
+    c.execute(
+        f"""
+        INSERT INTO trust_events (username, event_type, group_id, due_date, verified_at, created_at, note)
+        SELECT gm.username, 'payment_missed', d.id, d.previous_due_date, '', ?, 'Auto: no contribution recorded for this cycle'
+        FROM ({due_groups_sql}) d
+        JOIN group_members gm ON gm.group_id = d.id AND gm.status='joined'
+        WHERE EXISTS (
+                SELECT 1 FROM trust_events t
+                WHERE t.group_id = d.id AND t.due_date = d.previous_due_date
+                  AND LOWER(TRIM(COALESCE(t.event_type,'')))='contribution_verified'
+            )
+          AND NOT EXISTS (
+                SELECT 1 FROM trust_events t
+                WHERE t.username = gm.username AND t.group_id = d.id AND t.due_date = d.previous_due_date
+                  AND LOWER(TRIM(COALESCE(t.event_type,''))) IN ('contribution_verified', 'contribution_rejected', 'payment_missed')
+            )
+        """,
+        (today_iso, today_iso, grace_days),
+    )
+    missed = c.rowcount
+    c.execute(
+        f"UPDATE groups SET missed_checked_at=? WHERE id IN (SELECT id FROM ({due_groups_sql}))",
+        (today_iso, today_iso, grace_days),
+    )
+    if missed:
+        c.execute('SELECT DISTINCT username FROM trust_events WHERE id > ?', (last_event_id,))
+        rebuild_trust_aggregates(conn, [r[0] for r in c.fetchall()], grace_days=grace_days)
+
+    # 4) The groups triggers already track these changes; a full rebuild also repairs
+    #    any drift from rows written with the triggers missing.
+    scheduled = refresh_due_schedule(conn)
+
+    return {'activated': activated, 'rolled': rolled, 'missed': missed, 'scheduled': scheduled}
+
+
+def _queue_group_activation(conn) -> None:
+    """Run a cycle pass as soon as the caller commits (a join may have filled a group)."""
+    enqueue_job(conn, 'group_cycle', {}, idempotency_key='group_cycle:activation')
+
+
+@job_handler('group_cycle')
+def _job_group_cycle(conn, payload: dict) -> None:
+    result = run_group_cycle(conn)
+    if result['activated'] or result['rolled'] or result['missed']:
+        app.logger.info('Group cycle: %s', result)
+
+
+if GROUP_CYCLE_INTERVAL_SECONDS:
+    PERIODIC_JOBS['group_cycle'] = GROUP_CYCLE_INTERVAL_SECONDS
+
+
+@app.cli.command('group-cycle')
+def group_cycle_command():
+    """Activate full groups, roll due dates and record missed contributions."""
+    conn = get_db()
+    result = run_group_cycle(conn)
+    conn.commit()
+    conn.close()
+    print(
+        f"Activated {result['activated']} group(s), rolled {result['rolled']} due date(s), "
+        f"recorded {result['missed']} missed contribution(s); {result['scheduled']} group(s) on the due schedule."
+    )
+
+
+# --- Server-side session store ---
+# Bulky per-visitor state (support chat history, the pending WhatsApp handoff) lives in
+# session_store rather than in the signed cookie, which only carries an opaque `sid`.
+# A row is loaded at most once per request, written back after the request if it
+# changed, only served to the username that wrote it, and dropped once it expires.
+SESSION_STORE_TTL_SECONDS = max(60, int(os.environ.get('DCONT_SESSION_STORE_TTL', str(2 * 24 * 3600)) or 60))
+SESSION_STORE_PURGE_SECONDS = 3600
+# Keys that older cookies still carry; moved into the store on first access.
+_SESSION_STORE_COOKIE_KEYS = ('bot_history', 'whatsapp_handoff_url', 'whatsapp_handoff_message')
+
+
+class ServerSession(dict):
+    """Session data kept server-side; remembers whether it changed."""
+
+    modified = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def pop(self, key, default=None):
+        if key in self:
+            self.modified = True
+        return super().pop(key, default)
+
+
+def server_session() -> ServerSession:
+    """This visitor's server-side session data."""
+    data = g.get('_server_session')
+    if data is not None:
+        return data
+    data = ServerSession()
+    sid = session.get('sid')
+    if sid:
+        conn = get_db()
+        c = conn.cursor()
+        try:
+            c.execute(
+                "SELECT COALESCE(username,''), data FROM session_store WHERE sid=? AND expires_at > ?",
+                (sid, datetime.now().isoformat(timespec='seconds')),
+            )
+            row = c.fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        conn.close()
+        if row and row[0] == (session.get('username') or ''):
+            try:
+                dict.update(data, json.loads(row[1] or '{}'))
+            except ValueError:
+                pass
+    for key in _SESSION_STORE_COOKIE_KEYS:
+        if key in session:
+            data[key] = session.pop(key)
+    g._server_session = data
+    return data
+
+
+@app.after_request
+def _save_server_session(response):
+    data = g.get('_server_session')
+    if data is None or not data.modified:
+        return response
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        if data:
+            sid = session.get('sid') or secrets.token_urlsafe(24)
+            c.execute(
+                """
+                INSERT INTO session_store (sid, username, data, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(sid) DO UPDATE SET
+                    username=excluded.username, data=excluded.data, expires_at=excluded.expires_at
+                """,
+                (
+                    sid,
+                    session.get('username') or '',
+                    json.dumps(data),
+                    (datetime.now() + timedelta(seconds=SESSION_STORE_TTL_SECONDS)).isoformat(timespec='seconds'),
+                ),
+            )
+            session['sid'] = sid
+        elif session.get('sid'):
+            c.execute('DELETE FROM session_store WHERE sid=?', (session.pop('sid'),))
+        conn.commit()
     except sqlite3.OperationalError:
-        row = None
+        app.logger.warning('Could not save server-side session data')
+    conn.close()
+    return response
+
+
+@job_handler('session_store_purge')
+def _job_session_store_purge(conn, payload: dict) -> None:
+    c = conn.cursor()
+    c.execute('DELETE FROM session_store WHERE expires_at <= ?', (datetime.now().isoformat(timespec='seconds'),))
+
+
+PERIODIC_JOBS['session_store_purge'] = SESSION_STORE_PURGE_SECONDS
+
+
+# --- Settings cache ---
+# The whole settings table is loaded in one query and served from memory. Writes bump a
+# version row; other workers notice it the next time their TTL lapses (one tiny SELECT)
+# and reload only if it moved. The writing worker drops its copy immediately.
+SETTINGS_CACHE_TTL_SECONDS = max(0.0, float(os.environ.get('DCONT_SETTINGS_CACHE_TTL', '30') or 30))
+_SETTINGS_VERSION_KEY = '__settings_version__'
+_settings_cache = {'values': None, 'version': None, 'checked_at': 0.0}
+_settings_cache_lock = threading.Lock()
+
+
+def invalidate_settings_cache() -> None:
+    with _settings_cache_lock:
+        _settings_cache['values'] = None
+        _settings_cache['version'] = None
+        _settings_cache['checked_at'] = 0.0
+
+
+def _settings_snapshot() -> dict:
+    now = time.monotonic()
+    with _settings_cache_lock:
+        values = _settings_cache['values']
+        cached_version = _settings_cache['version']
+        if values is not None and (now - _settings_cache['checked_at']) < SETTINGS_CACHE_TTL_SECONDS:
+            return values
+
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        if values is not None:
+            c.execute('SELECT value FROM settings WHERE key=?', (_SETTINGS_VERSION_KEY,))
+            row = c.fetchone()
+            if (row[0] if row else None) == cached_version:
+                conn.close()
+                with _settings_cache_lock:
+                    if _settings_cache['values'] is values:
+                        _settings_cache['checked_at'] = now
+                return values
+        c.execute('SELECT key, value FROM settings')
+        rows = c.fetchall()
+    except sqlite3.OperationalError:
+        conn.close()
+        return {}
+    conn.close()
+
+    fresh = {}
+    version = None
+    for key, value in rows:
+        if key == _SETTINGS_VERSION_KEY:
+            version = value
+        elif value is not None:
+            fresh[key] = str(value)
+    with _settings_cache_lock:
+        _settings_cache['values'] = fresh
+        _settings_cache['version'] = version
+        _settings_cache['checked_at'] = now
+    return fresh
+
+
+def get_setting(key: str, default: str = "") -> str:
+    value = _settings_snapshot().get(key)
+    if value is None:
+        return default
+    return value
+
+
+def settings_version() -> str:
+    """Version of the settings snapshot get_setting() is currently serving."""
+    _settings_snapshot()
+    with _settings_cache_lock:
+        return str(_settings_cache['version'] or 0)
+
+
+def set_settings(values: dict) -> None:
+    conn = get_db()
+    c = conn.cursor()
+    c.executemany(
+        'INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value',
+        [(key, str(value)) for key, value in values.items()],
+    )
+    c.execute(
+        "INSERT INTO settings (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value=CAST(CAST(COALESCE(value,'0') AS INTEGER) + 1 AS TEXT)",
+        (_SETTINGS_VERSION_KEY,),
+    )
+    conn.commit()
     conn.close()
-    if not row or row[0] is None:
-        return default
-    return str(row[0])
+    invalidate_settings_cache()
 
 
 def set_setting(key: str, value: str) -> None:
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value', (key, str(value)))
-    conn.commit()
-    conn.close()
+    set_settings({key: value})
+
+
+# --- Template fragment cache ---
+# {% cache 'name', part, ... %}...{% endcache %} renders its body once per key and reuses
+# the HTML until the key changes. The key is (template, name, language, role, *parts);
+# pass data_version('groups', ...) as a part to re-render whenever those tables change.
+# Entries live in a per-worker LRU; invalidate_fragments() drops them explicitly.
+# Only cache markup that costs more than the lookup: a 50-group Owner -> Groups table
+# renders in about 5 ms, the nav bars in well under 0.1 ms (so they aren't cached).
+FRAGMENT_CACHE_MAX_ENTRIES = max(0, int(os.environ.get('DCONT_FRAGMENT_CACHE_MAX_ENTRIES', '512') or 0))
+_fragment_cache = OrderedDict()
+_fragment_cache_lock = threading.Lock()
+
+
+def invalidate_fragments(name: str = None) -> None:
+    """Drop cached fragments called `name` (all of them if None)."""
+    with _fragment_cache_lock:
+        if name is None:
+            _fragment_cache.clear()
+            return
+        for key in [k for k in _fragment_cache if k[1] == name]:
+            del _fragment_cache[key]
+
+
+_DATA_VERSIONS_SQL = 'SELECT scope, version FROM data_versions WHERE scope IN ({scopes})'
+
+
+def data_version(*scopes: str) -> str:
+    """Current write counters of `scopes` (tables or 'user:<name>'), e.g. '12.7'.
+
+    Each scope is read at most once per request.
+    """
+    versions = g.setdefault('_data_versions', {}) if has_app_context() else {}
+    missing = [scope for scope in dict.fromkeys(scopes) if scope not in versions]
+    if missing:
+        conn = get_db()
+        c = conn.cursor()
+        try:
+            c.execute(_DATA_VERSIONS_SQL.format(scopes=','.join('?' * len(missing))), missing)
+            found = dict(c.fetchall())
+        except sqlite3.OperationalError:
+            found = {}
+        conn.close()
+        for scope in missing:
+            versions[scope] = found.get(scope, 0)
+    return '.'.join(str(versions[scope]) for scope in scopes)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.Const(parser.name), nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, template_name, parts, caller):
+        role = (session.get('role') or '') if has_request_context() else ''
+        key = (template_name, parts[0], _request_lang() if has_request_context() else 'en', role, *parts[1:])
+        try:
+            hash(key)
+        except TypeError:
+            return caller()
+        if FRAGMENT_CACHE_MAX_ENTRIES <= 0:
+            return caller()
+        with _fragment_cache_lock:
+            html = _fragment_cache.get(key)
+            if html is not None:
+                _fragment_cache.move_to_end(key)
+                return html
+        html = caller()
+        with _fragment_cache_lock:
+            _fragment_cache[key] = html
+            _fragment_cache.move_to_end(key)
+            while len(_fragment_cache) > FRAGMENT_CACHE_MAX_ENTRIES:
+                _fragment_cache.popitem(last=False)
+        return html
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.globals['data_version'] = data_version
 
 
 def is_join_blocked(username: str) -> bool:
@@ -3937,12 +6072,14 @@ def is_join_blocked(username: str) -> bool:
     return int(row[0] if row[0] is not None else 0) == 1
 
 
-# Ensure DB is ready when imported by WSGI servers (e.g., Gunicorn)
-try:
-    init_db()
-except Exception:
-    # Best-effort: the app will surface DB errors on requests if init fails.
-    pass
+# Ensure DB is ready when imported by WSGI servers (e.g., Gunicorn).
+# At head this costs one SELECT; set DCONT_AUTO_MIGRATE=0 to require `flask --app app db-migrate`.
+if (os.environ.get('DCONT_AUTO_MIGRATE', '1') or '').strip().lower() not in {'0', 'false', 'no'}:
+    try:
+        init_db()
+    except Exception:
+        # Best-effort: the app will surface DB errors on requests if init fails.
+        pass
 
 @app.route('/terms')
 def terms():
@@ -3982,16 +6119,26 @@ def dashboard():
     return redirect(url_for('owner_dashboard'))
 
 
-@app.route('/owner/dashboard')
-@admin_required
-def owner_dashboard():
+# --- Owner dashboard sources ---
+# Each source opens its own connection (they run outside the request context) and
+# gets its own deadline; a late source renders as "still loading" and a failed one as
+# "unavailable" instead of holding up or breaking the page.
+DASHBOARD_SQL_TIMEOUT_SECONDS = float(os.environ.get('DCONT_DASHBOARD_SQL_TIMEOUT', '2') or 2)
+_dashboard_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='owner-dashboard')
+
+
+def _dashboard_user_counts() -> dict:
     conn = get_db()
     c = conn.cursor()
-
     c.execute("SELECT COUNT(*) FROM users WHERE COALESCE(NULLIF(role,''), 'customer') != 'admin'")
     total_users = int((c.fetchone() or [0])[0] or 0)
+    conn.close()
+    return {'total_users': total_users}
 
-    month_key = _current_month_key()
+
+def _dashboard_app_fee(month_key: str) -> dict:
+    conn = get_db()
+    c = conn.cursor()
     app_fee_paid_count = 0
     try:
         c.execute("SELECT COUNT(*) FROM app_fee_payments WHERE month=?", (month_key,))
@@ -4010,24 +6157,33 @@ def owner_dashboard():
         app_fee_amount = 0
     app_fee_collected = app_fee_paid_count * max(app_fee_amount, 0)
     try:
-        c.execute("SELECT COALESCE(SUM(COALESCE(net_amount,0)),0) FROM app_fee_payments WHERE month=?", (month_key,))
+        c.execute(_APP_FEE_MONTH_TOTAL_SQL, (month_key,))
         app_fee_collected = int((c.fetchone() or [0])[0] or 0)
     except sqlite3.OperationalError:
         pass
+    conn.close()
+    return {
+        'app_fee_amount': app_fee_amount,
+        'app_fee_paid_count': app_fee_paid_count,
+        'app_fee_collected': app_fee_collected,
+    }
 
+
+def _dashboard_group_tallies() -> dict:
+    conn = get_db()
+    c = conn.cursor()
     c.execute(
         """
         SELECT g.id,
                COALESCE(g.max_members, 10) as max_members,
                COALESCE(g.status, '') as status,
                COALESCE(g.is_paused, 0) as is_paused,
-               COUNT(gm.id) as joined_members
+               COALESCE(g.joined_count, 0) as joined_members
         FROM groups g
-        LEFT JOIN group_members gm ON gm.group_id = g.id AND gm.status='joined'
-        GROUP BY g.id, g.max_members, g.status, g.is_paused
         """
     )
     group_rows = c.fetchall()
+    conn.close()
 
     active_groups = 0
     formation_groups = 0
@@ -4047,112 +6203,313 @@ def owner_dashboard():
                 active_groups += 1
             else:
                 formation_groups += 1
+    return {
+        'active_groups': active_groups,
+        'formation_groups': formation_groups,
+        'completed_groups': completed_groups,
+    }
 
-    defaults_this_month = 0  # Placeholder until contribution tracking exists
 
-    # Fetch pending group joins
-    c = conn.cursor()
-    c.execute('''
-        SELECT gm.username, u.full_name, u.mobile, g.name as group_name
-        FROM group_members gm
-        JOIN users u ON u.username = gm.username
-        JOIN groups g ON g.id = gm.group_id
-        WHERE gm.status = 'joined'
-        ORDER BY gm.id DESC
-        LIMIT 20
-    ''')
-    pending_joins = c.fetchall()
+def _gather_dashboard_sources(sources: dict) -> tuple[dict, list[str], list[str]]:
+    """Run {name: (fn, args, timeout_seconds)} concurrently.
 
-    # Fetch document uploads from Supabase user_documents
-    pending_docs = []
-    try:
-        url = f"{SUPABASE_URL}/rest/v1/user_documents"
-        headers = {
-            "apikey": SUPABASE_SERVICE_ROLE_KEY,
-            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        }
-        params = {
-            "status": "eq.pending",
-            "order": "created_at.desc",
-            "limit": 20
+    Returns the merged results of the sources that finished in time, the names of
+    those still running at their deadline and the names of those that raised.
+    """
+    started = time.monotonic()
+    futures = {
+        name: (_dashboard_executor.submit(fn, *args), timeout)
+        for name, (fn, args, timeout) in sources.items()
+    }
+    merged = {}
+    late = []
+    failed = []
+    for name, (future, timeout) in futures.items():
+        remaining = max(0.0, started + timeout - time.monotonic())
+        try:
+            merged.update(future.result(timeout=remaining))
+        except FuturesTimeoutError:
+            app.logger.warning('owner dashboard: %s still loading after %.1fs', name, timeout)
+            late.append(name)
+        except Exception:
+            app.logger.exception('owner dashboard: %s failed', name)
+            failed.append(name)
+    return merged, late, failed
+
+
+@app.route('/owner/dashboard')
+@admin_required
+def owner_dashboard():
+    data, loading, unavailable = _gather_dashboard_sources(
+        {
+            'users': (_dashboard_user_counts, (), DASHBOARD_SQL_TIMEOUT_SECONDS),
+            'app_fee': (_dashboard_app_fee, (_current_month_key(),), DASHBOARD_SQL_TIMEOUT_SECONDS),
+            'groups': (_dashboard_group_tallies, (), DASHBOARD_SQL_TIMEOUT_SECONDS),
         }
-        resp = requests.get(url, headers=headers, params=params)
-        if resp.ok:
-            pending_docs = resp.json()
-    except Exception as e:
-        print(f"[Supabase user_documents] Error: {e}")
+    )
+    defaults_this_month = 0  # Placeholder until contribution tracking exists
 
-    conn.close()
     return render_template(
         'owner_dashboard.html',
         active_owner_tab='dashboard',
-        total_users=total_users,
-        active_groups=active_groups,
-        formation_groups=formation_groups,
-        completed_groups=completed_groups,
+        loading=loading,
+        unavailable=unavailable,
+        total_users=data.get('total_users'),
+        active_groups=data.get('active_groups'),
+        formation_groups=data.get('formation_groups'),
+        completed_groups=data.get('completed_groups'),
         defaults_this_month=defaults_this_month,
-        app_fee_amount=app_fee_amount,
-        app_fee_paid_count=app_fee_paid_count,
-        app_fee_collected=app_fee_collected,
-        pending_joins=pending_joins,
-        pending_docs=pending_docs,
+        app_fee_amount=data.get('app_fee_amount'),
+        app_fee_paid_count=data.get('app_fee_paid_count'),
+        app_fee_collected=data.get('app_fee_collected'),
     )
 
 
+# --- Owner listing pagination ---
+# Owner lists are keyset-paginated on the table's integer id, newest first. `after`
+# pages towards older rows, `before` back towards newer ones; cursors are plain ids so
+# rows inserted meanwhile never shift a page. Search/filters go into the WHERE clause.
+OWNER_PAGE_SIZE = 50
+OWNER_PAGE_SIZE_MAX = 200
+
+
+def _owner_page_args(prefix: str = '') -> dict:
+    """Read per_page/after/before (optionally namespaced, e.g. 'blocked_after')."""
+    def _int_arg(name):
+        raw = (request.args.get(name) or '').strip()
+        try:
+            return int(raw) if raw else None
+        except ValueError:
+            return None
+
+    per_page = _int_arg('per_page') or OWNER_PAGE_SIZE
+    return {
+        'prefix': prefix,
+        'limit': max(1, min(OWNER_PAGE_SIZE_MAX, per_page)),
+        'after': _int_arg(f'{prefix}after'),
+        'before': _int_arg(f'{prefix}before'),
+    }
+
+
+def _keyset_clause(id_expr: str, page: dict) -> tuple[str, list, str]:
+    """(extra WHERE condition, its params, ORDER BY) for one page; fetch page['limit'] + 1 rows."""
+    if page['before'] is not None:
+        return f'{id_expr} > ?', [page['before']], f'{id_expr} ASC'
+    if page['after'] is not None:
+        return f'{id_expr} < ?', [page['after']], f'{id_expr} DESC'
+    return '1=1', [], f'{id_expr} DESC'
+
+
+def _keyset_finish(rows: list, page: dict, row_id=lambda r: r[0]) -> tuple[list, dict]:
+    """Trim the probe row, restore newest-first order and build prev/next links."""
+    limit = page['limit']
+    more = len(rows) > limit
+    rows = list(rows[:limit])
+    backwards = page['before'] is not None
+    if backwards:
+        rows.reverse()
+    has_next = (not backwards and more) or (backwards and bool(rows))
+    has_prev = (backwards and more) or (not backwards and page['after'] is not None)
+
+    def _url(**cursor):
+        args = request.args.to_dict()
+        for key in ('after', 'before'):
+            args.pop(f"{page['prefix']}{key}", None)
+        args.update({f"{page['prefix']}{k}": v for k, v in cursor.items()})
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    pager = {
+        'next_url': _url(after=row_id(rows[-1])) if has_next and rows else '',
+        'prev_url': _url(before=row_id(rows[0])) if has_prev and rows else '',
+        'first_url': _url() if (backwards or page['after'] is not None) else '',
+        'per_page': limit,
+    }
+    return rows, pager
+
+
+def _like_pattern(q: str) -> str:
+    escaped = (q or '').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+# --- Owner user search ---
+# Backed by users_fts (see _migration_users_fts): every search term must match the start
+# of a word in username, full name, normalized mobile, email or referral code. Without
+# FTS5 the same terms fall back to LIKE over the users table.
+USER_SEARCH_LIMIT = 20
+USER_SEARCH_LIMIT_MAX = 50
+USER_SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 2.0, 3.0)  # bm25, in USERS_FTS_COLUMNS order
+_USER_SEARCH_COLUMNS = """
+    users.id, users.username, COALESCE(users.full_name,''), COALESCE(users.mobile,''),
+    COALESCE(users.email,''), COALESCE(users.referral_code,''),
+    COALESCE(users.is_active,1), COALESCE(users.join_blocked,0), COALESCE(users.trust_score,50)
+"""
+_USER_SEARCH_FTS_SQL = f"""
+    SELECT {_USER_SEARCH_COLUMNS}
+    FROM users_fts
+    JOIN users ON users.id = users_fts.rowid
+    WHERE users_fts MATCH ? AND {CUSTOMER_ONLY_SQL}
+    ORDER BY bm25(users_fts, {', '.join(str(w) for w in USER_SEARCH_WEIGHTS)}), users.id DESC
+    LIMIT ?
+"""
+
+
+def _user_search_terms(q: str) -> list[str]:
+    q = (q or '').strip()
+    if re.fullmatch(r'[\d\s+().-]+', q) and re.search(r'\d', q):
+        # A phone number in any format is one term: its normalized digits.
+        return [_normalize_mobile_digits(q)]
+    # Same word characters as the unicode61 tokenizer (so '_' separates words).
+    return re.findall(r'[^\W_]+', q)
+
+
+def _users_fts_available(c) -> bool:
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'")
+    return c.fetchone() is not None
+
+
+def _users_fts_match(terms: list[str]) -> str:
+    # Terms are plain word characters, so quoting them is enough to escape FTS syntax.
+    return ' '.join(f'"{t}"*' for t in terms)
+
+
+def _user_search_condition(c, q: str) -> tuple[str, list]:
+    """WHERE condition on users (unaliased) matching every term of `q`."""
+    terms = _user_search_terms(q)
+    if not terms:
+        return '1=1', []
+    if _users_fts_available(c):
+        return 'id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)', [_users_fts_match(terms)]
+    any_column = ' OR '.join(f"{col} LIKE ? ESCAPE '\\'" for col in USERS_FTS_COLUMNS)
+    conditions = ' AND '.join(f'({any_column})' for _ in terms)
+    return conditions, [_like_pattern(t) for t in terms for _ in USERS_FTS_COLUMNS]
+
+
+def search_users(conn, q: str, limit: int = USER_SEARCH_LIMIT) -> list[dict]:
+    """Customers matching `q`, best match first (bm25; newest first without FTS5)."""
+    terms = _user_search_terms(q)
+    if not terms:
+        return []
+    c = conn.cursor()
+    if _users_fts_available(c):
+        c.execute(_USER_SEARCH_FTS_SQL, (_users_fts_match(terms), limit))
+    else:
+        condition, params = _user_search_condition(c, q)
+        c.execute(
+            f"""
+            SELECT {_USER_SEARCH_COLUMNS}
+            FROM users
+            WHERE {condition} AND {CUSTOMER_ONLY_SQL}
+            ORDER BY users.id DESC
+            LIMIT ?
+            """,
+            (*params, limit),
+        )
+    return [
+        {
+            'id': int(r[0]),
+            'username': r[1] or '',
+            'full_name': r[2] or '',
+            'mobile': r[3] or '',
+            'email': r[4] or '',
+            'referral_code': r[5] or '',
+            'is_active': int(r[6] or 0),
+            'join_blocked': int(r[7] or 0),
+            'trust_score': int(r[8] if r[8] is not None else 50),
+        }
+        for r in c.fetchall()
+    ]
+
+
+@app.route('/owner/search/users')
+@admin_required
+def owner_search_users():
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = int(request.args.get('limit') or USER_SEARCH_LIMIT)
+    except ValueError:
+        limit = USER_SEARCH_LIMIT
+    limit = max(1, min(USER_SEARCH_LIMIT_MAX, limit))
+
+    conn = get_db()
+    try:
+        results = search_users(conn, q, limit)
+    except sqlite3.OperationalError:
+        conn.close()
+        return _json_error_response('Search is unavailable right now.', 503)
+    conn.close()
+    for r in results:
+        r['url'] = url_for('owner_user_profile', username=r['username'])
+    return jsonify({'q': q, 'results': results})
+
+
 @app.route('/owner/users')
 @admin_required
 def owner_users():
+    q = (request.args.get('q') or '').strip()
+    status_filter = (request.args.get('status') or '').strip().lower()
+    if status_filter not in {'active', 'blocked', 'frozen'}:
+        status_filter = ''
+    page = _owner_page_args()
+
     conn = get_db()
     c = conn.cursor()
+    where = [CUSTOMER_ONLY_SQL]
+    params = []
+    if q:
+        search_sql, search_params = _user_search_condition(c, q)
+        where.append(search_sql)
+        params += search_params
+    if status_filter == 'active':
+        where.append('COALESCE(is_active,1)=1')
+    elif status_filter in ('blocked', 'frozen'):
+        where.append(RISK_BUCKETS[status_filter])
+    cursor_sql, cursor_params, order_sql = _keyset_clause('id', page)
+    where.append(cursor_sql)
 
     c.execute(
-        """
-        SELECT username, full_name, mobile, COALESCE(NULLIF(role,''),'customer') as role,
+        f"""
+        SELECT id, username, full_name, mobile, COALESCE(NULLIF(role,''),'customer') as role,
                COALESCE(is_active,1) as is_active,
                COALESCE(join_blocked,0) as join_blocked,
                COALESCE(trust_score,50) as trust_score,
                COALESCE(app_fee_paid,0) as app_fee_paid
         FROM users
-        ORDER BY id DESC
-        """
+        WHERE {' AND '.join(where)}
+        ORDER BY {order_sql}
+        LIMIT ?
+        """,
+        (*params, *cursor_params, page['limit'] + 1),
     )
-    users_rows = c.fetchall()
+    users_rows, pager = _keyset_finish(c.fetchall(), page)
 
-    c.execute(
-        """
-        SELECT g.id,
-               COALESCE(g.max_members,10) as max_members,
-               COALESCE(g.status,'') as status,
-               COALESCE(g.is_paused,0) as is_paused,
-               COUNT(gm.id) as joined_members
-        FROM groups g
-        LEFT JOIN group_members gm ON gm.group_id=g.id AND gm.status='joined'
-        GROUP BY g.id, g.max_members, g.status, g.is_paused
-        """
-    )
-    group_meta = {}
-    for gid, max_members, status_raw, is_paused, joined_members in c.fetchall():
-        status = (status_raw or '').strip().lower()
-        if int(is_paused or 0) == 1:
-            label = 'paused'
-        elif status in {'active', 'formation', 'completed'}:
-            label = status
-        else:
-            label = 'active' if int(joined_members or 0) >= int(max_members or 10) else 'formation'
-        group_meta[int(gid)] = label
-
-    c.execute("SELECT username, group_id FROM group_members WHERE status='joined'")
-    memberships = c.fetchall()
-    per_user_group_ids = {}
-    for uname, gid in memberships:
-        if not uname:
-            continue
-        per_user_group_ids.setdefault(uname, []).append(int(gid))
+    # Active-group counts for this page only.
+    active_groups = {}
+    page_usernames = [r[1] for r in users_rows if r[1]]
+    if page_usernames:
+        c.execute(
+            f"""
+            SELECT gm.username, COUNT(DISTINCT g.id)
+            FROM group_members gm
+            JOIN groups g ON g.id = gm.group_id
+            WHERE gm.status='joined'
+              AND gm.username IN ({','.join('?' for _ in page_usernames)})
+              AND COALESCE(g.is_paused,0)=0
+              AND (
+                LOWER(TRIM(COALESCE(g.status,'')))='active'
+                OR (
+                  LOWER(TRIM(COALESCE(g.status,''))) NOT IN ('active','formation','completed')
+                  AND COALESCE(g.joined_count,0) >= COALESCE(g.max_members,10)
+                )
+              )
+            GROUP BY gm.username
+            """,
+            page_usernames,
+        )
+        active_groups = {uname: int(n or 0) for uname, n in c.fetchall()}
 
     users = []
-    for username, full_name, mobile, role, is_active, join_blocked, trust_score, app_fee_paid in users_rows:
-        group_ids = per_user_group_ids.get(username, [])
-        active_group_count = sum(1 for gid in group_ids if group_meta.get(gid) == 'active')
+    for _id, username, full_name, mobile, role, is_active, join_blocked, trust_score, app_fee_paid in users_rows:
         flags = []
         if int(join_blocked or 0) == 1:
             flags.append('Future frozen')
@@ -4165,14 +6522,21 @@ def owner_users():
                 'is_active': int(is_active or 1),
                 'join_blocked': int(join_blocked or 0),
                 'trust_score': int(trust_score if trust_score is not None else 50),
-                'active_groups': int(active_group_count),
+                'active_groups': active_groups.get(username, 0),
                 'flags': ', '.join(flags) if flags else '—',
                 'app_fee_paid': int(app_fee_paid or 0),
             }
         )
 
     conn.close()
-    return render_template('owner_users.html', active_owner_tab='users', users=users)
+    return render_template(
+        'owner_users.html',
+        active_owner_tab='users',
+        users=users,
+        pager=pager,
+        q=q,
+        status_filter=status_filter,
+    )
 
 
 
@@ -4190,6 +6554,7 @@ def owner_approve_document():
     try:
         c.execute('UPDATE documents SET status=? WHERE id=?', ('approved', doc_id))
         conn.commit()
+        get_supabase_client().invalidate("user_documents")
         flash('Document approved.')
     except Exception:
         flash('Could not approve document.')
@@ -4200,7 +6565,9 @@ def owner_approve_document():
 @admin_required
 def owner_user_profile(username):
     username = (username or '').strip()
-    trust_details = recalculate_and_store_trust(username)
+    trust_version = data_version('trust_events')
+    transactions_version = data_version('transactions', 'groups')
+    trust_details = get_trust_details(username, events_limit=25)
     conn = get_db()
     c = conn.cursor()
     c.execute(
@@ -4251,26 +6618,20 @@ def owner_user_profile(username):
     # Fetch all documents uploaded by this user from Supabase user_documents
     user_docs = []
     try:
-        url = f"{SUPABASE_URL}/rest/v1/user_documents"
-        headers = {
-            "apikey": SUPABASE_SERVICE_ROLE_KEY,
-            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        }
-        params = {
-            "user_id": f"eq.{username}",
-            "order": "created_at.desc"
-        }
-        resp = requests.get(url, headers=headers, params=params)
-        if resp.ok:
-            user_docs = [
-                (
-                    doc.get('doc_type'),
-                    doc.get('file_path'),
-                    doc.get('file_url'),
-                    doc.get('status'),
-                    doc.get('created_at')
-                ) for doc in resp.json()
-            ]
+        rows = get_supabase_client().select(
+            "user_documents",
+            {"user_id": f"eq.{username}", "order": "created_at.desc"},
+            cached=True,
+        )
+        user_docs = [
+            (
+                doc.get('doc_type'),
+                doc.get('file_path'),
+                doc.get('file_url'),
+                doc.get('status'),
+                doc.get('created_at')
+            ) for doc in rows
+        ]
     except Exception as e:
         print(f"[Supabase user_documents] Error: {e}")
     conn.close()
@@ -4301,6 +6662,8 @@ def owner_user_profile(username):
         trust_breakdown=trust_details.get('breakdown', {}),
         trust_events=(trust_details.get('events', [])[:25]),
         user_docs=user_docs,
+        trust_version=trust_version,
+        transactions_version=transactions_version,
     )
 
 
@@ -4330,7 +6693,8 @@ def owner_users_verify_app_fee():
 
     try:
         gross, credit_applied, net, month_key = _verify_app_fee_payment(conn, target_username)
-        _maybe_mark_referral_eligible(conn, target_username)
+        enqueue_job(conn, 'referral_eligibility', {'username': target_username},
+                    idempotency_key=f'referral_eligibility:{target_username}')
         conn.commit()
     except sqlite3.OperationalError:
         conn.close()
@@ -4411,18 +6775,16 @@ def owner_add_trust_event():
     if event_type not in allowed:
         flash('Invalid event type.')
         return redirect(url_for('owner_user_profile', username=target_username))
+    due = _parse_iso_date(due_date)
+    verified = _parse_iso_date(verified_at)
     if event_type == 'contribution_verified':
-        if not _parse_iso_date(due_date):
+        if not due:
             flash('For verified contributions, due date is required (YYYY-MM-DD).')
             return redirect(url_for('owner_user_profile', username=target_username))
-        if not _parse_iso_date(verified_at):
-            verified_at = _today_iso()
-    else:
-        # Other events can omit dates
-        if verified_at and not _parse_iso_date(verified_at):
-            verified_at = ''
-        if due_date and not _parse_iso_date(due_date):
-            due_date = ''
+        verified = verified or date.today()
+    # Other events can omit dates. Store them zero-padded, the form the trust counters read.
+    due_date = due.isoformat() if due else ''
+    verified_at = verified.isoformat() if verified else ''
 
     conn = get_db()
     c = conn.cursor()
@@ -4441,10 +6803,10 @@ def owner_add_trust_event():
         'INSERT INTO trust_events (username, event_type, group_id, due_date, verified_at, created_at, note) VALUES (?,?,?,?,?,?,?)',
         (target_username, event_type, group_id, due_date, verified_at, _today_iso(), note),
     )
+    record_trust_event(conn, target_username, c.lastrowid, event_type, due_date, verified_at)
     conn.commit()
     conn.close()
 
-    recalculate_and_store_trust(target_username)
     flash('Trust event recorded. Score updated.')
     return redirect(url_for('owner_user_profile', username=target_username))
 
@@ -4533,9 +6895,14 @@ def owner_delete_user():
     return redirect(url_for('owner_user_profile', username=target_username))
 
 
+_DUE_TODAY_GROUP_IDS_SQL = 'SELECT group_id FROM due_schedule WHERE due_date=?'
+
+
 @app.route('/owner/groups')
 @admin_required
 def owner_groups():
+    # Read before the queries so a concurrent write can only make the cached table older-keyed.
+    groups_version = data_version('groups', 'group_members', 'user_directory', 'due_schedule')
     conn = get_db()
     c = conn.cursor()
     c.execute(
@@ -4552,19 +6919,20 @@ def owner_groups():
                COALESCE(g.payout_receiver_upi,'') as payout_receiver_upi,
                COALESCE(g.status,'') as status,
                COALESCE(g.is_paused,0) as is_paused,
-               COUNT(gm.id) as joined_members
+               COALESCE(g.joined_count,0) as joined_members
         FROM groups g
-        LEFT JOIN group_members gm ON gm.group_id=g.id AND gm.status='joined'
-        GROUP BY g.id, g.name, g.description, g.monthly_amount, g.max_members, g.receiver_name, g.receiver_upi,
-                 g.activated_at, g.next_due_date, g.pay_cutoff_time,
-                 g.payout_receiver_username, g.payout_receiver_name, g.payout_receiver_upi,
-                 g.status, g.is_paused
         ORDER BY g.monthly_amount, g.id
         """
     )
-    groups = []
+    rows = c.fetchall()
     today_iso = _today_iso()
-    for r in c.fetchall():
+    try:
+        c.execute(_DUE_TODAY_GROUP_IDS_SQL, (today_iso,))
+        due_today_ids = {int(r[0]) for r in c.fetchall()}
+    except sqlite3.OperationalError:
+        due_today_ids = set()
+    groups = []
+    for r in rows:
         groups.append(
             {
                 'id': r[0],
@@ -4583,24 +6951,23 @@ def owner_groups():
                 'status': (r[13] or '').strip().lower(),
                 'is_paused': int(r[14] or 0),
                 'joined_members': int(r[15] or 0),
-                'is_due_today': ((r[8] or '').strip() == today_iso),
+                'is_due_today': int(r[0]) in due_today_ids,
             }
         )
 
     receiver_candidates = {}
-    due_group_ids = [g['id'] for g in groups if g.get('is_due_today') and not (g.get('payout_receiver_username') or '').strip()]
-    if due_group_ids:
-        placeholders = ','.join(['?'] * len(due_group_ids))
+    if due_today_ids:
         try:
             c.execute(
-                f"""
+                """
                 SELECT gm.group_id, u.username, COALESCE(u.full_name,''), COALESCE(u.upi_id,'')
-                FROM group_members gm
+                FROM due_schedule d
+                JOIN group_members gm ON gm.group_id = d.group_id AND gm.status='joined'
                 LEFT JOIN users u ON u.username = gm.username
-                WHERE gm.status='joined' AND gm.group_id IN ({placeholders})
+                WHERE d.due_date=? AND d.receiver_username IS NULL
                 ORDER BY COALESCE(u.full_name,''), u.username
                 """,
-                tuple(due_group_ids),
+                (today_iso,),
             )
             for gid, uname, full_name, upi_id in c.fetchall():
                 receiver_candidates.setdefault(int(gid), []).append(
@@ -4647,6 +7014,7 @@ def owner_groups():
         join_requests=join_requests,
         receiver_candidates=receiver_candidates,
         today_iso=today_iso,
+        groups_version=groups_version,
     )
 
 
@@ -4880,6 +7248,23 @@ def owner_select_group_receiver():
     return redirect(url_for('owner_groups'))
 
 
+_OWNER_PAYMENTS_SQL = """
+    SELECT p.id,
+           p.username,
+           COALESCE(u.full_name,''),
+           COALESCE(u.mobile,''),
+           COALESCE(p.gross_amount,0),
+           COALESCE(p.credit_applied,0),
+           COALESCE(p.net_amount,0),
+           COALESCE(p.verified_at,'')
+    FROM app_fee_payments p
+    LEFT JOIN users u ON u.username = p.username
+    WHERE {where}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+
 @app.route('/owner/payments')
 @admin_required
 def owner_payments():
@@ -4895,25 +7280,23 @@ def owner_payments():
     month_key = (request.args.get('month') or '').strip()
     if not re.fullmatch(r"\d{4}-\d{2}", month_key or ""):
         month_key = _current_month_key()
+    q = (request.args.get('q') or '').strip()
+    page = _owner_page_args()
+    pager = None
     app_fee_payments = []
     try:
+        where = ['p.month=?']
+        params = [month_key]
+        if q:
+            where.append("(p.username LIKE ? ESCAPE '\\' OR u.full_name LIKE ? ESCAPE '\\' OR u.mobile LIKE ? ESCAPE '\\')")
+            params += [_like_pattern(q)] * 3
+        cursor_sql, cursor_params, order_sql = _keyset_clause('p.id', page)
         c.execute(
-            """
-            SELECT p.username,
-                   COALESCE(u.full_name,''),
-                   COALESCE(u.mobile,''),
-                   COALESCE(p.gross_amount,0),
-                   COALESCE(p.credit_applied,0),
-                   COALESCE(p.net_amount,0),
-                   COALESCE(p.verified_at,'')
-            FROM app_fee_payments p
-            LEFT JOIN users u ON u.username = p.username
-            WHERE p.month=?
-            ORDER BY p.id DESC
-            """,
-            (month_key,),
+            _OWNER_PAYMENTS_SQL.format(where=' AND '.join([*where, cursor_sql]), order=order_sql),
+            (*params, *cursor_params, page['limit'] + 1),
         )
-        for uname, full_name, mobile, gross, credit_applied, net, verified_at in c.fetchall() or []:
+        rows, pager = _keyset_finish(c.fetchall(), page)
+        for _id, uname, full_name, mobile, gross, credit_applied, net, verified_at in rows:
             app_fee_payments.append(
                 {
                     'username': uname,
@@ -4928,26 +7311,31 @@ def owner_payments():
     except sqlite3.OperationalError:
         # Fallback legacy behavior
         try:
+            cursor_sql, cursor_params, order_sql = _keyset_clause('id', page)
             c.execute(
-                """
-                SELECT username, full_name, mobile
+                f"""
+                SELECT id, username, full_name, mobile
                 FROM users
                 WHERE COALESCE(NULLIF(role,''), 'customer') != 'admin'
                   AND COALESCE(app_fee_paid,0)=1
-                ORDER BY id DESC
-                """
+                  AND {cursor_sql}
+                ORDER BY {order_sql}
+                LIMIT ?
+                """,
+                (*cursor_params, page['limit'] + 1),
             )
+            rows, pager = _keyset_finish(c.fetchall(), page)
             app_fee_payments = [
                 {
-                    'username': r[0],
-                    'full_name': r[1] or '',
-                    'mobile': r[2] or '',
+                    'username': r[1],
+                    'full_name': r[2] or '',
+                    'mobile': r[3] or '',
                     'gross': fee_amount,
                     'credit_applied': 0,
                     'amount': fee_amount,
                     'verified_at': '',
                 }
-                for r in c.fetchall()
+                for r in rows
             ]
         except sqlite3.OperationalError:
             app_fee_payments = []
@@ -4959,6 +7347,8 @@ def owner_payments():
         app_fee_amount=fee_amount,
         app_fee_payments=app_fee_payments,
         app_fee_month=month_key,
+        pager=pager,
+        q=q,
     )
 
 
@@ -5052,12 +7442,34 @@ def owner_users_unverify_app_fee():
 @app.route('/owner/referrals')
 @admin_required
 def owner_referrals():
+    q = (request.args.get('q') or '').strip()
+    status_filter = (request.args.get('status') or '').strip().upper()
+    if status_filter not in {'PENDING', 'ELIGIBLE', 'CREDITED'}:
+        status_filter = ''
+    page = _owner_page_args()
+    where = []
+    params = []
+    if q:
+        where.append(
+            "(r.referrer_username LIKE ? ESCAPE '\\' OR r.new_username LIKE ? ESCAPE '\\'"
+            " OR ru.full_name LIKE ? ESCAPE '\\' OR nu.full_name LIKE ? ESCAPE '\\' OR nu.mobile LIKE ? ESCAPE '\\')"
+        )
+        params += [_like_pattern(q)] * 5
+    if status_filter == 'PENDING':
+        where.append("UPPER(COALESCE(NULLIF(TRIM(r.status),''),'PENDING'))='PENDING'")
+    elif status_filter:
+        where.append("UPPER(TRIM(COALESCE(r.status,'')))=?")
+        params.append(status_filter)
+    cursor_sql, cursor_params, order_sql = _keyset_clause('r.id', page)
+    where.append(cursor_sql)
+
     conn = get_db()
     c = conn.cursor()
     rows = []
+    pager = None
     try:
         c.execute(
-            """
+            f"""
             SELECT r.id,
                    r.referrer_username,
                    COALESCE(ru.full_name,''),
@@ -5080,11 +7492,13 @@ def owner_referrals():
             FROM referrals r
             LEFT JOIN users ru ON ru.username = r.referrer_username
             LEFT JOIN users nu ON nu.username = r.new_username
-            ORDER BY r.id DESC
-            LIMIT 300
-            """
+            WHERE {' AND '.join(where)}
+            ORDER BY {order_sql}
+            LIMIT ?
+            """,
+            (*params, *cursor_params, page['limit'] + 1),
         )
-        rows = c.fetchall() or []
+        rows, pager = _keyset_finish(c.fetchall(), page)
     except sqlite3.OperationalError:
         rows = []
 
@@ -5116,6 +7530,9 @@ def owner_referrals():
         'owner_referrals.html',
         active_owner_tab='referrals',
         referrals=referrals,
+        pager=pager,
+        q=q,
+        status_filter=status_filter,
         referral_reward_amount=int(REFERRAL_REWARD_AMOUNT),
     )
 
@@ -5147,7 +7564,8 @@ def owner_referrals_verify_app_fee():
 
     try:
         gross, credit_applied, net, month_key = _verify_app_fee_payment(conn, new_username)
-        _maybe_mark_referral_eligible(conn, new_username)
+        enqueue_job(conn, 'referral_eligibility', {'username': new_username},
+                    idempotency_key=f'referral_eligibility:{new_username}')
         conn.commit()
     except sqlite3.OperationalError:
         conn.close()
@@ -5158,7 +7576,7 @@ def owner_referrals_verify_app_fee():
     if credit_applied > 0:
         flash(f"App fee verified for {month_key}. Credit applied: ₹{credit_applied}. Net paid: ₹{net}.")
     else:
-        flash('App fee marked as verified. Referral eligibility updated.')
+        flash('App fee marked as verified. Referral eligibility will refresh shortly.')
     return redirect(url_for('owner_referrals'))
 
 
@@ -5248,53 +7666,92 @@ def owner_referrals_mark_paid():
     return redirect(url_for('owner_referrals'))
 
 
+# --- Risk summary ---
+# Bucket sizes for the Risk page header: one COUNT per bucket, each answered from its
+# partial index, cached per worker against the 'users' write counter. Blocks, freezes
+# and trust score changes all bump it, so the next view recounts.
+_risk_summary_cache = {'counts': None, 'version': None}
+_risk_summary_lock = threading.Lock()
+
+
+_RISK_BUCKET_COUNT_SQL = 'SELECT COUNT(1) FROM users WHERE {customer} AND {condition}'
+_RISK_BUCKET_PAGE_SQL = """
+    SELECT id, username, full_name, mobile, COALESCE(trust_score,50) as trust_score
+    FROM users
+    WHERE {customer}
+      AND {condition}
+      AND {cursor}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+
+def risk_bucket_counts(conn) -> dict:
+    c = conn.cursor()
+    counts = {}
+    for bucket, condition in RISK_BUCKETS.items():
+        c.execute(_RISK_BUCKET_COUNT_SQL.format(customer=CUSTOMER_ONLY_SQL, condition=condition))
+        counts[bucket] = int((c.fetchone() or [0])[0] or 0)
+    return counts
+
+
+def get_risk_summary(conn) -> dict:
+    # Read the counter before counting: a write in between only means the next view recounts.
+    version = data_version('users')
+    with _risk_summary_lock:
+        if _risk_summary_cache['counts'] is not None and _risk_summary_cache['version'] == version:
+            return _risk_summary_cache['counts']
+    counts = risk_bucket_counts(conn)
+    with _risk_summary_lock:
+        _risk_summary_cache['counts'] = counts
+        _risk_summary_cache['version'] = version
+    return counts
+
+
+_OWNER_EARLY_PAYOUTS_SQL = """
+    SELECT r.id, r.username, COALESCE(u.full_name,''), COALESCE(u.mobile,''),
+           r.group_id, COALESCE(g.name,''), COALESCE(r.monthly_amount,0), COALESCE(r.deposit_amount,0),
+           COALESCE(r.status,''), COALESCE(r.deposit_status,''), COALESCE(r.utr,''), COALESCE(r.created_at,'')
+    FROM early_payout_requests r
+    LEFT JOIN users u ON u.username = r.username
+    LEFT JOIN groups g ON g.id = r.group_id
+    ORDER BY r.id DESC
+    LIMIT 50
+"""
+
+
 @app.route('/owner/risk')
 @admin_required
 def owner_risk():
+    # Each bucket pages on its own cursor (blocked_after=..., low_trust_before=...).
+    buckets = {}
+    risk_pagers = {}
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        """
-        SELECT username, full_name, mobile,
-               COALESCE(is_active,1) as is_active,
-               COALESCE(join_blocked,0) as join_blocked,
-               COALESCE(trust_score,50) as trust_score
-        FROM users
-        WHERE COALESCE(NULLIF(role,''), 'customer') != 'admin'
-        ORDER BY id DESC
-        """
-    )
-    rows = c.fetchall()
+    for bucket, condition in RISK_BUCKETS.items():
+        page = _owner_page_args(prefix=f'{bucket}_')
+        cursor_sql, cursor_params, order_sql = _keyset_clause('id', page)
+        c.execute(
+            _RISK_BUCKET_PAGE_SQL.format(customer=CUSTOMER_ONLY_SQL, condition=condition, cursor=cursor_sql, order=order_sql),
+            (*cursor_params, page['limit'] + 1),
+        )
+        rows, risk_pagers[bucket] = _keyset_finish(c.fetchall(), page)
+        buckets[bucket] = [
+            {
+                'username': username,
+                'full_name': full_name or '',
+                'mobile': mobile or '',
+                'trust_score': int(trust_score if trust_score is not None else 50),
+            }
+            for _id, username, full_name, mobile, trust_score in rows
+        ]
+    risk_summary = get_risk_summary(conn)
     conn.close()
 
-    blocked = []
-    frozen = []
-    low_trust = []
-    for r in rows:
-        username, full_name, mobile, is_active, join_blocked, trust_score = r
-        item = {'username': username, 'full_name': full_name or '', 'mobile': mobile or '', 'trust_score': int(trust_score if trust_score is not None else 50)}
-        if int(is_active or 1) == 0:
-            blocked.append(item)
-        if int(join_blocked or 0) == 1:
-            frozen.append(item)
-        if int(trust_score if trust_score is not None else 50) < 40:
-            low_trust.append(item)
-
     try:
         conn = get_db()
         c = conn.cursor()
-        c.execute(
-            """
-            SELECT r.id, r.username, COALESCE(u.full_name,''), COALESCE(u.mobile,''),
-                   r.group_id, COALESCE(g.name,''), COALESCE(r.monthly_amount,0), COALESCE(r.deposit_amount,0),
-                   COALESCE(r.status,''), COALESCE(r.deposit_status,''), COALESCE(r.utr,''), COALESCE(r.created_at,'')
-            FROM early_payout_requests r
-            LEFT JOIN users u ON u.username = r.username
-            LEFT JOIN groups g ON g.id = r.group_id
-            ORDER BY r.id DESC
-            LIMIT 50
-            """
-        )
+        c.execute(_OWNER_EARLY_PAYOUTS_SQL)
         req_rows = c.fetchall()
         conn.close()
     except sqlite3.OperationalError:
@@ -5322,9 +7779,11 @@ def owner_risk():
     return render_template(
         'owner_risk.html',
         active_owner_tab='risk',
-        blocked=blocked,
-        frozen=frozen,
-        low_trust=low_trust,
+        blocked=buckets['blocked'],
+        frozen=buckets['frozen'],
+        low_trust=buckets['low_trust'],
+        risk_pagers=risk_pagers,
+        risk_summary=risk_summary,
         early_payout_requests=early_payout_requests,
     )
 
@@ -5381,6 +7840,7 @@ def owner_verify_early_payout_deposit(request_id: int):
             'INSERT INTO trust_events (username, event_type, group_id, due_date, verified_at, created_at, note) VALUES (?,?,?,?,?,?,?)',
             (req_username, 'deposit_verified', group_id or None, '', _today_iso(), _today_iso(), 'Early payout security deposit verified'),
         )
+        record_trust_event(conn, req_username, c.lastrowid, 'deposit_verified', '', _today_iso())
         conn.commit()
     except sqlite3.OperationalError:
         conn.close()
@@ -5388,7 +7848,6 @@ def owner_verify_early_payout_deposit(request_id: int):
         return redirect(url_for('owner_risk'))
     conn.close()
 
-    recalculate_and_store_trust(req_username)
     flash('Deposit verified. Request moved to review.')
     return redirect(url_for('owner_risk'))
 
@@ -5443,11 +7902,15 @@ def owner_decide_early_payout(request_id: int):
 @admin_required
 def owner_settings():
     if request.method == 'POST':
-        set_setting('app_fee_amount', (request.form.get('app_fee_amount') or '').strip())
-        set_setting('group_size_limit', (request.form.get('group_size_limit') or '').strip())
-        set_setting('max_monthly_contribution', (request.form.get('max_monthly_contribution') or '').strip())
-        set_setting('company_upi_id', (request.form.get('company_upi_id') or '').strip())
-        set_setting('legal_text', (request.form.get('legal_text') or '').strip())
+        set_settings(
+            {
+                'app_fee_amount': (request.form.get('app_fee_amount') or '').strip(),
+                'group_size_limit': (request.form.get('group_size_limit') or '').strip(),
+                'max_monthly_contribution': (request.form.get('max_monthly_contribution') or '').strip(),
+                'company_upi_id': (request.form.get('company_upi_id') or '').strip(),
+                'legal_text': (request.form.get('legal_text') or '').strip(),
+            }
+        )
         flash('Settings saved.')
         return redirect(url_for('owner_settings'))
     settings = {
@@ -5478,39 +7941,35 @@ def setup():
     return redirect(url_for('home_tab'))
 
 
+_MY_GROUPS_SQL = '''
+    SELECT g.id,
+           g.name,
+           g.description,
+           g.monthly_amount,
+           COALESCE(g.max_members, 10) as max_members,
+           COALESCE(g.receiver_name, '') as receiver_name,
+           COALESCE(g.receiver_upi, '') as receiver_upi,
+           COALESCE(g.payout_receiver_username, '') as payout_receiver_username,
+           COALESCE(g.payout_receiver_name, '') as payout_receiver_name,
+           COALESCE(g.payout_receiver_upi, '') as payout_receiver_upi,
+           COALESCE(g.activated_at, '') as activated_at,
+           COALESCE(g.next_due_date, '') as next_due_date,
+           COALESCE(g.pay_cutoff_time, '') as pay_cutoff_time,
+           COALESCE(g.status, '') as group_status,
+           COALESCE(g.is_paused, 0) as is_paused,
+           COALESCE(g.joined_count, 0) as joined_members
+    FROM group_members gm
+    JOIN groups g ON g.id = gm.group_id
+    WHERE gm.username=? AND gm.status='joined'
+    GROUP BY g.id
+    ORDER BY g.monthly_amount, g.id
+'''
+
+
 def _fetch_my_groups(username: str):
     conn = get_db()
     c = conn.cursor()
-    c.execute(
-        '''
-        SELECT g.id,
-               g.name,
-               g.description,
-               g.monthly_amount,
-               COALESCE(g.max_members, 10) as max_members,
-               COALESCE(g.receiver_name, '') as receiver_name,
-               COALESCE(g.receiver_upi, '') as receiver_upi,
-               COALESCE(g.payout_receiver_username, '') as payout_receiver_username,
-               COALESCE(g.payout_receiver_name, '') as payout_receiver_name,
-               COALESCE(g.payout_receiver_upi, '') as payout_receiver_upi,
-               COALESCE(g.activated_at, '') as activated_at,
-               COALESCE(g.next_due_date, '') as next_due_date,
-               COALESCE(g.pay_cutoff_time, '') as pay_cutoff_time,
-               COALESCE(g.status, '') as group_status,
-               COALESCE(g.is_paused, 0) as is_paused,
-               COUNT(gm2.id) as joined_members
-        FROM group_members gm
-        JOIN groups g ON g.id = gm.group_id
-        LEFT JOIN group_members gm2 ON gm2.group_id = g.id AND gm2.status='joined'
-        WHERE gm.username=? AND gm.status='joined'
-        GROUP BY g.id, g.name, g.description, g.monthly_amount, g.max_members, g.receiver_name, g.receiver_upi,
-                 g.payout_receiver_username, g.payout_receiver_name, g.payout_receiver_upi,
-                 g.activated_at, g.next_due_date, g.pay_cutoff_time,
-                 g.status, g.is_paused
-        ORDER BY g.monthly_amount, g.id
-        ''',
-        (username,),
-    )
+    c.execute(_MY_GROUPS_SQL, (username,))
     rows = c.fetchall()
     conn.close()
 
@@ -5574,18 +8033,16 @@ def _fetch_available_groups(username: str):
                g.description,
                g.monthly_amount,
                COALESCE(g.max_members, 10) as max_members,
-             COUNT(gm2.id) as joined_members,
+             COALESCE(g.joined_count, 0) as joined_members,
              COALESCE(g.joining_open, 1) as joining_open,
              COALESCE(g.start_mode, 'when_full') as start_mode,
              COALESCE(g.start_date, '') as start_date,
              COALESCE(g.status, '') as status
         FROM groups g
-        LEFT JOIN group_members gm2 ON gm2.group_id = g.id AND gm2.status='joined'
         WHERE g.id NOT IN (
             SELECT group_id FROM group_members WHERE username=? AND status='joined'
         )
           AND COALESCE(g.is_paused, 0) = 0
-        GROUP BY g.id, g.name, g.description, g.monthly_amount, g.max_members
         ORDER BY g.monthly_amount, g.id
         ''',
         (username,),
@@ -5681,11 +8138,9 @@ def _customer_join_guard(conn, group_id: int, username: str):
                    COALESCE(g.start_date,''),
                    COALESCE(g.status,''),
                    COALESCE(g.activated_at,''),
-                   COUNT(gm2.id) as joined_members
+                   COALESCE(g.joined_count,0) as joined_members
             FROM groups g
-            LEFT JOIN group_members gm2 ON gm2.group_id=g.id AND gm2.status='joined'
             WHERE g.id=?
-            GROUP BY g.id
             """,
             (int(group_id or 0),),
         )
@@ -5730,6 +8185,7 @@ def _customer_join_guard(conn, group_id: int, username: str):
 
 @app.route('/home')
 @require_customer
+@conditional_page('groups', 'user')
 def home_tab():
     username = session['username']
     user = get_user_row(username)
@@ -5773,6 +8229,7 @@ def home_tab():
 
 @app.route('/groups')
 @require_customer
+@conditional_page('groups', 'user')
 def groups_tab():
     username = session['username']
     available_groups = _fetch_available_groups(username)
@@ -5857,13 +8314,25 @@ def join_group_customer():
     return redirect(url_for('groups_tab'))
 
 
+_PAYMENTS_DUE_TODAY_SQL = """
+    SELECT g.id, g.name, g.monthly_amount,
+           d.due_date, COALESCE(d.receiver_username,''), d.receiver_name, d.receiver_upi, d.pay_cutoff_time
+    FROM due_schedule d
+    JOIN group_members gm ON gm.group_id = d.group_id AND gm.username=? AND gm.status='joined'
+    JOIN groups g ON g.id = d.group_id
+    WHERE d.due_date=?
+      AND COALESCE(g.joined_count,0) >= MAX(1, COALESCE(g.max_members,10))
+    GROUP BY g.id
+    ORDER BY g.monthly_amount, g.id
+"""
+
+
 @app.route('/payments')
 @require_customer
 def payments_tab():
     username = session['username']
     user = get_user_row(username) or {}
     upi_id = (user.get('upi_id') or '').strip()
-    my_groups = _fetch_my_groups(username)
 
     conn = get_db()
     c = conn.cursor()
@@ -5878,7 +8347,7 @@ def payments_tab():
     net_amount_actual = app_fee_amount
     try:
         c.execute(
-            "SELECT gross_amount, credit_applied, net_amount FROM app_fee_payments WHERE username=? AND month=?",
+            _APP_FEE_FOR_MONTH_SQL,
             (username, month_key),
         )
         row = c.fetchone()
@@ -5899,47 +8368,32 @@ def payments_tab():
         except sqlite3.OperationalError:
             pass
 
+    today_iso = _today_iso()
+    # Full groups due today (see due_schedule) that this user belongs to.
+    try:
+        c.execute(_PAYMENTS_DUE_TODAY_SQL, (username, today_iso))
+        due_rows = c.fetchall()
+    except sqlite3.OperationalError:
+        due_rows = []
+
     conn.commit()
     conn.close()
 
     net_to_show = (net_amount_actual if app_fee_paid_this_month else max(0, int(app_fee_amount) - int(credit_preview)))
     session['nav_pay_badge'] = str(int(net_to_show)) if (not app_fee_paid_this_month and int(net_to_show) > 0) else ''
 
-    today_iso = _today_iso()
-
     pay_to = []
-    for g in my_groups:
-        # Show payment details only on the due date when a receiver is selected.
-        due_date = (g.get('next_due_date') or '').strip()
-        if not due_date or due_date != today_iso:
-            continue
-
-        # Must have reached max members (default 10)
-        try:
-            joined_members = int(g.get('joined_members') or 0)
-            max_members = int(g.get('max_members') or 10)
-        except (TypeError, ValueError):
-            joined_members = 0
-            max_members = 10
-        if joined_members < max(1, max_members):
-            continue
-
-        receiver_username = (g.get('payout_receiver_username') or '').strip()
+    for group_id, name, amount, due_date, receiver_username, receiver_name, receiver_upi, cutoff in due_rows:
+        # The receiver doesn't pay themselves.
         if receiver_username and receiver_username == username:
             continue
-
-        receiver_upi = (g.get('payout_receiver_upi') or '').strip() or (g.get('receiver_upi') or '').strip()
-        receiver_name = (g.get('payout_receiver_name') or '').strip() or (g.get('receiver_name') or '').strip() or 'Receiver'
-        amount = g.get('monthly_amount')
-        note = f"D-CONT - {g.get('name') or 'Group'}"
+        note = f"D-CONT - {name or 'Group'}"
         pay_url = ''
         if receiver_upi:
             pay_url = f"upi://pay?pa={quote(receiver_upi)}&pn={quote(receiver_name)}&am={quote(str(amount))}&tn={quote(note)}"
-
-        cutoff = (g.get('pay_cutoff_time') or '').strip() or DEFAULT_PAY_CUTOFF_TIME
         pay_to.append(
             {
-                'group': g,
+                'group': {'id': group_id, 'name': name, 'monthly_amount': amount},
                 'receiver_upi': receiver_upi,
                 'receiver_name': receiver_name,
                 'amount': amount,
@@ -5965,6 +8419,7 @@ def payments_tab():
 
 @app.route('/transactions')
 @require_customer
+@conditional_page('groups', 'user')
 def transactions_tab():
     username = session['username']
     my_groups = _fetch_my_groups(username)
@@ -6106,6 +8561,7 @@ def groups_by_amount(amount):
 
 @app.route('/group/<int:group_id>')
 @require_customer
+@conditional_page('groups', 'user')
 def group_preview(group_id):
     username = session['username']
     conn = get_db()
@@ -6247,6 +8703,10 @@ def admin_add_group():
     return redirect(url_for('owner_groups'))
 
 
+_GROUP_TRUST_USERS_SQL = 'SELECT DISTINCT username FROM trust_events WHERE group_id=?'
+_DELETE_GROUP_EARLY_PAYOUTS_SQL = 'DELETE FROM early_payout_requests WHERE group_id=?'
+
+
 @app.route('/admin/delete_group', methods=['POST'])
 @admin_required
 def admin_delete_group():
@@ -6258,16 +8718,25 @@ def admin_delete_group():
     conn = get_db()
     c = conn.cursor()
     # Best-effort cleanup: remove memberships first.
+    trust_usernames = []
     try:
+        c.execute(_GROUP_TRUST_USERS_SQL, (group_id,))
+        trust_usernames = [r[0] for r in c.fetchall()]
         c.execute('DELETE FROM trust_events WHERE group_id=?', (group_id,))
     except sqlite3.OperationalError:
         pass
     try:
-        c.execute('DELETE FROM early_payout_requests WHERE group_id=?', (group_id,))
+        c.execute(_DELETE_GROUP_EARLY_PAYOUTS_SQL, (group_id,))
     except sqlite3.OperationalError:
         pass
     c.execute('DELETE FROM group_members WHERE group_id=?', (group_id,))
     c.execute('DELETE FROM groups WHERE id=?', (group_id,))
+    if trust_usernames:
+        # Their aggregates still count the events just removed.
+        try:
+            enqueue_job(conn, 'trust_rebuild', {'usernames': trust_usernames})
+        except sqlite3.OperationalError:
+            pass
     conn.commit()
     conn.close()
     flash('Group deleted.')
@@ -6293,9 +8762,10 @@ def admin_update_membership_status():
         group_id = 0
 
     c.execute('UPDATE group_members SET status=? WHERE id=?', (new_status, membership_id))
+    _sync_group_joined_count(conn, [group_id])
 
     if new_status == 'joined' and group_id > 0:
-        _maybe_activate_group(conn, group_id)
+        _queue_group_activation(conn)
 
     conn.commit()
     conn.close()
@@ -6339,6 +8809,116 @@ def admin_toggle_user_active():
     flash('User updated.')
     return redirect(url_for('owner_users'))
 
+# --- Query plan check ---
+# The per-request queries exactly as their call sites run them: each entry uses the SQL
+# constant the code executes, with any dynamic parts filled in the way the code fills
+# them. Each must be answered through an index; `allow_scan` names tables (as aliased in
+# the query) that are walked on purpose. `flask check-query-plans` runs the check.
+def _hot_pages(id_expr: str) -> list[tuple[str, tuple[str, list, str]]]:
+    """The three keyset clauses a paged list can run: first, older and newer page."""
+    pages = {
+        'first page': {'before': None, 'after': None},
+        'older page': {'before': None, 'after': 1},
+        'newer page': {'before': 1, 'after': None},
+    }
+    return [(name, _keyset_clause(id_expr, page)) for name, page in pages.items()]
+
+
+HOT_QUERIES = [
+    ('get_user_row', _USER_ROW_SQL, ()),
+    ('mobile lookup', _CUSTOMER_BY_MOBILE_SQL, ()),
+    ('membership check', _MEMBERSHIP_SQL, ()),
+    ('has joined any group', _HAS_JOINED_ANY_GROUP_SQL, ()),
+    ('_fetch_my_groups', _MY_GROUPS_SQL, ()),
+    ('_fetch_group_members_with_trust', _GROUP_MEMBERS_WITH_TRUST_SQL, ()),
+    ('_sync_group_joined_count', _SYNC_JOINED_COUNT_SQL.format(ids='?,?'), ()),
+    ('recent trust events', _RECENT_TRUST_EVENTS_SQL, ()),
+    ('trust counts', _TRUST_COUNTS_SQL.format(where='WHERE username IN (?,?)'), ()),
+    ('trust aggregate', _TRUST_AGGREGATE_SQL, ()),
+    ('group trust events', _GROUP_TRUST_USERS_SQL, ()),
+    ('delete group early payouts', _DELETE_GROUP_EARLY_PAYOUTS_SQL, ()),
+    ('app fee for month', _APP_FEE_FOR_MONTH_SQL, ()),
+    *[
+        (f'owner_payments {name}', _OWNER_PAYMENTS_SQL.format(where=f'p.month=? AND {cursor}', order=order), ())
+        for name, (cursor, _params, order) in _hot_pages('p.id')
+    ],
+    ('app fee month total', _APP_FEE_MONTH_TOTAL_SQL, ()),
+    ('early payout requests for user', _USER_EARLY_PAYOUTS_SQL, ()),
+    ('referral credit', _REFERRAL_CREDIT_AVAILABLE_SQL, ()),
+    ('referral by new user', _REFERRAL_BY_NEW_USER_SQL, ()),
+    ('user transactions', _USER_TRANSACTIONS_SQL, ()),
+    ('auth failures by ip', _AUTH_FAILURES_BY_IP_SQL, ()),
+    ('auth failures by identifier', _AUTH_FAILURES_BY_IDENTIFIER_SQL, ()),
+    ('auth prune', _AUTH_PRUNE_SQL, ()),
+    ('owner_risk early payouts', _OWNER_EARLY_PAYOUTS_SQL, ('r',)),
+    ('due today (owner_groups)', _DUE_TODAY_GROUP_IDS_SQL, ()),
+    ('payments_tab due today', _PAYMENTS_DUE_TODAY_SQL, ()),
+    *[
+        (
+            f'owner_risk {bucket} {name}',
+            _RISK_BUCKET_PAGE_SQL.format(customer=CUSTOMER_ONLY_SQL, condition=condition, cursor=cursor, order=order),
+            (),
+        )
+        for bucket, condition in RISK_BUCKETS.items()
+        for name, (cursor, _params, order) in _hot_pages('id')
+    ],
+    *[
+        (f'risk count {bucket}', _RISK_BUCKET_COUNT_SQL.format(customer=CUSTOMER_ONLY_SQL, condition=condition), ())
+        for bucket, condition in RISK_BUCKETS.items()
+    ],
+    ('owner user search', _USER_SEARCH_FTS_SQL, ('users_fts',)),
+    ('_claim_job', _CLAIM_JOB_SQL, ()),
+    ('data versions', _DATA_VERSIONS_SQL.format(scopes='?,?,?'), ()),
+    ('referred users version', _REFERRED_USERS_VERSION_SQL, ()),
+]
+
+# One EXPLAIN QUERY PLAN row that reads a table; older SQLite says "SCAN TABLE users AS u".
+_PLAN_TABLE_ACCESS = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS (\S+))?')
+_PLAN_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\S+)')
+_PLAN_KEY_LOOKUP = re.compile(r'USING (?:INTEGER )?PRIMARY KEY|USING ROWID SEARCH')
+
+
+def _plan_row_problem(detail: str, allow_scan, partial_indexes) -> bool:
+    """True if this plan row reads a table without an index it is allowed to use.
+
+    A SEARCH must go through an index or the primary key (an AUTOMATIC index doesn't
+    count). A SCAN is only fine through a partial index, which holds just the rows the
+    query wants, or on a table listed in `allow_scan`.
+    """
+    access = _PLAN_TABLE_ACCESS.match(detail)
+    if not access:
+        return False
+    kind, table, alias = access.groups()
+    if (alias or table) in allow_scan or table in ('CONSTANT', 'SUBQUERY') or table.startswith('('):
+        return False
+    index = _PLAN_INDEX.search(detail)
+    if kind == 'SEARCH':
+        return not (index or _PLAN_KEY_LOOKUP.search(detail))
+    return not (index and index.group(1) in partial_indexes)
+
+
+def check_query_plans(conn: sqlite3.Connection) -> list[str]:
+    """Return problems: missing declared indexes and hot queries that don't use one."""
+    c = conn.cursor()
+    problems = []
+    c.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    existing = {r[0] for r in c.fetchall()}
+    for name in SCHEMA_INDEXES:
+        if name not in existing:
+            problems.append(f'missing index {name}')
+    partial = {name for name, ddl in SCHEMA_INDEXES.items() if ' WHERE ' in ddl}
+
+    for label, sql, allow_scan in HOT_QUERIES:
+        try:
+            c.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?'))
+            plan = [row[-1] for row in c.fetchall()]
+        except sqlite3.OperationalError as e:
+            problems.append(f'{label}: {e}')
+            continue
+        problems.extend(f'{label}: {detail}' for detail in plan if _plan_row_problem(detail, allow_scan, partial))
+    return problems
+
+
 if __name__ == '__main__':
     host = os.environ.get('DCONT_HOST', '127.0.0.1')
     port = int(os.environ.get('DCONT_PORT', '5000'))
@@ -0,0 +1,288 @@
+"""Shared Supabase REST client.
+
+Every Supabase call in the app goes through one pooled requests.Session per
+process, so connections are kept alive instead of doing a fresh TCP+TLS
+handshake per call. Each call gets a (connect, read) timeout; idempotent reads
+are retried with jittered backoff on connection errors and 429/5xx responses.
+
+Admin checks and cached selects are kept in a small per-process TTL+LRU cache;
+writes through insert() drop the cached reads of that table, and callers that
+change rows some other way call invalidate().
+
+Point SUPABASE_URL at a local stub HTTP server to exercise it without network.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SUPABASE_POOL_SIZE = max(1, int(os.getenv("DCONT_SUPABASE_POOL_SIZE", "10") or 10))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("DCONT_SUPABASE_CONNECT_TIMEOUT", "3.05") or 3.05)
+SUPABASE_READ_TIMEOUT = float(os.getenv("DCONT_SUPABASE_READ_TIMEOUT", "10") or 10)
+SUPABASE_READ_RETRIES = max(0, int(os.getenv("DCONT_SUPABASE_READ_RETRIES", "2") or 2))
+SUPABASE_RETRY_BACKOFF = 0.25  # seconds; doubled per attempt, full jitter
+SUPABASE_UPLOAD_CHUNK_SIZE = 64 * 1024
+SUPABASE_CACHE_TTL = max(0.0, float(os.getenv("DCONT_SUPABASE_CACHE_TTL", "30") or 30))
+SUPABASE_CACHE_MAX_ENTRIES = max(1, int(os.getenv("DCONT_SUPABASE_CACHE_MAX_ENTRIES", "512") or 512))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class _TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (hit, value)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _HashingReader:
+    """File-like wrapper that hashes and counts bytes as the HTTP layer reads them.
+
+    Defining __len__ lets requests send a Content-Length instead of chunking.
+    """
+
+    def __init__(self, stream, size, chunk_size=SUPABASE_UPLOAD_CHUNK_SIZE):
+        self.stream = stream
+        self.size = size
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._hash = hashlib.sha256()
+
+    def read(self, n=-1):
+        chunk = self.stream.read(self.chunk_size if n is None or n < 0 else n)
+        if chunk:
+            self._hash.update(chunk)
+            self.bytes_read += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __len__(self):
+        return self.size
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class SupabaseClient:
+    def __init__(
+        self,
+        url,
+        anon_key,
+        service_role_key,
+        *,
+        pool_size=SUPABASE_POOL_SIZE,
+        timeout=(SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT),
+        read_retries=SUPABASE_READ_RETRIES,
+        backoff=SUPABASE_RETRY_BACKOFF,
+        cache_ttl=SUPABASE_CACHE_TTL,
+        cache_max_entries=SUPABASE_CACHE_MAX_ENTRIES,
+    ):
+        self.url = (url or "").rstrip("/")
+        self.anon_key = anon_key or ""
+        self.service_role_key = service_role_key or ""
+        self.timeout = timeout
+        self.read_retries = read_retries
+        self.backoff = backoff
+        self.cache = _TTLCache(cache_ttl, cache_max_entries)
+
+        self.session = requests.Session()
+        # Retries are handled in request() so only idempotent calls repeat.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.service_role_key)
+
+    def _headers(self, service: bool, extra=None) -> dict:
+        key = self.service_role_key if service else self.anon_key
+        headers = {"apikey": key}
+        if service:
+            headers["Authorization"] = f"Bearer {key}"
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def request(self, method, path, *, service=True, headers=None, timeout=None, retries=None, **kwargs):
+        """Send one request; raises requests.RequestException once retries are exhausted."""
+        method = method.upper()
+        if retries is None:
+            retries = self.read_retries if method in IDEMPOTENT_METHODS else 0
+        url = f"{self.url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(
+                    method,
+                    url,
+                    headers=self._headers(service, headers),
+                    timeout=timeout or self.timeout,
+                    **kwargs,
+                )
+                if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return resp
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    # --- Auth ---
+
+    def login(self, email: str, password: str):
+        return self.request(
+            "POST",
+            "/auth/v1/token?grant_type=password",
+            service=False,
+            headers={"Content-Type": "application/json"},
+            json={"email": email, "password": password},
+        )
+
+    # --- PostgREST ---
+
+    def select(self, table: str, params: dict, *, timeout=None, retries=None, cached=False) -> list:
+        """GET /rest/v1/<table>; returns rows, or raises on a non-2xx response.
+
+        With cached=True a successful result is reused for the cache TTL.
+        """
+        key = ("select", table, tuple(sorted((str(k), str(v)) for k, v in params.items())))
+        if cached:
+            hit, rows = self.cache.get(key)
+            if hit:
+                return list(rows)
+        resp = self.request("GET", f"/rest/v1/{table}", params=params, timeout=timeout, retries=retries)
+        resp.raise_for_status()
+        rows = resp.json()
+        if cached and isinstance(rows, list):
+            self.cache.set(key, rows)
+            return list(rows)
+        return rows
+
+    def insert(self, table: str, payload: dict):
+        try:
+            return self.request(
+                "POST",
+                f"/rest/v1/{table}",
+                headers={"Content-Type": "application/json", "Prefer": "return=representation"},
+                json=payload,
+            )
+        finally:
+            # Even a failed POST may have landed; don't serve a listing that predates it.
+            self.invalidate(table)
+
+    def update(self, table: str, params: dict, payload: dict):
+        """PATCH the rows of `table` matching the PostgREST filters in `params`."""
+        try:
+            return self.request(
+                "PATCH",
+                f"/rest/v1/{table}",
+                params=params,
+                headers={"Content-Type": "application/json"},
+                json=payload,
+            )
+        finally:
+            self.invalidate(table)
+
+    def is_admin(self, user_id: str) -> bool:
+        key = ("is_admin", str(user_id))
+        hit, value = self.cache.get(key)
+        if hit:
+            return value
+        resp = self.request("GET", "/rest/v1/profiles", params={"id": f"eq.{user_id}", "select": "is_admin"})
+        if not resp.ok:
+            print("[ADMIN CHECK ERROR]", resp.status_code, resp.text)
+            return False
+        rows = resp.json()
+        value = bool(rows and rows[0].get("is_admin") is True)
+        self.cache.set(key, value)
+        return value
+
+    def invalidate(self, table: str = None, user_id: str = None):
+        """Drop cached reads: every select on `table`, and/or the admin flag of `user_id`."""
+        if table is not None:
+            self.cache.discard_where(lambda k: k[0] == "select" and k[1] == table)
+        if user_id is not None:
+            self.cache.discard_where(lambda k: k == ("is_admin", str(user_id)))
+
+    # --- Storage ---
+
+    def upload_stream(self, bucket: str, path: str, stream, content_type: str, *, size=None, upsert: bool = True):
+        """PUT a file-like object to Storage in chunks without buffering it.
+
+        Returns (response, sha256 hex digest, bytes sent). With size=None the body
+        goes out with chunked transfer encoding. PUTs are never retried, so the
+        stream is only read once.
+        """
+        reader = _HashingReader(stream, size)
+        resp = self.request(
+            "PUT",
+            f"/storage/v1/object/{bucket}/{path}",
+            headers={"Content-Type": content_type, "x-upsert": "true" if upsert else "false"},
+            data=reader if size is not None else iter(reader),
+        )
+        return resp, reader.hexdigest(), reader.bytes_read
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_supabase_client() -> SupabaseClient:
+    """The process-wide client, built from SUPABASE_* env vars on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SupabaseClient(
+                    os.getenv("SUPABASE_URL"),
+                    os.getenv("SUPABASE_ANON_KEY"),
+                    os.getenv("SUPABASE_SERVICE_ROLE_KEY"),
+                )
+    return _client